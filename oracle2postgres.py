@@ -1,16 +1,43 @@
 # Import libraries
+import os
 import sys
 import logging
-from datetime import datetime
+import pickle
+import hashlib
+import math
+import time
+import json
+import csv
+import gzip
+import shutil
+import queue
+import threading
+import collections
+import functools
+import asyncio
+import concurrent.futures
+import socket
+from datetime import datetime, date, timedelta
+from decimal import Decimal
 import multiprocessing
+import multiprocessing.pool
+import io
+import numpy as np
 import pandas as pd
 import sqlalchemy
 from sqlalchemy.orm import sessionmaker
 import cx_Oracle
 import psycopg2
+import psycopg2.extras
 import readline # support use of cursors in user input
 import getpass
 
+# optional async Postgres driver for the asyncio copy engine
+try:
+    import asyncpg
+except ImportError:
+    asyncpg = None
+
 def create_logfile(fn='migration.log'):
     """
     Create a log file (record info status and above)
@@ -116,10 +143,64 @@ def get_migration_config():
     else:
         config['trialrun'] = False
 
-    # max size of migration chunk
-    config['batchsize'] = int(input("- Number of rows per batch (default '300000'): ") or 300000)
+    # max size of migration chunk. by default, sized within the memory budget.
+    config['batchsize'] = input("- Number of rows per batch (leave empty to size batches automatically): ") or None
+    if config['batchsize']:
+        config['batchsize'] = int(config['batchsize'])
     if config['trialrun']:
-        config['batchsize'] = min(config['batchsize'],100)
+        config['batchsize'] = min(config['batchsize'] or 100,100)
+
+    # reflect each schema once and share the metadata between stages
+    config['metadata_cache'] = input("- Directory for cached schema metadata, or 'none' (default '.metadata_cache'): ") or ".metadata_cache"
+    if config['metadata_cache'].lower() == 'none':
+        config['metadata_cache'] = None
+
+    # how to page through the source tables
+    config['paging'] = input("- Paging, 'cursor' (one streamed query per table) or 'rowid' (ROWID extent ranges) (default 'cursor'): ") or "cursor"
+    config['paging'] = config['paging'].lower()
+    if config['paging'] not in ('cursor','rowid'):
+        sys.exit("Paging must be 'cursor' or 'rowid'.")
+
+    # read the next batch while the last batch is written
+    pipeline = input("- Read and write batches in parallel threads, y or n (default 'y'): ") or "y"
+    if pipeline.lower() == "y":
+        config['pipeline'] = True
+    else:
+        config['pipeline'] = False
+    config['memory_budget_mb'] = int(input("- Memory budget for batches per process in MB (default '1024'): ") or 1024)
+
+    # encode batches column by column
+    columnar = input("- Encode each batch column by column with numpy (faster for numeric tables), y or n (default 'n'): ") or "n"
+    if columnar.lower() == "y":
+        config['columnar'] = True
+    else:
+        config['columnar'] = False
+
+    # fetch small LOBs with the row, and stream large LOBs in pieces
+    config['lob_inline_kb'] = input("- Fetch LOBs up to this many KB with the row, and stream larger LOBs, or 'none' to fetch all LOBs with the row (default '64'): ") or "64"
+    if config['lob_inline_kb'].lower() == 'none':
+        config['lob_inline_kb'] = None
+    else:
+        config['lob_inline_kb'] = int(config['lob_inline_kb'])
+
+    # record progress so that an interrupted migration can be resumed
+    checkpoint = input("- Record checkpoints so the migration can be resumed (reads each table in sorted ROWID ranges), y or n (default 'y'): ") or "y"
+    if checkpoint.lower() == "y":
+        config['checkpoint'] = True
+    else:
+        config['checkpoint'] = False
+
+    # remove null characters from strings as they are copied
+    strip_nulls = input("- Strip null characters from strings during the copy (the source is not modified), y or n (default 'n'): ") or "n"
+    if strip_nulls.lower() == "y":
+        config['strip_nulls'] = True
+    else:
+        config['strip_nulls'] = False
+
+    # throughput metrics
+    config['metrics_dir'] = input("- Directory for throughput metrics, or 'none' (default 'metrics'): ") or "metrics"
+    if config['metrics_dir'].lower() == 'none':
+        config['metrics_dir'] = None
 
     # disable logging for faster migration
     disable_log = input('- Disable logging (requires Postgres 9.5 or later), y or n (default "y"): ') or "y"
@@ -128,94 +209,211 @@ def get_migration_config():
     else:
         config['logged'] = True
 
+    # method used to load data into the target
+    config['load_method'] = input("- Load method, 'copy' or 'insert' (default 'copy'): ") or "copy"
+    config['load_method'] = config['load_method'].lower()
+    if config['load_method'] not in ('copy','insert'):
+        sys.exit("Load method must be 'copy' or 'insert'.")
+
+    # load whole tables already frozen, in place of disabling logging
+    freeze = input("- Load each table in one transaction with TRUNCATE and COPY FREEZE (little WAL with wal_level=minimal), y or n (default 'n'): ") or "n"
+    if freeze.lower() == "y":
+        config['freeze'] = True
+    else:
+        config['freeze'] = False
+
     # run with multiprocessing
     multiprocess = input("- Run multiple processes, y or n (default 'n'): ") or "n"
     if multiprocess.lower() == "y":
         config['multiprocess'] = True
-        config['processes'] = input("- Number of processes (leave empty to assign automatically): ") or None
+        config['processes'] = int(input("- Number of processes (leave empty to assign automatically): ") or 0) or None
     else:
         config['multiprocess'] = False
         config['processes'] = None
 
+    # copy many tables at once in a single process
+    config['concurrency'] = int(input("- Concurrent copies in a single process with asyncio, or 0 to use processes (default '0'): ") or 0)
+
+    # rebuild keys and indexes after the load
+    config['index_processes'] = int(input("- Processes for building keys and indexes after the load (default '4'): ") or 4)
+    config['maintenance_work_mem'] = input("- maintenance_work_mem for building keys and indexes (default '1GB'): ") or '1GB'
+    config['max_parallel_maintenance_workers'] = int(input("- max_parallel_maintenance_workers for building indexes (default '2'): ") or 2)
+
+    # map oracle numbers to narrower postgres types
+    config['number_types'] = input("- Number types, 'numeric' (all NUMERIC), 'declared' (narrow by declared precision) or 'profile' (also scan the data) (default 'declared'): ") or "declared"
+    config['number_types'] = config['number_types'].lower()
+    if config['number_types'] not in ('numeric','declared','profile'):
+        sys.exit("Number types must be 'numeric', 'declared' or 'profile'.")
+    config['type_report'] = input("- File for the report of number types, or 'none' (default 'number_types.csv'): ") or "number_types.csv"
+    if config['type_report'].lower() == 'none':
+        config['type_report'] = None
+
+    # recreate partitioned tables and copy each partition separately
+    partitions = input("- Create partitioned tables as partitioned tables and copy each partition separately, y or n (default 'y'): ") or "y"
+    if partitions.lower() == "y":
+        config['partitions'] = True
+    else:
+        config['partitions'] = False
+
+    # split large tables into chunks that are copied in parallel
+    config['split_threshold_mb'] = int(input("- Split tables larger than this many MB into chunks (default '2048', 0 to disable): ") or 2048)
+    config['table_chunks'] = _clean_table_settings(input("- Chunk counts for specific tables e.g. 's1.t1:16,s1.t2:8' (default none): ") or None,int)
+
+    # track changes for incremental catch-up passes after the bulk load
+    delta = input("- Record high-water marks for delta sync passes, y or n (default 'n'): ") or "n"
+    if delta.lower() == "y":
+        config['delta'] = True
+        config['delta_columns'] = _clean_table_settings(input("- Last-modified columns e.g. 's1.t1:updated_at' (default ORA_ROWSCN): ") or None)
+    else:
+        config['delta'] = False
+        config['delta_columns'] = {}
+
     msg = '''
     Trialrun: {}
-    Batchsize: {}
+    Batchsize (None = automatic): {}
+    Metadata cache: {}
+    Paging: {}
+    Pipeline: {}
+    Memory budget (MB): {}
+    Columnar encoding: {}
+    Inline LOBs up to (KB): {}
+    Checkpoint: {}
+    Strip null characters: {}
+    Metrics directory: {}
     Database logging (False = disabled): {}
+    Load method: {}
+    COPY FREEZE: {}
     Multiprocess: {}
-    '''.format(config['trialrun'], config['batchsize'], config['logged'],
-        config['multiprocess'])
+    Async concurrency (0 = disabled): {}
+    Key and index processes: {}
+    maintenance_work_mem: {}
+    max_parallel_maintenance_workers: {}
+    Number types: {}
+    Number type report: {}
+    Partitions: {}
+    Split tables larger than (MB): {}
+    Table chunks: {}
+    Delta sync: {}
+    Last-modified columns: {}
+    '''.format(config['trialrun'], config['batchsize'], config['metadata_cache'], config['paging'],
+        config['pipeline'], config['memory_budget_mb'], config['columnar'], config['lob_inline_kb'], config['checkpoint'],
+        config['strip_nulls'], config['metrics_dir'], config['logged'], config['load_method'], config['freeze'], config['multiprocess'],
+        config['concurrency'], config['index_processes'], config['maintenance_work_mem'], config['max_parallel_maintenance_workers'],
+        config['number_types'], config['type_report'], config['partitions'],
+        config['split_threshold_mb'], config['table_chunks'], config['delta'],
+        config['delta_columns'])
 
     print(msg)
     logging.info(msg)    
 
     return config
 
-def check_for_nulls(engine,schema_list,remove=False):
+def check_for_nulls(engine,schema_list,remove=False,processes=4,cache_dir=None):
     """
-    Check for null characters in strings.
+    Check for null characters in strings. Each table is checked with a 
+    single scan of all of its character columns, and several tables are 
+    checked at the same time.
 
     Args:
         engine (obj): Database engine.
         schema_list (list): List of schema to remove.
         remove (bool): Remove null characters, if found. Default False.
+        processes (int): Number of tables to check at the same time. Default 4.
+        cache_dir (str): Directory of cached metadata, see cache_metadata.
     """
     msg = "Checking source database for nulls in strings."
     logging.info(msg)
-    null_list = []
-    con = engine.connect()
 
+    tables = []
     for source_schema in schema_list:
-        source_metadata = sqlalchemy.MetaData(engine,quote_schema=True)
-        source_metadata.reflect(schema=source_schema)
+        source_metadata = _reflect_schema(engine,source_schema,cache_dir)
+        tables.extend([t for t in source_metadata.sorted_tables if t.schema == source_schema])
 
-        # iterate the tables
-        for t in source_metadata.sorted_tables:
-            for col in t.columns:
-                try:
-                    result = t.select().where(col.like('%' + chr(0) + '%')).execute()
-                    nulls = result.fetchone()
-                except:
-                    nulls = None
-                if nulls and len(nulls):
-                    msg = "Null characters found in: {}.{}.{}".format(source_schema,
-                        t.name,col.name)
-                    logging.info(msg)
-                    null_list.append('{}.{}.{}'.format(source_schema,t.name,col.name))
-                    if remove:
-                        # remove them
-                        t.update().values({col:sqlalchemy.func.replace(col,chr(0),
-                            '')}).where(col.like('%' + chr(0) + '%')).execute()
-                        con.execute("COMMIT")
-                        msg = "Null characters removed from {}.{}.{}".format(source_schema,
-                            t.name,col.name)
-                        logging.info(msg)
+    # the checks wait on the database, so threads are sufficient
+    pool = multiprocessing.pool.ThreadPool(processes)
+    null_list = sum(pool.map(lambda t: _find_nulls(engine,t,remove),tables,chunksize=1),[])
+    pool.close()
+    pool.join()
 
     if null_list and not remove:
         msg = "Null chars must be removed from: {}".format(null_list)
-        con.close()
         logging.info(msg)
         sys.exit(msg)
 
-    con.close()
+def _find_nulls(engine,table,remove=False):
+    """
+    Find the character columns of a table that contain null characters, 
+    in a single scan of the table. Returns a list of 'schema.table.column'.
+
+    Args:
+        engine (obj): Database engine.
+        table (obj): SQLAlchemy table object.
+        remove (bool): Remove null characters, if found. Default False.
+    """
+    columns = [col for col in table.columns if isinstance(col.type,sqlalchemy.types.String)]
+    if not columns:
+        return []
+
+    preparer = engine.dialect.identifier_preparer
+    checks = ', '.join(["MAX(CASE WHEN INSTR({}, CHR(0)) > 0 THEN 1 ELSE 0 END)".format(preparer.format_column(col)) 
+        for col in columns])
+    query = "SELECT {} FROM {}".format(checks,preparer.format_table(table))
+    try:
+        flags = engine.execute(query).fetchone()
+    except:
+        msg = "Unable to check {}.{} for null characters".format(table.schema,table.name)
+        logging.error(msg)
+        return []
+
+    null_list = []
+    for col, flag in zip(columns,flags):
+        if not flag:
+            continue
+        msg = "Null characters found in: {}.{}.{}".format(table.schema,
+            table.name,col.name)
+        logging.info(msg)
+        null_list.append('{}.{}.{}'.format(table.schema,table.name,col.name))
+        if remove:
+            # remove them
+            con = engine.connect()
+            con.execute(table.update().values({col:sqlalchemy.func.replace(col,chr(0),
+                '')}).where(col.like('%' + chr(0) + '%')))
+            con.execute("COMMIT")
+            con.close()
+            msg = "Null characters removed from {}.{}.{}".format(table.schema,
+                table.name,col.name)
+            logging.info(msg)
+
+    return null_list
 
 def connect_to_source(config):
     """
-    Connect to source database.
+    Connect to source database. If the settings include a 'url', it is used 
+    in place of the Oracle connection settings, e.g. to point the migration
+    at a local stand-in for benchmarking. Any 'engine_args' are passed to
+    sqlalchemy.create_engine.
 
     Args:
         config (dict): Settings for the source database.
     """
     print_log = False
 
+    if config.get('url'):
+        return sqlalchemy.create_engine(config['url'], echo = print_log,
+            **config.get('engine_args',{}))
+
     dsn_str = cx_Oracle.makedsn(config['host'],config['port'],service_name=config['database'])
     con_string = 'oracle://{}:{}@'.format(config['username'], config['password']) + dsn_str
-    engine = sqlalchemy.create_engine(con_string, echo = print_log)
+    engine = sqlalchemy.create_engine(con_string, echo = print_log,
+        **config.get('engine_args',{}))
 
     return engine
 
 def connect_to_target(config,dbname=None):
     """
-    Connect to target database.
+    Connect to target database. If the settings include a 'url', it is 
+    used in place of the other connection settings and dbname. Any 
+    'engine_args' are passed to sqlalchemy.create_engine.
 
     Args:
         config (dict): Settings for the target database.
@@ -223,6 +421,10 @@ def connect_to_target(config,dbname=None):
     """
     print_log = False
 
+    if config.get('url'):
+        return sqlalchemy.create_engine(config['url'], echo = print_log,
+            **config.get('engine_args',{}))
+
     if dbname:
         con_string = 'postgresql+psycopg2://{}:{}@{}:{}/{}'.format(config['username'], 
             config['password'], config['host'], config['port'], dbname)
@@ -230,10 +432,56 @@ def connect_to_target(config,dbname=None):
         con_string = 'postgresql+psycopg2://{}:{}@{}:{}'.format(config['username'], 
             config['password'], config['host'], config['port'])
 
-    engine = sqlalchemy.create_engine(con_string, echo = print_log)
+    engine = sqlalchemy.create_engine(con_string, echo = print_log,
+        **config.get('engine_args',{}))
 
     return engine
 
+# engines of this process, reused by its work items. see _get_engine.
+_engines = {}
+
+def _get_engine(config,dbname=None,target=False):
+    """
+    Get an engine for the source or target database that is shared by 
+    every work item in this process, so that connections are kept in its 
+    pool and reused from table to table. Connections are pinged when they 
+    are checked out of the pool, and replaced if they have been dropped.
+    Work items that fail discard their connections instead of returning
+    them to the pool. Target connections are set up for loading when they are opened, see 
+    _set_target_session.
+
+    Args:
+        config (dict): Settings for the database.
+        dbname (str): Name of target database.
+        target (bool): True for the target database, False for the source.
+    """
+    # engines are not shared with forked processes
+    key = (os.getpid(),target,dbname,json.dumps(config,sort_keys=True,default=str))
+    if key not in _engines:
+        config = dict(config,engine_args=dict(config.get('engine_args',{}),pool_pre_ping=True))
+        if target:
+            engine = connect_to_target(config,dbname)
+            sqlalchemy.event.listen(engine,'connect',_set_target_session)
+        else:
+            engine = connect_to_source(config)
+        _engines[key] = engine
+
+    return _engines[key]
+
+def _set_target_session(dbapi_connection,connection_record):
+    """
+    Set up a new target connection for loading, once for the life of the
+    connection: integrity checks (triggers and foreign keys) are disabled.
+
+    Args:
+        dbapi_connection (obj): psycopg2 connection.
+        connection_record (obj): SQLAlchemy connection record.
+    """
+    cursor = dbapi_connection.cursor()
+    cursor.execute("SET session_replication_role = replica;")
+    cursor.close()
+    dbapi_connection.commit()
+
 def _clean_list(schema_list):
     """
     check the list of schema is a valid list
@@ -247,6 +495,22 @@ def _clean_list(schema_list):
         pass
     return cleaned
 
+def _clean_table_settings(settings,convert=str):
+    """
+    Convert a string of per table settings e.g. 's1.t1:16,s1.t2:8' to a 
+    dict keyed on lower case 'schema.table'.
+
+    Args:
+        settings (str): Comma separated list of table:value pairs.
+        convert (obj): Function applied to each value. Default str.
+    """
+    cleaned = {}
+    if settings:
+        for item in _clean_list(settings):
+            name, value = item.rsplit(':',1)
+            cleaned[name.strip().lower()] = convert(value.strip())
+    return cleaned
+
 def check_schema_exist(engine,schema_list):
     """
     Check the schema are present on the source database
@@ -272,30 +536,511 @@ def check_schema_exist(engine,schema_list):
 
     return schema_list
 
-def _migrate_data(schema,source_config,target_config,migration_config):
+# change when the cached metadata format changes
+_METADATA_CACHE_VERSION = 1
+
+# metadata loaded from the cache by this process, keyed on file path
+_loaded_metadata = {}
+
+def _get_metadata_cache_path(engine,schema,cache_dir):
+    """
+    Path of the cache file for a schema. The name includes a hash of the
+    cache version, the SQLAlchemy version and the database URL, so stale 
+    formats and other databases are never read.
+
+    Args:
+        engine (obj): Database engine.
+        schema (str): Name of schema.
+        cache_dir (str): Directory of cached metadata.
+    """
+    key = '{}|{}|{}|{}'.format(_METADATA_CACHE_VERSION,sqlalchemy.__version__,
+        repr(engine.url),schema)
+    digest = hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+    return os.path.join(cache_dir,'{}_{}.pickle'.format(schema,digest))
+
+def _reflect_schema(engine,schema,cache_dir=None,refresh=False):
+    """
+    Reflect the metadata of a schema. If cache_dir is given, the metadata 
+    is loaded from the cache, or reflected and saved to the cache if it is
+    missing. Returns a new MetaData object bound to the engine, which the 
+    caller may modify.
+
+    Args:
+        engine (obj): Database engine.
+        schema (str): Name of schema.
+        cache_dir (str): Directory of cached metadata. Default None (no cache).
+        refresh (bool): Reflect the schema even if it is in the cache.
+    """
+    if cache_dir:
+        path = _get_metadata_cache_path(engine,schema,cache_dir)
+        if not refresh and os.path.exists(path):
+            try:
+                with open(path,'rb') as f:
+                    cached = pickle.load(f)
+                if cached['version'] == _METADATA_CACHE_VERSION:
+                    metadata = cached['metadata']
+                    metadata.bind = engine
+                    return metadata
+            except Exception as e:
+                msg = "Unable to read cached metadata for {}: {}".format(schema,e)
+                logging.info(msg)
+
+    metadata = sqlalchemy.MetaData(engine,quote_schema=True)
+    metadata.reflect(schema=schema)
+
+    if cache_dir:
+        # write to a temporary file first, as other processes may be reading
+        os.makedirs(cache_dir,exist_ok=True)
+        cached = {'version': _METADATA_CACHE_VERSION, 'schema': schema,
+            'created': datetime.now(), 'metadata': metadata}
+        temp_path = '{}.{}.tmp'.format(path,os.getpid())
+        with open(temp_path,'wb') as f:
+            pickle.dump(cached,f,protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path,path)
+        msg = "Cached metadata for {} in {}".format(schema,path)
+        logging.info(msg)
+
+    return metadata
+
+def _get_table(engine,schema,table_name,cache_dir=None):
+    """
+    Get the metadata of a single source table. With a cache, the schema 
+    metadata is loaded once per process and shared, so the table must not
+    be modified. Without a cache, only the table is reflected.
+
+    Args:
+        engine (obj): Database engine.
+        schema (str): Name of schema.
+        table_name (str): Name of table.
+        cache_dir (str): Directory of cached metadata. Default None (no cache).
+    """
+    if not cache_dir:
+        metadata = sqlalchemy.MetaData(engine)
+        return sqlalchemy.Table(table_name,metadata,schema=schema,autoload=True)
+
+    path = _get_metadata_cache_path(engine,schema,cache_dir)
+    if path not in _loaded_metadata:
+        _loaded_metadata[path] = _reflect_schema(engine,schema,cache_dir)
+    metadata = _loaded_metadata[path]
+    metadata.bind = engine
+
+    return metadata.tables['{}.{}'.format(schema,table_name)]
+
+def cache_metadata(engine,schema_list,cache_dir):
+    """
+    Reflect the source schema and save the metadata to the cache, replacing 
+    any earlier cache. Run at the start of a migration so that every stage
+    and process loads the metadata from disk rather than reflecting it.
+
+    Args:
+        engine (obj): Database engine.
+        schema_list (list): List of schema.
+        cache_dir (str): Directory of cached metadata.
+    """
+    msg = 'Caching schema metadata in {}...\n'.format(cache_dir)
+    print(msg)
+    for schema in schema_list:
+        _reflect_schema(engine,schema,cache_dir,refresh=True)
+    _loaded_metadata.clear()
+
+def _get_table_sizes(engine,schema):
+    """
+    Get the approximate size in bytes of each table in a schema. Uses the
+    segment sizes in DBA_SEGMENTS if they are accessible, otherwise the 
+    optimizer statistics in ALL_TABLES (NUM_ROWS * AVG_ROW_LEN).
+
+    Args:
+        engine (obj): Database engine.
+        schema (str): Name of the schema.
+    """
+    queries = ["""SELECT segment_name, SUM(bytes) 
+                  FROM dba_segments 
+                  WHERE owner = :owner 
+                      AND segment_type IN ('TABLE','TABLE PARTITION','TABLE SUBPARTITION')
+                  GROUP BY segment_name""",
+               """SELECT table_name, NVL(num_rows,0) * NVL(avg_row_len,0)
+                  FROM all_tables 
+                  WHERE owner = :owner"""]
+    for query in queries:
+        try:
+            result = engine.execute(sqlalchemy.text(query),owner=schema.upper())
+            return {name.lower(): int(size or 0) for name, size in result}
+        except:
+            pass
+
+    msg = "Unable to get table sizes for {}. Tables will be copied in name order.".format(schema)
+    logging.info(msg)
+    return {}
+
+# oracle partitioning methods that can be recreated in postgres
+_PARTITION_METHODS = ('RANGE','LIST','HASH')
+
+def _get_partitions(engine,schema,table_name=None):
+    """
+    Get the partitioning of the partitioned tables in a schema from 
+    ALL_PART_TABLES and ALL_TAB_PARTITIONS. Returns a dict of table name to
+    a dict with the partitioning 'method' (e.g. 'RANGE'), the key 
+    'columns' and the 'partitions' as a list of (name, high value, size) 
+    in partition order. Returns an empty dict if the dictionary views are 
+    not accessible (e.g. the source is not Oracle).
+
+    Args:
+        engine (obj): Database engine.
+        schema (str): Name of the schema.
+        table_name (str): Only get the partitioning of this table.
+    """
+    tables = """SELECT t.table_name, t.partitioning_type, c.column_name
+                FROM all_part_tables t, all_part_key_columns c
+                WHERE t.owner = :owner 
+                    AND c.owner = t.owner AND c.name = t.table_name 
+                    AND c.object_type = 'TABLE'
+                    AND (:table_name IS NULL OR t.table_name = :table_name)
+                ORDER BY t.table_name, c.column_position"""
+    # size of each partition segment, or its statistics if the segment 
+    # sizes are not accessible or the partition has subpartitions
+    sizes = ["""NVL((SELECT SUM(s.bytes) FROM dba_segments s 
+                     WHERE s.owner = p.table_owner AND s.segment_name = p.table_name 
+                         AND s.partition_name = p.partition_name),
+                    NVL(p.num_rows,0) * NVL(p.avg_row_len,0))""",
+             "NVL(p.num_rows,0) * NVL(p.avg_row_len,0)"]
+    partitions = """SELECT p.table_name, p.partition_name, p.high_value, {}
+                    FROM all_tab_partitions p
+                    WHERE p.table_owner = :owner
+                        AND (:table_name IS NULL OR p.table_name = :table_name)
+                    ORDER BY p.table_name, p.partition_position"""
+    params = {'owner': schema.upper(), 'table_name': table_name.upper() if table_name else None}
+
+    partitioning = {}
+    try:
+        for name, method, column in engine.execute(sqlalchemy.text(tables),**params):
+            info = partitioning.setdefault(name.lower(),{'method': method, 
+                'columns': [], 'partitions': []})
+            info['columns'].append(column.lower())
+    except:
+        return {}
+
+    for size in sizes:
+        try:
+            rows = engine.execute(sqlalchemy.text(partitions.format(size)),**params).fetchall()
+            break
+        except:
+            rows = []
+    for name, partition, high_value, size in rows:
+        if name.lower() in partitioning:
+            partitioning[name.lower()]['partitions'].append((partition,high_value,int(size or 0)))
+
+    return partitioning
+
+def _get_work_items(engine,schema_list):
     """
-    Migrate the data from the source tables to the target tables
+    Create a list of (schema, table, size) work items for the migration,
+    ordered largest first so that the biggest tables start early and the
+    small tables fill the gaps at the end of the run.
 
     Args:
-        schema (str): Name of schema to migrate.
+        engine (obj): Database engine.
+        schema_list (list): List of schema.
+    """
+    inspector = sqlalchemy.inspect(engine)
+    work_items = []
+    for schema in schema_list:
+        sizes = _get_table_sizes(engine,schema)
+        for table_name in inspector.get_table_names(schema=schema):
+            work_items.append((schema,table_name,sizes.get(table_name.lower(),0)))
+
+    work_items.sort(key=lambda x: x[2],reverse=True)
+
+    return work_items
+
+def _split_work_items(engine,work_items,migration_config):
+    """
+    Split the work items for large tables into ROWID range chunks, so that 
+    several workers can copy one table at the same time. Returns a list of
+    (schema, table, size, rowid_range, partition) work items, ordered 
+    largest first. Partitioned tables are split into their partitions if
+    'partitions' is set. Other tables are split if they are larger than 
+    'split_threshold_mb', into chunks of about that size, or into the 
+    number of chunks given for the table in 'table_chunks'.
+
+    Args:
+        engine (obj): Database engine.
+        work_items (list): List of (schema, table, size) work items.
+        migration_config (dict): Settings for the migration.
+    """
+    threshold = migration_config.get('split_threshold_mb',0) * 1024 * 1024
+    table_chunks = migration_config.get('table_chunks') or {}
+
+    partitioning = {}
+    if migration_config.get('partitions',False):
+        for schema in set([x[0] for x in work_items]):
+            for table_name, info in _get_partitions(engine,schema).items():
+                partitioning[(schema,table_name)] = info
+
+    split_items = []
+    for schema, table_name, size in work_items:
+        info = partitioning.get((schema,table_name.lower()))
+        if info and info['partitions']:
+            for partition, high_value, partition_size in info['partitions']:
+                split_items.append((schema,table_name,partition_size,None,partition))
+            continue
+
+        chunks = table_chunks.get('{}.{}'.format(schema,table_name).lower())
+        if not chunks and threshold and size > threshold:
+            chunks = int(math.ceil(float(size) / threshold))
+
+        if chunks and chunks > 1:
+            rowid_ranges = _get_rowid_ranges(engine,schema,table_name,chunks)
+        else:
+            rowid_ranges = [None]
+
+        for rowid_range in rowid_ranges:
+            split_items.append((schema,table_name,size // len(rowid_ranges),rowid_range,None))
+
+    split_items.sort(key=lambda x: x[2],reverse=True)
+
+    return split_items
+
+# schema on the target database for tables that control the migration
+_CONTROL_SCHEMA = 'oracle2postgres_control'
+
+def _create_checkpoints(engine,work_items):
+    """
+    Create the checkpoint table on the target database and record the work
+    items for a new migration, replacing any earlier checkpoints.
+
+    Args:
+        engine (obj): Database engine.
+        work_items (list): List of (schema, table, size, rowid_range, 
+            partition) items.
+    """
+    con = engine.connect()
+    trans = con.begin()
+    con.execute("CREATE SCHEMA IF NOT EXISTS {}".format(_CONTROL_SCHEMA))
+    con.execute("DROP TABLE IF EXISTS {}.checkpoint".format(_CONTROL_SCHEMA))
+    con.execute("""
+        CREATE TABLE {}.checkpoint (
+            schema_name TEXT NOT NULL,
+            table_name TEXT NOT NULL,
+            partition_name TEXT NOT NULL DEFAULT '',
+            lo_rowid TEXT NOT NULL DEFAULT '',
+            hi_rowid TEXT NOT NULL DEFAULT '',
+            size_bytes BIGINT NOT NULL DEFAULT 0,
+            status TEXT NOT NULL DEFAULT 'pending',
+            last_rowid TEXT,
+            rows_copied BIGINT NOT NULL DEFAULT 0,
+            updated_at TIMESTAMP,
+            worker TEXT,
+            lease_until TIMESTAMPTZ,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (schema_name, table_name, partition_name, lo_rowid, hi_rowid))""".format(_CONTROL_SCHEMA))
+    query = """INSERT INTO {}.checkpoint (schema_name, table_name, partition_name, lo_rowid, hi_rowid, size_bytes)
+               VALUES (:schema_name, :table_name, :partition_name, :lo_rowid, :hi_rowid, :size_bytes)""".format(_CONTROL_SCHEMA)
+    for schema, table_name, size, rowid_range, partition in work_items:
+        lo_rowid, hi_rowid = rowid_range or ('','')
+        con.execute(sqlalchemy.text(query),schema_name=schema,table_name=table_name,
+            partition_name=partition or '',lo_rowid=lo_rowid,hi_rowid=hi_rowid,size_bytes=size)
+    trans.commit()
+    con.close()
+
+def _get_checkpoints(engine):
+    """
+    Get the unfinished work items of an earlier migration from the 
+    checkpoint table, as a list of (schema, table, size, rowid_range, 
+    partition, last_rowid), largest first. Checkpoints of tables that have since 
+    been emptied (e.g. unlogged tables after a crash of the target 
+    server) are reset first.
+
+    Args:
+        engine (obj): Database engine.
+    """
+    query = """SELECT schema_name, table_name, SUM(rows_copied) 
+               FROM {}.checkpoint 
+               GROUP BY schema_name, table_name
+               HAVING SUM(rows_copied) > 0""".format(_CONTROL_SCHEMA)
+    try:
+        copied = engine.execute(query).fetchall()
+    except:
+        msg = "No checkpoints found on the target database. Unable to resume."
+        logging.info(msg)
+        sys.exit(msg)
+
+    for schema, table_name, rows in copied:
+        if engine.execute('SELECT 1 FROM {}."{}" LIMIT 1'.format(schema,table_name)).fetchone():
+            continue
+        msg = "{}.{} is empty on the target. Restarting the table.".format(schema,table_name)
+        logging.info(msg)
+        engine.execute(sqlalchemy.text("""
+            UPDATE {}.checkpoint 
+            SET status = 'pending', last_rowid = NULL, rows_copied = 0
+            WHERE schema_name = :schema_name AND table_name = :table_name""".format(_CONTROL_SCHEMA)),
+            schema_name=schema,table_name=table_name)
+
+    query = """SELECT schema_name, table_name, size_bytes, lo_rowid, hi_rowid, partition_name, 
+                   last_rowid
+               FROM {}.checkpoint 
+               WHERE status <> 'done'
+               ORDER BY size_bytes DESC""".format(_CONTROL_SCHEMA)
+    work_items = []
+    for schema, table_name, size, lo_rowid, hi_rowid, partition, last_rowid in engine.execute(query):
+        rowid_range = (lo_rowid,hi_rowid) if lo_rowid else None
+        work_items.append((schema,table_name,size,rowid_range,partition or None,last_rowid))
+
+    return work_items
+
+class _LeaseLost(Exception):
+    """
+    Raised when a distributed worker no longer holds its work item, e.g. 
+    its lease expired and another worker claimed the item.
+    """
+
+def _save_checkpoint(target_connection,schema,table_name,rowid_range,last_rowid=None,
+    rows=0,status='running',partition=None,owner=None):
+    """
+    Record the progress of a work item in the checkpoint table. The caller
+    commits the connection. With owner, raises _LeaseLost if the item is 
+    held by another worker, so the caller can roll back the rows written 
+    with the checkpoint.
+
+    Args:
+        target_connection (obj): psycopg2 connection.
+        schema (str): Name of schema.
+        table_name (str): Name of table.
+        rowid_range (tuple): First and last ROWID of the work item, or None.
+        last_rowid (str): Last ROWID copied.
+        rows (int): Number of rows copied since the last checkpoint.
+        status (str): 'running' or 'done'.
+        partition (str): Name of the partition of the work item, or None.
+        owner (str): Distributed worker that holds the work item, or None.
+    """
+    lo_rowid, hi_rowid = rowid_range or ('','')
+    query = """UPDATE {}.checkpoint 
+               SET status = %(status)s, 
+                   last_rowid = COALESCE(%(last_rowid)s, last_rowid),
+                   rows_copied = rows_copied + %(rows)s,
+                   updated_at = now()
+               WHERE schema_name = %(schema_name)s AND table_name = %(table_name)s 
+                   AND partition_name = %(partition_name)s
+                   AND lo_rowid = %(lo_rowid)s AND hi_rowid = %(hi_rowid)s""".format(_CONTROL_SCHEMA)
+    if owner:
+        query = query + " AND worker = %(owner)s"
+    cursor = target_connection.cursor()
+    cursor.execute(query,{'status': status, 'last_rowid': last_rowid, 'rows': rows, 
+        'schema_name': schema, 'table_name': table_name, 'partition_name': partition or '',
+        'lo_rowid': lo_rowid, 'hi_rowid': hi_rowid, 'owner': owner})
+    rowcount = cursor.rowcount
+    cursor.close()
+    if owner and not rowcount:
+        raise _LeaseLost('{} no longer holds {}.{}'.format(owner,schema,table_name))
+
+def _set_logged(engine,schema,table_name,logged):
+    """
+    Switch Postgres logging (WAL) on or off for a table. A partitioned 
+    table holds no rows, so its partitions are switched instead.
+
+    Args:
+        engine (obj): Database engine.
+        schema (str): Name of schema.
+        table_name (str): Name of table.
+        logged (bool): True for LOGGED, False for UNLOGGED.
+    """
+    name = '{}.{}'.format(_PG_PREPARER.quote_schema(schema),_PG_PREPARER.quote(table_name))
+    try:
+        partitions = [x[0] for x in engine.execute(sqlalchemy.text("""
+            SELECT inhrelid::regclass::text 
+            FROM pg_inherits 
+            WHERE inhparent = to_regclass(:name)"""),name=name)]
+        for target in partitions or [name]:
+            engine.execute('ALTER TABLE {} SET {}'.format(target,'LOGGED' if logged else 'UNLOGGED'))
+    except:
+        msg = "Unable to {} logging for {}.{}".format('enable' if logged else 'disable',
+            schema,table_name)
+        logging.info(msg)
+
+def _get_shared_tables(work_items):
+    """
+    Get the tables that are loaded by more than one work item (ROWID 
+    chunks or partitions). Their logging is switched once for the whole 
+    table, rather than by each work item. Returns a sorted list of 
+    (schema, table_name).
+
+    Args:
+        work_items (list): Work items, see _split_work_items.
+    """
+    return sorted(set([(x[0],x[1]) for x in work_items if x[3] or x[4]]))
+
+def _migrate_table(schema,table_name,source_config,target_config,migration_config,
+    rowid_range=None,last_rowid=None,partition=None,owner=None,lease_lost=None):
+    """
+    Migrate the data from a source table (or a ROWID range or partition of
+    the table) to the target table. Returns a tuple of (schema, table_name, worker, 
+    start, finish, stats), see _copy_data for stats.
+
+    Args:
+        schema (str): Name of schema.
+        table_name (str): Name of table.
         source_config (dict): Settings for source database.
         target_config (dict): Settings for target database.
         migration_config (dict): Settings for the migration.
+        rowid_range (tuple): First and last ROWID of the chunk to copy. 
+            Logging must be switched by the caller when copying chunks.
+        last_rowid (str): Resume the copy after this ROWID.
+        partition (str): Name of the partition to copy.
+        owner (str): Distributed worker that holds the work item, see 
+            _copy_data.
+        lease_lost (obj): threading.Event, set if the owner loses the item.
     """
-    # create database connections
-    source_engine = connect_to_source(source_config)
-    target_engine = connect_to_target(target_config,target_config['database'])
-    
-    # load the schema metadata profile
-    source_metadata = sqlalchemy.MetaData(source_engine)
-    source_metadata.reflect(schema=schema)
+    worker = multiprocessing.current_process().name
+    label = '{}.{}'.format(schema,table_name)
+    if rowid_range:
+        label = '{} [{} - {}]'.format(label,*rowid_range)
+    if partition:
+        label = '{} PARTITION ({})'.format(label,partition)
+    start = datetime.now()
+    msg = '{} started {} at {}'.format(worker,label,
+        datetime.strftime(start,"%Y-%m-%d %H:%M:%S"))
+    logging.info(msg)
+
+    # reuse the database connections of this process
+    source_engine = _get_engine(source_config)
+    target_engine = _get_engine(target_config,target_config['database'],target=True)
+
+    # load the table metadata profile
+    t = _get_table(source_engine,schema,table_name,migration_config.get('metadata_cache'))
+
+    # logging of chunks and partitions is switched for the whole table, 
+    # see _get_shared_tables
+    stats = _copy_data(source_engine,schema,target_engine,t,migration_config['batchsize'],
+        migration_config['logged'] or bool(rowid_range or partition),trialrun=migration_config['trialrun'],
+        load_method=migration_config.get('load_method','copy'),
+        paging=migration_config.get('paging','cursor'),rowid_range=rowid_range,
+        pipeline=migration_config.get('pipeline',False),
+        memory_budget_mb=migration_config.get('memory_budget_mb',1024),
+        checkpoint=migration_config.get('checkpoint',False),last_rowid=last_rowid,
+        strip_nulls=migration_config.get('strip_nulls',False),
+        metrics_dir=migration_config.get('metrics_dir'),
+        run_id=migration_config.get('run_id'),
+        lob_inline_kb=migration_config.get('lob_inline_kb'),
+        columnar=migration_config.get('columnar',False),partition=partition,
+        freeze=migration_config.get('freeze',False),owner=owner,lease_lost=lease_lost)
+
+    finish = datetime.now()
+    msg = '{} finished {} at {} ({:.1f} seconds)'.format(worker,label,
+        datetime.strftime(finish,"%Y-%m-%d %H:%M:%S"),(finish - start).total_seconds())
+    logging.info(msg)
 
-    # iterate the tables, loading the data
-    for t in source_metadata.sorted_tables:
-        _copy_data(source_engine,schema,target_engine,t,migration_config['batchsize'],
-            migration_config['logged'],trialrun=migration_config['trialrun'])
+    return schema, table_name, worker, start, finish, stats
 
-def create_target_schema(schema_list,source_engine,target_engine):
+def _migrate_table_args(args):
+    """
+    Calls _migrate_table with a list of arguments, for Pool.imap_unordered.
+
+    Args:
+        args (list): Arguments for _migrate_table.
+    """
+    return _migrate_table(*args)
+
+def create_target_schema(schema_list,source_engine,target_engine,cache_dir=None,
+    number_types='numeric',type_report=None,processes=4,partitions=False):
     """
     Recreate the sources tables on the target database
 
@@ -303,33 +1048,95 @@ def create_target_schema(schema_list,source_engine,target_engine):
         schema_list (list): List of schema.
         source_engine (obj): Database engine.
         target_engine (obj): Database engine.
+        cache_dir (str): Directory of cached metadata, see cache_metadata.
+        number_types (str): 'numeric' to create every number column as 
+            NUMERIC, 'declared' to use the narrowest type that holds the 
+            declared precision, or 'profile' to also narrow columns without 
+            a declared precision to the range of their data. See 
+            _narrow_number. Default 'numeric'.
+        type_report (str): Path of a CSV report of the type chosen for each 
+            number column. Default None (no report).
+        processes (int): Number of tables to profile at the same time.
+        partitions (bool): Create partitioned source tables as declarative 
+            partitioned tables, with a partition for each source partition.
+            See _get_partition_ddl.
     """
     msg = 'Creating schema on target database...\n'
     print(msg)
-    for source_schema in schema_list:
+
+    # reflect every schema first, as foreign keys may cross schema
+    metadata_list = [(x,_reflect_schema(source_engine,x,cache_dir)) for x in schema_list]
+
+    # a table referenced from another schema is reflected in both
+    tables = {}
+    for source_schema, source_metadata in metadata_list:
+        for t in source_metadata.sorted_tables:
+            tables.setdefault((t.schema,t.name),t)
+
+    # scan the number columns without a declared precision
+    profiles = {}
+    if number_types == 'profile':
+        pool = multiprocessing.pool.ThreadPool(processes)
+        results = pool.map(lambda t: _profile_numbers(source_engine,t),tables.values(),chunksize=1)
+        pool.close()
+        pool.join()
+        for t, result in zip(tables.values(),results):
+            for name, profile in result.items():
+                profiles[(t.schema,t.name,name)] = profile
+
+    # choose the target types
+    types = {}
+    report = {}
+    for (schema, table_name), t in tables.items():
+        for col in t.columns:
+            key = (schema,table_name,col.name)
+            decisions = []
+            types[key] = _convert_type(col.name, col.type, schema_name=schema, 
+                table_name=table_name, number_types=number_types, 
+                profile=profiles.get(key), report=decisions)
+            if decisions:
+                report[key] = decisions[0]
+
+    # postgres cannot compare integers with numerics in a foreign key
+    if number_types != 'numeric':
+        _match_foreign_key_types(tables,types,report)
+
+    if type_report:
+        _write_type_report(type_report,report)
+
+    for source_schema, source_metadata in metadata_list:
         
         # load the schema metadata profile
         print(source_schema)
-        source_metadata = sqlalchemy.MetaData(source_engine,quote_schema=True)
-        source_metadata.reflect(schema=source_schema)
 
         # create the schema on the target database
         target_engine.execute(sqlalchemy.schema.CreateSchema(source_schema))
 
+        partitioning = _get_partitions(source_engine,source_schema) if partitions else {}
+        partition_ddl = []
+
         # iterate the tables
         for t in source_metadata.sorted_tables:
 
-            # clear the indexes and constraints
+            # partition the table like the source
+            if t.schema == source_schema and t.name.lower() in partitioning:
+                ddl = _get_partition_ddl(source_engine,t,partitioning[t.name.lower()])
+                if ddl:
+                    t.dialect_options['postgresql']['partition_by'] = ddl[0]
+                    partition_ddl.extend(ddl[1])
+
+            # clear the indexes and constraints. the keys are added after
+            # the load, see create_target_constraints. an integer key would
+            # also make its column SERIAL.
             t.indexes.clear()
             t.constraints.clear()
+            t.primary_key = sqlalchemy.PrimaryKeyConstraint()
             
             # clean the data types
             for col in t.columns:
                 
                 # set the column types
-                newtype = _convert_type(col.name, col.type,
-                    schema_name=source_schema, table_name=t.name)
-                t.c[col.name].type = newtype
+                t.c[col.name].type = types[(t.schema,t.name,col.name)]
                 
                 # check the default values
                 if t.c[col.name].default:
@@ -342,313 +1149,3735 @@ def create_target_schema(schema_list,source_engine,target_engine):
 
         # Build the tables on the target database
         source_metadata.create_all(target_engine,checkfirst=False)
+        for statement in partition_ddl:
+            target_engine.execute(statement)
 
         msg = "Target schema created: {}".format(source_schema)
         logging.info(msg)
 
-def drop_connections(dbname,engine):
+def _split_high_value(high_value):
     """
-    Closes connections to a database to avoid any interference
-    with the migration.
+    Split the HIGH_VALUE of an Oracle partition into the expressions for 
+    each key column (or each value of a list partition), at the commas 
+    that are not quoted or inside parentheses.
 
     Args:
-        dbname (str): Name of database.
-        engine (obj): Database engine.
+        high_value (str): HIGH_VALUE from ALL_TAB_PARTITIONS.
     """
-    con = engine.connect()
-    con.execute("COMMIT") # need to close current transaction
-    con.execute("""
-        SELECT pg_terminate_backend(pid) 
-        FROM pg_stat_activity 
-        WHERE datname = '{}';""".format(dbname))
-    con.execute("COMMIT") # need to close current transaction
-    con.close()
+    parts, current, depth, quoted = [], '', 0, False
+    for char in high_value:
+        if char == "'":
+            quoted = not quoted
+        elif not quoted and char == '(':
+            depth += 1
+        elif not quoted and char == ')':
+            depth -= 1
+        elif not quoted and not depth and char == ',':
+            parts.append(current.strip())
+            current = ''
+            continue
+        current += char
+    parts.append(current.strip())
 
-def drop_database(dbname,engine):
+    return parts
+
+def _format_bound(value):
     """
-    Warning, drops the specified database!
+    Formats a partition bound as a Postgres literal.
+
+    Args:
+        value (obj): Value returned by the source database.
+    """
+    if value is None:
+        return 'NULL'
+    elif isinstance(value,str):
+        return "'{}'".format(value.replace("'","''"))
+    elif isinstance(value,(datetime,date)):
+        return "'{}'".format(value.isoformat())
+    else:
+        return str(value)
+
+def _get_bound_literals(engine,high_value):
+    """
+    Convert the HIGH_VALUE of an Oracle partition to a list of Postgres 
+    literals, by evaluating its expressions (e.g. TO_DATE(...)) on the 
+    source database. MAXVALUE and DEFAULT are kept as keywords.
 
     Args:
-        dbname (str): Name of database to drop.
         engine (obj): Database engine.
+        high_value (str): HIGH_VALUE from ALL_TAB_PARTITIONS.
     """
+    parts = _split_high_value(high_value)
+    expressions = [x for x in parts if x.upper() not in ('MAXVALUE','DEFAULT')]
+    values = []
+    if expressions:
+        values = list(engine.execute("SELECT {} FROM dual".format(', '.join(expressions))).fetchone())
 
-    msg =  """
-    --------------------------------------------------------- \n
-    Warning, you are about to delete the following database!  \n
-    {}.{}
-    Are you sure you wish to continue?                        \n
-    Type 'yes' to proceed.                                    \n
-    --------------------------------------------------------- \n
-    \n""".format(engine.name,dbname)
+    literals = []
+    for part in parts:
+        if part.upper() in ('MAXVALUE','DEFAULT'):
+            literals.append(part.upper())
+        else:
+            literals.append(_format_bound(values.pop(0)))
+
+    return literals
+
+def _get_partition_table_name(table_name,partition):
+    """
+    Name of the Postgres table for a partition of a table.
+
+    Args:
+        table_name (str): Name of the table.
+        partition (str): Name of the source partition.
+    """
+    # postgres names are at most 63 bytes
+    return '{}_{}'.format(table_name,partition.lower())[:63]
+
+def _get_partition_ddl(engine,table,info):
+    """
+    Create the PARTITION BY clause of a table and the statements that 
+    create its partitions, to match the partitioning of the source table.
+    Range and list partitions are given the bounds of the source partitions,
+    so each partition can be copied straight into its own table. An Oracle
+    MAXVALUE partition becomes the default partition, which also holds the
+    NULL keys. Hash partitions cannot match the Oracle hash function, so 
+    the same number of partitions is created and rows are routed by the 
+    parent table. Returns (partition_by, statements), or None if the 
+    partitioning cannot be recreated (e.g. reference or multi-column list
+    partitioning), in which case the table is created unpartitioned.
+
+    Args:
+        engine (obj): Database engine.
+        table (obj): SQLAlchemy table object.
+        info (dict): Partitioning of the source table, see _get_partitions.
+    """
+    method, columns, partitions = info['method'], info['columns'], info['partitions']
+    label = '{}.{}'.format(table.schema,table.name)
+    if method not in _PARTITION_METHODS or not partitions or (method == 'LIST' and len(columns) > 1):
+        msg = "{}: {} partitioning on {} columns is not supported. Creating an unpartitioned table.".format(label,
+            method,len(columns))
+        logging.info(msg)
+        return None
+
+    preparer = _PG_PREPARER
+    partition_by = '{} ({})'.format(method,', '.join([preparer.quote(x) for x in columns]))
+    statements = []
+    lower = ['MINVALUE'] * len(columns)
+    try:
+        for i, (partition, high_value, size) in enumerate(partitions):
+            if method == 'HASH':
+                bound = 'FOR VALUES WITH (MODULUS {}, REMAINDER {})'.format(len(partitions),i)
+            else:
+                literals = _get_bound_literals(engine,high_value)
+                if literals == ['DEFAULT'] or set(literals) == set(['MAXVALUE']):
+                    bound = 'DEFAULT'
+                elif method == 'LIST':
+                    bound = 'FOR VALUES IN ({})'.format(', '.join(literals))
+                else:
+                    bound = 'FOR VALUES FROM ({}) TO ({})'.format(', '.join(lower),', '.join(literals))
+                    lower = literals
+            statements.append('CREATE TABLE {}.{} PARTITION OF {} {}'.format(
+                preparer.quote_schema(table.schema),
+                preparer.quote(_get_partition_table_name(table.name,partition)),
+                preparer.format_table(table),bound))
+    except:
+        msg = "{}: unable to read the partition bounds. Creating an unpartitioned table.".format(label)
+        logging.error(msg)
+        return None
+
+    return partition_by, statements
+
+def _get_partition_target(target_cursor,schema,table_name,partition):
+    """
+    Get the quoted name of the Postgres table that a source partition can
+    be copied into directly, or None if it must be copied into the parent 
+    table (e.g. it is unpartitioned or hash partitioned).
+
+    Args:
+        target_cursor (obj): psycopg2 cursor.
+        schema (str): Name of schema.
+        table_name (str): Name of table.
+        partition (str): Name of the source partition.
+    """
+    name = _get_partition_table_name(table_name,partition)
+    target = '{}.{}'.format(_PG_PREPARER.quote_schema(schema),_PG_PREPARER.quote(name))
+    target_cursor.execute("""
+        SELECT 1 
+        FROM pg_inherits i, pg_partitioned_table p
+        WHERE i.inhrelid = to_regclass(%(target)s) AND p.partrelid = i.inhparent 
+            AND p.partstrat <> 'h'""",{'target': target})
+    if target_cursor.fetchone():
+        return target
+    return None
+
+# postgres integer types, with the digits and largest value each can hold
+_INTEGER_TYPES = [(SMALLINT,4,2**15 - 1),(INTEGER,9,2**31 - 1),(BIGINT,18,2**63 - 1)]
+
+def _get_integer_type(digits=None,lo=None,hi=None):
+    """
+    Get the smallest Postgres integer type that holds a number of decimal
+    digits, or a range of values. Returns None if no integer type is large 
+    enough.
+
+    Args:
+        digits (int): Number of decimal digits.
+        lo (obj): Smallest value.
+        hi (obj): Largest value.
+    """
+    for pg_type, max_digits, max_value in _INTEGER_TYPES:
+        if digits is not None:
+            if digits <= max_digits:
+                return pg_type()
+        elif lo >= -max_value - 1 and hi <= max_value:
+            return pg_type()
+    return None
+
+def _get_number_precision(ora_type):
+    """
+    Get the declared precision and scale of an Oracle number type. INTEGER 
+    is NUMBER(38,0), and a negative scale adds digits to the precision. 
+    The precision is None if it is not declared.
+
+    Args:
+        ora_type (obj): Data type in the source (Oracle) database.
+    """
+    if not isinstance(ora_type,sqlalchemy.types.Numeric):
+        return 38, 0
+    precision, scale = ora_type.precision, ora_type.scale or 0
+    if precision and scale < 0:
+        return precision - scale, 0
+    return precision, scale
+
+def _can_profile(ora_type):
+    """
+    Check whether the type of an Oracle number column could be narrowed 
+    further by profiling its data.
+
+    Args:
+        ora_type (obj): Data type in the source (Oracle) database.
+    """
+    if str(ora_type).startswith('BINARY_') or isinstance(ora_type,sqlalchemy.types.Float):
+        return False
+    precision, scale = _get_number_precision(ora_type)
+    return not scale and not (precision and precision <= _INTEGER_TYPES[-1][1])
+
+def _narrow_number(ora_type,profile=None):
+    """
+    Choose the narrowest Postgres type that holds every value of an Oracle
+    number column without loss. Integers use SMALLINT, INTEGER or BIGINT if
+    the declared precision fits, or if the profile of the data fits and 
+    has no fractions. Binary floating point uses REAL or DOUBLE PRECISION.
+    Other numbers use NUMERIC, with the declared precision and scale. 
+    Returns a tuple of (type, reason).
+
+    Args:
+        ora_type (obj): Data type in the source (Oracle) database.
+        profile (tuple): (minimum, maximum, has fractions) of the data, 
+            see _profile_numbers.
+    """
+    name = str(ora_type)
+    if name == 'BINARY_DOUBLE':
+        return DOUBLE_PRECISION(), 'binary floating point'
+    elif name == 'BINARY_FLOAT':
+        return REAL(), 'binary floating point'
+    elif isinstance(ora_type,sqlalchemy.types.Float):
+        # oracle FLOAT is a decimal number
+        return sqlalchemy.types.Numeric(), 'decimal floating point'
+
+    precision, scale = _get_number_precision(ora_type)
+    if scale:
+        # oracle allows a scale above the precision, e.g. NUMBER(3,5)
+        # holds 0.00123. postgres (before 15) needs the precision widened.
+        if precision and scale > precision:
+            precision = scale
+        return sqlalchemy.types.Numeric(precision,scale), 'declared scale'
+    if precision:
+        pg_type = _get_integer_type(digits=precision)
+        if pg_type:
+            return pg_type, 'declared precision'
+    if profile and profile[0] is not None and not profile[2]:
+        pg_type = _get_integer_type(lo=profile[0],hi=profile[1])
+        if pg_type:
+            return pg_type, 'profiled range'
+    if precision:
+        return sqlalchemy.types.Numeric(precision,0), 'declared precision'
+    return sqlalchemy.types.Numeric(), 'no declared precision'
+
+def _profile_numbers(engine,table):
+    """
+    Find the minimum, the maximum and whether there are fractional values 
+    in each number column of a table that could be narrowed by profiling, 
+    in a single scan of the table. Returns a dict of column name to 
+    (minimum, maximum, has fractions).
+
+    Args:
+        engine (obj): Database engine.
+        table (obj): SQLAlchemy table object.
+    """
+    columns = [col for col in table.columns if isinstance(col.type,(sqlalchemy.types.Numeric,
+        sqlalchemy.types.Integer)) and _can_profile(col.type)]
+    if not columns:
+        return {}
+
+    preparer = engine.dialect.identifier_preparer
+    aggregates = []
+    for col in columns:
+        aggregates.extend(['MIN({})','MAX({})',
+            'MAX(CASE WHEN {0} <> ROUND({0}) THEN 1 ELSE 0 END)'])
+        aggregates[-3:] = [x.format(preparer.format_column(col)) for x in aggregates[-3:]]
+    query = "SELECT {} FROM {}".format(', '.join(aggregates),preparer.format_table(table))
+    try:
+        values = engine.execute(query).fetchone()
+    except:
+        msg = "Unable to profile the numbers in {}.{}".format(table.schema,table.name)
+        logging.error(msg)
+        return {}
+
+    return {col.name: tuple(values[3 * i:3 * i + 3]) for i, col in enumerate(columns)}
+
+def _is_integer_type(pg_type):
+    """
+    Check whether a Postgres type is one of the integer types.
+
+    Args:
+        pg_type (obj): SQLAlchemy type.
+    """
+    return isinstance(pg_type,sqlalchemy.types.Integer) and not isinstance(pg_type,
+        sqlalchemy.types.Numeric)
+
+def _match_foreign_key_types(tables,types,report):
+    """
+    Widen narrowed integer columns to NUMERIC where they are joined by a 
+    foreign key to a NUMERIC column, as Postgres cannot create the key. 
+    Integer types of different sizes are compatible.
+
+    Args:
+        tables (dict): Tables, keyed by (schema, table name).
+        types (dict): Target types, keyed by (schema, table name, column).
+            Modified in place.
+        report (dict): Report of the number columns, see _convert_type. 
+            Modified in place.
+    """
+    pairs = []
+    for t in tables.values():
+        for fk in t.foreign_keys:
+            try:
+                parent = fk.column
+            except sqlalchemy.exc.NoReferencedTableError:
+                continue
+            pairs.append(((t.schema,t.name,fk.parent.name),
+                (parent.table.schema,parent.table.name,parent.name)))
+
+    # repeat, as keys may be chained
+    changed = True
+    while changed:
+        changed = False
+        for a, b in pairs:
+            if a not in types or b not in types:
+                continue
+            if _is_integer_type(types[a]) == _is_integer_type(types[b]):
+                continue
+            narrow, wide = (a,b) if _is_integer_type(types[a]) else (b,a)
+            types[narrow] = types[wide]
+            if narrow in report:
+                report[narrow] = dict(report[narrow],target_type=str(types[wide]),
+                    reason='matches foreign key {}.{}.{}'.format(*wide))
+            changed = True
+
+def _write_type_report(path,report):
+    """
+    Write the type chosen for each number column to a CSV file, for review.
+
+    Args:
+        path (str): Path of the report.
+        report (dict): Report of the number columns, see _convert_type.
+    """
+    fields = ['schema','table','column','source_type','target_type','reason',
+        'minimum','maximum','fractions']
+    with open(path,'w',newline='') as f:
+        writer = csv.DictWriter(f,fieldnames=fields)
+        writer.writeheader()
+        for key in sorted(report):
+            writer.writerow(report[key])
+
+    narrowed = len([x for x in report.values() if not x['target_type'].startswith('NUMERIC')])
+    msg = "Number types: {} of {} columns narrowed from NUMERIC. See {}".format(narrowed,
+        len(report),path)
+    logging.info(msg)
+    print(msg)
+
+def _get_constraint_ddl(table,dialect,schema_list):
+    """
+    Create the DDL for the keys and indexes of a reflected source table. 
+    Returns a list of statements for primary keys, unique constraints and
+    indexes, and a list of (add, validate) statement pairs for foreign 
+    keys. Foreign keys are added as NOT VALID, to be validated separately.
+
+    Args:
+        table (obj): SQLAlchemy table object.
+        dialect (obj): Dialect of the target database.
+        schema_list (list): List of migrated schema. Foreign keys to other 
+            schema are skipped.
+    """
+    statements = []
+    foreign_keys = []
+    keyed_columns = []
+
+    for constraint in table.constraints:
+        if isinstance(constraint,(sqlalchemy.PrimaryKeyConstraint,sqlalchemy.UniqueConstraint)):
+            if not constraint.columns:
+                continue
+            keyed_columns.append(set(constraint.columns.keys()))
+            statements.append(str(sqlalchemy.schema.AddConstraint(constraint).compile(dialect=dialect)))
+        elif isinstance(constraint,sqlalchemy.ForeignKeyConstraint):
+            if constraint.referred_table.schema not in schema_list:
+                continue
+            add = str(sqlalchemy.schema.AddConstraint(constraint).compile(dialect=dialect))
+            validate = 'ALTER TABLE {} VALIDATE CONSTRAINT {}'.format(
+                dialect.identifier_preparer.format_table(table),
+                dialect.identifier_preparer.format_constraint(constraint))
+            foreign_keys.append((add + ' NOT VALID',validate))
+
+    for index in table.indexes:
+        # unique indexes that back a constraint are created with it
+        if index.unique and set(index.columns.keys()) in keyed_columns:
+            continue
+        try:
+            statements.append(str(sqlalchemy.schema.CreateIndex(index).compile(dialect=dialect)))
+        except:
+            msg = "{}.{}: unable to create index {}".format(table.schema,table.name,index.name)
+            logging.info(msg)
+
+    return statements, foreign_keys
+
+def _execute_ddl(target_config,statements,migration_config):
+    """
+    Run DDL statements on the target database in a session configured for
+    building indexes. Errors are logged and the remaining statements are 
+    run. Returns the number of statements that failed.
+
+    Args:
+        target_config (dict): Settings for target database.
+        statements (list): List of DDL statements.
+        migration_config (dict): Settings for the migration.
+    """
+    target_engine = connect_to_target(target_config,target_config['database'])
+    con = target_engine.connect().execution_options(autocommit=True)
+    con.execute("SET maintenance_work_mem = '{}'".format(migration_config.get('maintenance_work_mem','1GB')))
+    con.execute("SET max_parallel_maintenance_workers = {}".format(
+        migration_config.get('max_parallel_maintenance_workers',2)))
+
+    failed = 0
+    for statement in statements:
+        start = datetime.now()
+        try:
+            con.execute(statement)
+            msg = "{} ({:.1f} seconds)".format(statement.strip(),(datetime.now() - start).total_seconds())
+            logging.info(msg)
+        except Exception as e:
+            failed = failed + 1
+            msg = "Failed: {}\n{}".format(statement.strip(),e)
+            logging.error(msg)
+
+    con.close()
+    target_engine.dispose()
+
+    return failed
+
+def create_target_constraints(source_config,target_config,migration_config):
+    """
+    Recreate the primary keys, unique constraints, indexes and foreign keys
+    of the source tables on the target database, after the data has been
+    loaded. Tables are processed in parallel, largest first. Foreign keys 
+    are added as NOT VALID and then validated in parallel.
+
+    Args:
+        source_config (dict): Settings for source database.
+        target_config (dict): Settings for target database.
+        migration_config (dict): Settings for the migration.
+    """
+    source_engine = connect_to_source(source_config)
+    table_statements, foreign_keys = _get_target_constraints(source_engine,
+        source_config['schema_list'],migration_config.get('metadata_cache'))
+    source_engine.dispose()
+
+    _create_constraints(target_config,table_statements,foreign_keys,migration_config)
+
+def _get_target_constraints(source_engine,schema_list,cache_dir=None):
+    """
+    Get the DDL for the keys, indexes and foreign keys of the source tables
+    on the target database. Returns a tuple of the statements for each 
+    table, largest table first, and the (add, validate) statements of the 
+    foreign keys. See _get_constraint_ddl.
+
+    Args:
+        source_engine (obj): Database engine.
+        schema_list (list): List of schema.
+        cache_dir (str): Directory of cached metadata, see cache_metadata.
+    """
+    dialect = sqlalchemy.dialects.postgresql.dialect()
+    sizes = {}
+    for schema, table_name, size in _get_work_items(source_engine,schema_list):
+        sizes[(schema,table_name)] = size
+
+    table_statements = []
+    foreign_keys = []
+    for schema in schema_list:
+        source_metadata = _reflect_schema(source_engine,schema,cache_dir)
+        for t in source_metadata.sorted_tables:
+            if t.schema != schema:
+                continue
+            statements, fks = _get_constraint_ddl(t,dialect,schema_list)
+            if statements:
+                table_statements.append((sizes.get((schema,t.name),0),statements))
+            foreign_keys.extend(fks)
+    table_statements.sort(key=lambda x: x[0],reverse=True)
+
+    return [statements for size, statements in table_statements], foreign_keys
+
+def _create_constraints(target_config,table_statements,foreign_keys,migration_config):
+    """
+    Run the DDL for the keys, indexes and foreign keys on the target 
+    database, see _get_target_constraints.
+
+    Args:
+        target_config (dict): Settings for target database.
+        table_statements (list): List of the statements for each table.
+        foreign_keys (list): List of (add, validate) foreign key statements.
+        migration_config (dict): Settings for the migration.
+    """
+    msg = 'Creating keys and indexes on target database...\n'
+    print(msg)
+    logging.info(msg)
+
+    pool = multiprocessing.Pool(migration_config.get('index_processes',4))
+
+    # keys and indexes, one task per table
+    arg_iterable = [[target_config,statements,migration_config] for statements in table_statements]
+    failed = sum(pool.starmap(_execute_ddl,arg_iterable,chunksize=1))
+
+    # adding NOT VALID foreign keys only needs a brief lock, so run them 
+    # together before validating them in parallel
+    failed = failed + _execute_ddl(target_config,[add for add, validate in foreign_keys],
+        migration_config)
+    arg_iterable = [[target_config,[validate],migration_config] for add, validate in foreign_keys]
+    failed = failed + sum(pool.starmap(_execute_ddl,arg_iterable,chunksize=1))
+
+    pool.close()
+    pool.join()
+
+    msg = 'Keys and indexes created ({} statements failed, see log)\n'.format(failed)
+    print(msg)
+    logging.info(msg)
+
+def drop_connections(dbname,engine):
+    """
+    Closes connections to a database to avoid any interference
+    with the migration.
+
+    Args:
+        dbname (str): Name of database.
+        engine (obj): Database engine.
+    """
+    con = engine.connect()
+    con.execute("COMMIT") # need to close current transaction
+    con.execute("""
+        SELECT pg_terminate_backend(pid) 
+        FROM pg_stat_activity 
+        WHERE datname = '{}';""".format(dbname))
+    con.execute("COMMIT") # need to close current transaction
+    con.close()
+
+def drop_database(dbname,engine):
+    """
+    Warning, drops the specified database!
+
+    Args:
+        dbname (str): Name of database to drop.
+        engine (obj): Database engine.
+    """
+
+    msg =  """
+    --------------------------------------------------------- \n
+    Warning, you are about to delete the following database!  \n
+    {}.{}
+    Are you sure you wish to continue?                        \n
+    Type 'yes' to proceed.                                    \n
+    --------------------------------------------------------- \n
+    \n""".format(engine.name,dbname)
 
     if input(msg).lower() != "yes":
         sys.exit()
 
-    con = engine.connect()
-    con.execute("COMMIT") # need to close current transaction
-    con.execute("DROP DATABASE IF EXISTS {}".format(dbname))
-    con.execute("COMMIT") # need to close current transaction
-    con.close()
-    msg = "Target database dropped: {}".format(dbname)
+    con = engine.connect()
+    con.execute("COMMIT") # need to close current transaction
+    con.execute("DROP DATABASE IF EXISTS {}".format(dbname))
+    con.execute("COMMIT") # need to close current transaction
+    con.close()
+    msg = "Target database dropped: {}".format(dbname)
+    logging.info(msg)
+
+def create_database(dbname,engine):
+    """
+    Creates a new database on the target.
+
+    Args:
+        dbname (str): Name of database.
+        engine (obj): Database engine.
+    """
+    con = engine.connect()
+    con.execute("COMMIT") # need to close current transaction
+    con.execute("CREATE DATABASE {}".format(dbname))
+    con.execute("COMMIT") 
+    con.close()
+    msg = "Target database created: {}".format(dbname)
+    logging.info(msg)
+
+def _check_default(default):
+    new_default = default
+    logging.info("CHECKING DEFAULT")
+
+    if str(default).lower() == "sysdate":
+        logging.info("UPDATED")
+        new_default = None
+    
+    return new_default
+
+def _insert_data(target_connection,table,data,method='copy',checkpoint=None,
+    strip_nulls=False,columnar=False,target=None,freeze=False,commit=True):
+    """
+    Inserts the data into the target system. Integrity checks must be 
+    disabled for the session, see _set_target_session.
+
+    Args:
+        target_connection (obj): psycopg2 connection.
+        table (obj): SQLAlchemy table object.
+        data (list): Rows to insert, with values in table column order.
+        method (str): 'copy' to stream the data with COPY FROM STDIN, or
+            'insert' to use multi-row INSERT statements. Default 'copy'.
+        checkpoint (dict): Arguments for _save_checkpoint. The checkpoint is
+            committed in the same transaction as the data.
+        strip_nulls (bool): Remove null characters from strings.
+        columnar (bool): Encode the rows for COPY column by column, see 
+            _encode_columns.
+        target (str): Quoted name of the table to insert into, if it is not 
+            the table itself (e.g. a partition).
+        freeze (bool): Copy with FREEZE, see _copy_rows.
+        commit (bool): Commit the batch. Default True.
+
+    Returns:
+        tuple: Characters sent with COPY, or bytes of the INSERT 
+            statements, and the seconds spent serializing them for COPY.
+    """
+    nbytes, seconds = 0, 0.0
+    if data:
+        # insert data
+        if method == 'copy':
+            nbytes, seconds = _copy_rows(target_connection,table,data,target=target,
+                strip_nulls=strip_nulls,columnar=columnar,freeze=freeze)
+        else:
+            lob_columns = _get_lob_columns(table)
+            if any([hasattr(row[i],'read') for row in data for i in lob_columns]):
+                # inserts cannot stream, so read any LOB locators whole
+                data = [[x.read() if hasattr(x,'read') else x for x in row] for row in data]
+            if strip_nulls:
+                data = _strip_nulls(data)
+            columns = ', '.join([_PG_PREPARER.format_column(col) for col in table.columns])
+            query = 'INSERT INTO {} ({}) VALUES %s'.format(target or _PG_PREPARER.format_table(table),
+                columns)
+            cursor = target_connection.cursor()
+            # one page at a time, so the size of each statement is counted
+            for i in range(0,len(data),1000):
+                psycopg2.extras.execute_values(cursor,query,data[i:i + 1000],page_size=1000)
+                nbytes = nbytes + len(cursor.query)
+            cursor.close()
+        if checkpoint:
+            _save_checkpoint(target_connection,**checkpoint)
+        if commit:
+            target_connection.commit()
+
+    return nbytes, seconds
+
+# quotes names for the target database
+_PG_PREPARER = sqlalchemy.dialects.postgresql.dialect().identifier_preparer
+
+def _copy_rows(target_connection,table,data,target=None,strip_nulls=False,columnar=False,
+    freeze=False):
+    """
+    Streams rows into the target table with COPY FROM STDIN. 
+
+    Args:
+        target_connection (obj): psycopg2 connection, e.g. the connection 
+            that underlies a session.
+        table (obj): SQLAlchemy table object.
+        data (list): Rows to copy, with values in table column order.
+        target (str): Quoted name of the table to copy into, if it is not
+            the table itself (e.g. a staging table).
+        strip_nulls (bool): Remove null characters from strings.
+        columnar (bool): Encode the rows column by column, see 
+            _encode_columns. Batches with LOB locators are streamed row by 
+            row.
+        freeze (bool): Copy with FREEZE. The table must have been created 
+            or truncated in the current subtransaction.
+
+    Returns:
+        tuple: Characters sent and the seconds spent serializing them.
+    """
+    columns = ', '.join([_PG_PREPARER.format_column(col) for col in table.columns])
+    query = 'COPY {} ({}) FROM STDIN'.format(target or _PG_PREPARER.format_table(table),columns)
+    if freeze:
+        query = query + ' WITH (FREEZE)'
+
+    cursor = target_connection.cursor()
+    stream = _get_copy_stream(table,data,strip_nulls,columnar)
+    try:
+        cursor.copy_expert(query,stream)
+    finally:
+        cursor.close()
+
+    return stream.chars_read, stream.seconds
+
+def _get_copy_stream(table,data,strip_nulls=False,columnar=False):
+    """
+    Serialize rows to the COPY text format as a file-like object. Once it
+    has been read, chars_read and seconds give the characters read and the
+    seconds spent serializing them.
+
+    Args:
+        table (obj): SQLAlchemy table object.
+        data (list): Rows, with values in table column order.
+        strip_nulls (bool): Remove null characters from strings.
+        columnar (bool): Encode the rows column by column, see 
+            _encode_columns. Batches with LOB locators are streamed row by 
+            row.
+    """
+    lob_columns = _get_lob_columns(table)
+    if columnar and not any([hasattr(row[i],'read') for row in data for i in lob_columns]):
+        start = time.time()
+        text = _encode_columns(data,_get_column_kinds(table),strip_nulls)
+        stream = io.StringIO(text)
+        stream.chars_read, stream.seconds = len(text), time.time() - start
+    else:
+        stream = _CopyStream(data,strip_nulls,lob_columns)
+
+    return stream
+
+# characters with special meaning in the COPY text format
+_COPY_ESCAPES = str.maketrans({'\\': '\\\\', '\n': '\\n', '\r': '\\r', '\t': '\\t'})
+# as above, also deleting null characters, which postgres cannot store
+_COPY_ESCAPES_STRIP_NULLS = dict(_COPY_ESCAPES)
+_COPY_ESCAPES_STRIP_NULLS[0] = None
+
+def _strip_nulls(data):
+    """
+    Remove null characters from the strings in a batch of rows.
+
+    Args:
+        data (list): Rows of values.
+    """
+    return [[x.replace('\x00','') if isinstance(x,str) else x for x in row] for row in data]
+
+def _format_copy_value(value,escapes=_COPY_ESCAPES):
+    """
+    Formats a single value for the Postgres COPY text format.
+
+    Args:
+        value (obj): Value returned by the source database.
+        escapes (dict): Translation table for strings.
+    """
+    if value is None:
+        return '\\N'
+    elif isinstance(value,str):
+        return value.translate(escapes)
+    elif isinstance(value,bool):
+        return 't' if value else 'f'
+    elif isinstance(value,(bytes,bytearray,memoryview)):
+        # bytea hex format. the backslash is itself escaped for COPY.
+        return '\\\\x' + bytes(value).hex()
+    elif isinstance(value,float):
+        if math.isnan(value):
+            return 'NaN'
+        elif math.isinf(value):
+            return 'Infinity' if value > 0 else '-Infinity'
+        return repr(value)
+    elif isinstance(value,datetime):
+        return value.isoformat(sep=' ')
+    elif isinstance(value,date):
+        return value.isoformat()
+    elif isinstance(value,timedelta):
+        # python normalises negative intervals to negative days only
+        return '{} days {} seconds {} microseconds'.format(value.days,
+            value.seconds,value.microseconds)
+    elif hasattr(value,'read'):
+        # unread LOB locator
+        return _format_copy_value(value.read(),escapes)
+    else:
+        return str(value).translate(escapes)
+
+def _format_copy_row(row,escapes=_COPY_ESCAPES):
+    """
+    Formats a row as a line of the Postgres COPY text format.
+
+    Args:
+        row (obj): Sequence of values.
+        escapes (dict): Translation table for strings.
+    """
+    return '\t'.join([_format_copy_value(value,escapes) for value in row]) + '\n'
+
+# characters or bytes read from a streamed LOB at a time
+_LOB_PIECE_SIZE = 1024 * 1024
+
+def _read_lob(lob):
+    """
+    Reads a LOB locator in pieces of _LOB_PIECE_SIZE.
+
+    Args:
+        lob (obj): cx_Oracle LOB.
+    """
+    offset = 1
+    while True:
+        piece = lob.read(offset,_LOB_PIECE_SIZE)
+        if not piece:
+            break
+        yield piece
+        offset += len(piece)
+
+def _format_copy_pieces(row,escapes=_COPY_ESCAPES):
+    """
+    Formats a row as a line of the Postgres COPY text format, in pieces. 
+    LOB locators are read and formatted a piece at a time, so a large LOB
+    is never held in memory whole.
+
+    Args:
+        row (obj): Sequence of values.
+        escapes (dict): Translation table for strings.
+    """
+    for i, value in enumerate(row):
+        if i:
+            yield '\t'
+        if hasattr(value,'read'):
+            if value.type in (cx_Oracle.BLOB,cx_Oracle.BFILE):
+                yield '\\\\x'
+                for piece in _read_lob(value):
+                    yield piece.hex()
+            else:
+                for piece in _read_lob(value):
+                    yield piece.translate(escapes)
+        else:
+            yield _format_copy_value(value,escapes)
+    yield '\n'
+
+def _get_copy_lines(rows,escapes=_COPY_ESCAPES,lob_columns=()):
+    """
+    Formats rows in the Postgres COPY text format. Yields a line for each
+    row, or a line in pieces for rows with LOB locators.
+
+    Args:
+        rows (iter): Rows to format.
+        escapes (dict): Translation table for strings.
+        lob_columns (list): Indexes of the columns that may hold LOB locators.
+    """
+    for row in rows:
+        if lob_columns and any([hasattr(row[i],'read') for i in lob_columns]):
+            for piece in _format_copy_pieces(row,escapes):
+                yield piece
+        else:
+            yield _format_copy_row(row,escapes)
+
+class _CopyStream(object):
+    """
+    Read-only file-like object that serializes rows to the COPY text format
+    as psycopg2 reads them, so the whole batch is never held as one string.
+
+    Args:
+        rows (iter): Rows to serialize.
+        strip_nulls (bool): Remove null characters from strings.
+        lob_columns (list): Indexes of the columns that may hold LOB 
+            locators, which are streamed in pieces.
+    """
+    def __init__(self,rows,strip_nulls=False,lob_columns=()):
+        escapes = _COPY_ESCAPES_STRIP_NULLS if strip_nulls else _COPY_ESCAPES
+        self._lines = _get_copy_lines(rows,escapes,lob_columns)
+        self._pending = []
+        self._pending_size = 0
+        self.chars_read = 0
+        self.seconds = 0.0
+
+    def read(self,size=-1):
+        start = time.time()
+        while size < 0 or self._pending_size < size:
+            try:
+                line = next(self._lines)
+            except StopIteration:
+                break
+            self._pending.append(line)
+            self._pending_size += len(line)
+
+        chunk = ''.join(self._pending)
+        if size >= 0 and len(chunk) > size:
+            chunk, remainder = chunk[:size], chunk[size:]
+            self._pending = [remainder]
+            self._pending_size = len(remainder)
+        else:
+            self._pending = []
+            self._pending_size = 0
+
+        self.chars_read += len(chunk)
+        self.seconds += time.time() - start
+        return chunk
+
+def _get_column_kinds(table):
+    """
+    Classify the columns of a table for _encode_columns: 'int' for integer
+    NUMBERs, 'float' for BINARY_FLOAT and BINARY_DOUBLE, 'decimal' for 
+    other numbers, 'datetime' for DATE and TIMESTAMP without time zone, 
+    'text', 'bytes', or 'other'.
+
+    Args:
+        table (obj): SQLAlchemy table object.
+    """
+    kinds = []
+    for col in table.columns:
+        coltype = col.type
+        name = '' if isinstance(coltype,sqlalchemy.types.NullType) else str(coltype)
+        if name in ('CLOB','NCLOB','BLOB'):
+            kind = 'other'
+        elif name.startswith('BINARY_'):
+            kind = 'float'
+        elif isinstance(coltype,sqlalchemy.types.Numeric):
+            # the oracle NUMBER type is also an Integer
+            if coltype.precision and not coltype.scale:
+                kind = 'int'
+            else:
+                kind = 'decimal'
+        elif isinstance(coltype,sqlalchemy.types.Integer):
+            kind = 'int'
+        elif isinstance(coltype,sqlalchemy.types.DateTime) and not getattr(coltype,'timezone',False):
+            kind = 'datetime'
+        elif isinstance(coltype,sqlalchemy.types.String):
+            kind = 'text'
+        elif isinstance(coltype,sqlalchemy.types.LargeBinary) or name == 'RAW':
+            kind = 'bytes'
+        else:
+            kind = 'other'
+        kinds.append(kind)
+
+    return kinds
+
+# separates the values of a text column while it is escaped as one string
+_COLUMN_SEPARATOR = '\x1e'
+
+def _encode_column(values,kind,escapes=_COPY_ESCAPES):
+    """
+    Formats a column of values for the Postgres COPY text format. The 
+    format of each kind of column is fixed, so the column is converted in
+    one pass (e.g. map(str,values)) instead of testing the type of each 
+    value, and a text column is escaped as a single string. Returns a list
+    of strings.
+
+    Args:
+        values (tuple): Values of the column.
+        kind (str): Kind of column, see _get_column_kinds.
+        escapes (dict): Translation table for strings.
+    """
+    nulls = None in values
+    if kind == 'text':
+        text = _COLUMN_SEPARATOR.join(['' if x is None else x for x in values] if nulls else values)
+        if text.count(_COLUMN_SEPARATOR) != len(values) - 1:
+            raise ValueError('Column contains the separator')
+        encoded = text.translate(escapes).split(_COLUMN_SEPARATOR)
+    elif kind == 'bytes':
+        encoded = ['' if x is None else '\\\\x' + bytes(x).hex() for x in values]
+    elif kind in ('int','decimal','datetime'):
+        # str gives the COPY format of numbers, and of datetimes (with ' ')
+        encoded = list(map(str,values))
+    elif kind == 'float' and np.isfinite(np.array(values,dtype=np.float64)).all():
+        encoded = list(map(repr,values))
+    else:
+        # NaN, infinity or NULL floats, and other types
+        return [_format_copy_value(x,escapes) for x in values]
+
+    if nulls:
+        encoded = ['\\N' if x is None else e for x, e in zip(values,encoded)]
+
+    return encoded
+
+def _encode_columns(data,kinds,strip_nulls=False):
+    """
+    Formats a batch of rows in the Postgres COPY text format, column by 
+    column, see _encode_column. Columns that cannot be converted as a whole
+    are formatted value by value.
+
+    Args:
+        data (list): Rows of values.
+        kinds (list): Kind of each column, see _get_column_kinds.
+        strip_nulls (bool): Remove null characters from strings.
+    """
+    if not data:
+        return ''
+    escapes = _COPY_ESCAPES_STRIP_NULLS if strip_nulls else _COPY_ESCAPES
+    columns = []
+    for values, kind in zip(zip(*data),kinds):
+        try:
+            columns.append(_encode_column(values,kind,escapes))
+        except (TypeError,ValueError,AttributeError):
+            columns.append(_encode_column(values,'other',escapes))
+
+    return '\n'.join(['\t'.join(row) for row in zip(*columns)]) + '\n'
+
+def _get_column_string(table,lob_inline_kb=None):
+    """
+    Create a string of column names for contructing a query.
+
+    Args:
+        table (obj): SQLAlchemy table object.
+        lob_inline_kb (int): If given, each LOB column is selected twice: 
+            with the row if its length is up to this many KB (otherwise 
+            NULL), and as a locator named LOB$<n> at the end of the list if
+            it is longer. See _fetch_batches. 
+    """
+    column_list = table.columns.keys()
+
+    # quote columns that are also keywords. 
+    # assume they are upper case!
+    keywords = ['where','from','select','comment','order']
+    column_list = ['"{}"'.format(x.upper()) if x.lower() in keywords else x for x in column_list] 
+
+    if lob_inline_kb is not None:
+        limit = int(lob_inline_kb) * 1024
+        locators = []
+        for i in _get_lob_columns(table):
+            column = column_list[i]
+            column_list[i] = 'CASE WHEN DBMS_LOB.GETLENGTH({0}) <= {1} THEN {0} END'.format(column,limit)
+            locators.append('CASE WHEN DBMS_LOB.GETLENGTH({0}) > {1} THEN {0} END "LOB${2}"'.format(column,
+                limit,i))
+        column_list = column_list + locators
+
+    column_str = ', '.join(column_list)
+    
+    return column_str
+
+def _get_lob_columns(table):
+    """
+    Get the indexes of the LOB columns of a table.
+
+    Args:
+        table (obj): SQLAlchemy table object.
+    """
+    return [i for i, col in enumerate(table.columns) 
+        if str(col.type) in ('CLOB','NCLOB','BLOB')]
+
+def _lob_output_type_handler(cursor,name,default_type,size,precision,scale):
+    """
+    cx_Oracle output type handler that fetches the columns named LOB$<n>
+    as LOB locators, and the other columns with the handler of the 
+    connection, which fetches LOBs with the row.
+    """
+    if name.upper().startswith('LOB$'):
+        return None
+    handler = cursor.connection.outputtypehandler
+    if handler:
+        return handler(cursor,name,default_type,size,precision,scale)
+
+def _merge_lob_columns(data,lob_columns,ncols):
+    """
+    Replaces the values of LOB columns that were too long to fetch with 
+    the row by their locators, and drops the locator columns.
+
+    Args:
+        data (list): Batch of rows.
+        lob_columns (list): Indexes of the LOB columns.
+        ncols (int): Number of table columns, which precede the locators.
+    """
+    merged = []
+    for row in data:
+        values = list(row[:ncols])
+        for k, i in enumerate(lob_columns):
+            if values[i] is None:
+                values[i] = row[ncols + k]
+        merged.append(tuple(values) + tuple(row[ncols + len(lob_columns):]))
+
+    return merged
+
+def _get_select_query(columns,schema,table_name,rowid_range=None,last_rowid=None,
+    order=False,partition=None):
+    """
+    Create the query used to read a table, optionally limited to a range
+    of ROWIDs or a partition.
+
+    Args:
+        columns (str): Column string, see _get_column_string.
+        schema (str): Name of the schema.
+        table_name (str): Name of the table.
+        rowid_range (tuple): First and last ROWID (as strings) to read.
+        last_rowid (str): Only read rows after this ROWID.
+        order (bool): Order the rows by ROWID.
+        partition (str): Name of the partition to read.
+    """
+    query = "SELECT {} FROM {}.{}".format(columns,schema,table_name)
+    if partition:
+        query = query + ' PARTITION ("{}")'.format(partition)
+    conditions = []
+    params = {}
+    if rowid_range:
+        conditions.append("rowid BETWEEN CHARTOROWID(:lo_rowid) AND CHARTOROWID(:hi_rowid)")
+        params['lo_rowid'], params['hi_rowid'] = rowid_range
+    if last_rowid:
+        conditions.append("rowid > CHARTOROWID(:last_rowid)")
+        params['last_rowid'] = last_rowid
+    if conditions:
+        query = query + " WHERE " + " AND ".join(conditions)
+    if order:
+        query = query + " ORDER BY rowid"
+
+    return query, params
+
+# most rows fetched from the source in one round trip
+_MAX_ARRAYSIZE = 10000
+
+def _fetch_batches(source_connection,queries,batchsize,fetch_times=None,lob_columns=None,
+    ncols=None):
+    """
+    Runs each query once on a DB-API cursor and drains it with fetchmany, 
+    yielding batches of rows as tuples. Every batch costs the same, however
+    far into the table it is.
+
+    Args:
+        source_connection (obj): DB-API connection, e.g. from 
+            engine.raw_connection(). The output type handler of the 
+            SQLAlchemy cx_Oracle dialect is set on the connection.
+        queries (list): List of (query, params) tuples.
+        batchsize (obj): Number of rows in each batch, or a callable that 
+            returns the number of rows for the next batch, see _BatchSizer.
+        fetch_times (obj): Optional deque. The seconds taken to fetch each
+            batch are appended to it, in the order the batches are yielded.
+        lob_columns (list): Indexes of the LOB columns, if the queries select
+            LOB locators (see _get_column_string). The locators replace the 
+            LOB values that were too long to fetch with the row.
+        ncols (int): Number of table columns, if lob_columns is given.
+    """
+    for query, params in queries:
+        start = time.time()
+        cursor = source_connection.cursor()
+        # fetch each batch in as few round trips as possible
+        size = batchsize() if callable(batchsize) else batchsize
+        cursor.arraysize = min(size,_MAX_ARRAYSIZE)
+        if hasattr(cursor,'prefetchrows'):
+            cursor.prefetchrows = cursor.arraysize
+        if lob_columns:
+            cursor.outputtypehandler = _lob_output_type_handler
+        try:
+            cursor.execute(query,params)
+            data = cursor.fetchmany(size)
+            while data:
+                if lob_columns:
+                    data = _merge_lob_columns(data,lob_columns,ncols)
+                if fetch_times is not None:
+                    fetch_times.append(time.time() - start)
+                yield data
+                start = time.time()
+                data = cursor.fetchmany(batchsize() if callable(batchsize) else batchsize)
+        finally:
+            cursor.close()
+
+def _get_table_stats(engine,schema,table_name):
+    """
+    Get the number of rows and the average row length in bytes of a table
+    from the optimizer statistics. Returns (None, None) if the table has 
+    not been analyzed.
+
+    Args:
+        engine (obj): Database engine.
+        schema (str): Name of the schema.
+        table_name (str): Name of the table.
+    """
+    query = """SELECT num_rows, avg_row_len 
+               FROM all_tables 
+               WHERE owner = :owner AND table_name = :table_name"""
+    try:
+        stats = engine.execute(sqlalchemy.text(query),owner=schema.upper(),
+            table_name=table_name.upper()).fetchone()
+    except:
+        stats = None
+
+    if not stats:
+        return None, None
+
+    return stats[0], stats[1]
+
+# python objects take several times the space of the oracle row
+_ROW_MEMORY_FACTOR = 4
+
+def _get_queue_depth(batchsize,avg_row_len,memory_budget_mb):
+    """
+    Number of batches that can be queued between the fetch and write 
+    threads without exceeding the memory budget. One batch is also held 
+    by each thread.
+
+    Args:
+        batchsize (int): Number of rows in each batch.
+        avg_row_len (int): Average row length in bytes, or None if unknown.
+        memory_budget_mb (int): Memory available for batches.
+    """
+    batch_bytes = batchsize * (avg_row_len or 100) * _ROW_MEMORY_FACTOR
+    batches = memory_budget_mb * 1024 * 1024 // batch_bytes
+
+    return max(1,int(batches) - 2)
+
+# queued batches when the batch size is chosen automatically
+_ADAPTIVE_QUEUE_DEPTH = 2
+# limits on the automatic batch size
+_MIN_BATCHSIZE = 100
+_MAX_BATCHSIZE = 1000000
+# first batch size, before the throughput has been measured
+_START_BATCHSIZE = 10000
+
+def _get_row_size(data,sample=100):
+    """
+    Estimate the memory used by each row of a batch in bytes, from a 
+    sample of the rows.
+
+    Args:
+        data (list): Batch of rows.
+        sample (int): Number of rows to measure.
+    """
+    rows = data[::max(1,len(data) // sample)]
+    size = sum([sys.getsizeof(tuple(row)) + sum([sys.getsizeof(x) for x in row]) for row in rows])
+
+    return size / float(len(rows))
+
+class _BatchSizer(object):
+    """
+    Chooses the number of rows in each batch. Unless a fixed batch size is
+    given, the batches are capped so that the batches held in memory fit 
+    within the memory budget. Within the cap, the batch size is tuned to 
+    maximise the measured rows per second: it keeps moving in the same 
+    direction while the throughput improves, and turns back with a smaller
+    step when it falls. The row size is first estimated from AVG_ROW_LEN,
+    then measured from a sample of each batch.
+
+    Call the object to get the size of the next batch.
+
+    Args:
+        memory_budget_mb (int): Memory available for batches.
+        batches_in_memory (int): Number of batches held in memory at once.
+        avg_row_len (int): Average row length in bytes, or None if unknown.
+        batchsize (int): Fixed number of rows in each batch, or None to 
+            size batches automatically.
+    """
+    def __init__(self,memory_budget_mb,batches_in_memory,avg_row_len=None,batchsize=None):
+        self.fixed = bool(batchsize)
+        self.limit = memory_budget_mb * 1024 * 1024 / float(batches_in_memory)
+        self.row_size = avg_row_len * _ROW_MEMORY_FACTOR if avg_row_len else None
+        self.step = 2.0
+        self.rate = None
+        if self.fixed:
+            self.size = int(batchsize)
+        else:
+            # without statistics, the first batch is a small sample
+            self.size = self._clip(_START_BATCHSIZE if self.row_size else 1000)
+
+    def __call__(self):
+        return self.size
+
+    def _clip(self,size):
+        if self.row_size:
+            size = min(size,self.limit / self.row_size)
+        return int(max(_MIN_BATCHSIZE,min(_MAX_BATCHSIZE,size)))
+
+    def update(self,data,seconds):
+        """
+        Records a batch and chooses the size of the next batch.
+
+        Args:
+            data (list): Batch of rows.
+            seconds (float): Seconds taken to fetch and write the batch.
+        """
+        if self.fixed or not data:
+            return
+
+        # err on the large side, as rows vary in size between batches
+        row_size = _get_row_size(data)
+        self.row_size = max(row_size,((self.row_size or row_size) + row_size) / 2)
+
+        rate = len(data) / max(seconds,1e-6)
+        if self.rate is not None and rate < self.rate:
+            # turn back, with a smaller step but never stopping altogether
+            self.step = 1 / self.step ** 0.5
+            if abs(math.log(self.step)) < math.log(1.1):
+                self.step = 1.1 if self.step > 1 else 1 / 1.1
+        self.rate = rate
+
+        size = self._clip(self.size * self.step)
+        if size != self.size:
+            msg = '\tBatch size {} rows (~{:.0f} bytes per row, {:.0f} rows/sec)'.format(size,
+                self.row_size,rate)
+            logging.debug(msg)
+        self.size = size
+
+# marks the end of the stream of batches
+_PIPELINE_DONE = object()
+
+def _pipeline_batches(batches,depth):
+    """
+    Drains an iterator of batches in a separate thread, through a queue of
+    at most depth batches. Yields the batches in order. Errors raised by 
+    the iterator are raised in the calling thread.
+
+    Args:
+        batches (obj): Generator of batches, see _fetch_batches.
+        depth (int): Maximum number of queued batches.
+    """
+    pipe = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                pipe.put(item,timeout=1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        item = _PIPELINE_DONE
+        try:
+            for data in batches:
+                if not put(data):
+                    return
+        except Exception as e:
+            item = e
+        finally:
+            batches.close()
+        put(item)
+
+    thread = threading.Thread(target=produce)
+    thread.daemon = True
+    thread.start()
+    try:
+        while True:
+            item = pipe.get()
+            if item is _PIPELINE_DONE:
+                break
+            elif isinstance(item,Exception):
+                raise item
+            yield item
+    finally:
+        # stop the producer if the consumer finishes early
+        stop.set()
+        thread.join()
+
+def _get_rowid_ranges(engine,schema,table_name,chunks):
+    """
+    Split a table into ROWID ranges of roughly equal numbers of blocks, 
+    using the extent map in DBA_EXTENTS. Returns [None] (i.e. read the 
+    whole table) if the ranges cannot be determined, for example when the 
+    dictionary views are not accessible or the table is partitioned.
+
+    Args:
+        engine (obj): Database engine.
+        schema (str): Name of the schema.
+        table_name (str): Name of the table.
+        chunks (int): Number of ranges to create.
+    """
+    query = """
+        SELECT ROWIDTOCHAR(DBMS_ROWID.ROWID_CREATE(1, o.data_object_id, lo_fno, lo_block, 0)),
+               ROWIDTOCHAR(DBMS_ROWID.ROWID_CREATE(1, o.data_object_id, hi_fno, hi_block, 32767))
+        FROM (SELECT DISTINCT grp,
+                     FIRST_VALUE(relative_fno) OVER (PARTITION BY grp 
+                         ORDER BY relative_fno, block_id 
+                         ROWS BETWEEN UNBOUNDED PRECEDING AND UNBOUNDED FOLLOWING) lo_fno,
+                     FIRST_VALUE(block_id) OVER (PARTITION BY grp 
+                         ORDER BY relative_fno, block_id 
+                         ROWS BETWEEN UNBOUNDED PRECEDING AND UNBOUNDED FOLLOWING) lo_block,
+                     LAST_VALUE(relative_fno) OVER (PARTITION BY grp 
+                         ORDER BY relative_fno, block_id 
+                         ROWS BETWEEN UNBOUNDED PRECEDING AND UNBOUNDED FOLLOWING) hi_fno,
+                     LAST_VALUE(block_id + blocks - 1) OVER (PARTITION BY grp 
+                         ORDER BY relative_fno, block_id 
+                         ROWS BETWEEN UNBOUNDED PRECEDING AND UNBOUNDED FOLLOWING) hi_block
+              FROM (SELECT relative_fno, block_id, blocks,
+                           TRUNC((SUM(blocks) OVER (ORDER BY relative_fno, block_id) - 0.01) / 
+                               (SUM(blocks) OVER () / :chunks)) grp
+                    FROM dba_extents
+                    WHERE owner = :owner AND segment_name = :table_name 
+                        AND segment_type = 'TABLE')) e,
+             dba_objects o
+        WHERE o.owner = :owner AND o.object_name = :table_name 
+            AND o.object_type = 'TABLE'
+        ORDER BY grp"""
+    try:
+        ranges = engine.execute(sqlalchemy.text(query),chunks=chunks,
+            owner=schema.upper(),table_name=table_name.upper()).fetchall()
+    except:
+        ranges = None
+
+    if not ranges or any(lo is None or hi is None for lo, hi in ranges):
+        msg = "Unable to split {}.{} into ROWID ranges. Reading as a single query.".format(schema,
+            table_name)
+        logging.info(msg)
+        return [None]
+
+    return [(lo, hi) for lo, hi in ranges]
+
+# rows in each ROWID range that is sorted for checkpoints
+_CHECKPOINT_RANGE_ROWS = 1000000
+
+def _get_copy_plan(source_engine,source_schema,table,batchsize=10000,paging='cursor',
+    rowid_range=None,pipeline=False,memory_budget_mb=1024,checkpoint=False,
+    last_rowid=None,lob_inline_kb=None,partition=None):
+    """
+    Plan the copy of a table: the queries that read it, the batch sizer 
+    and the depth of the pipeline queue. Returns a tuple of (queries, 
+    sizer, depth, lob_columns, ordered), where lob_columns is None unless 
+    large LOBs are streamed, and ordered is True if the rows are read in 
+    ROWID order with the ROWID as the last column, so that the progress 
+    can be checkpointed. See _copy_data for the arguments.
+
+    Args:
+        source_engine (obj): Database engine.
+        source_schema (obj): Name of schema to migrate.
+        table (obj): SQLAlchemy table object.
+        batchsize (int): Number of rows in each batch, or None.
+        paging (str): 'cursor' or 'rowid'.
+        rowid_range (tuple): First and last ROWID to copy.
+        pipeline (bool): Fetch batches in a separate thread.
+        memory_budget_mb (int): Memory available for batches.
+        checkpoint (bool): Read rows in ROWID order, with the ROWID as the
+            last column. Only bounded ROWID ranges are sorted, so the table
+            is read as a series of ranges. If it cannot be split into 
+            ranges, it is read unordered and ordered is False.
+        last_rowid (str): Resume the copy after this ROWID.
+        lob_inline_kb (int): Fetch LOBs up to this many KB with the row.
+        partition (str): Copy only this partition of the table.
+    """
+    # large LOBs are only streamed from Oracle
+    lob_columns = _get_lob_columns(table)
+    if not lob_columns or source_engine.dialect.name != 'oracle':
+        lob_inline_kb = None
+    columns = _get_column_string(table,lob_inline_kb)
+
+    # each query seeks to its own rows, so no batch rereads earlier rows
+    num_rows, avg_row_len = _get_table_stats(source_engine,source_schema,table.name)
+
+    # batches held in memory: the batch being written, plus the batch 
+    # being fetched and the queue between them when pipelining
+    if pipeline and batchsize:
+        depth = _get_queue_depth(batchsize,avg_row_len,memory_budget_mb)
+    else:
+        depth = _ADAPTIVE_QUEUE_DEPTH
+    sizer = _BatchSizer(memory_budget_mb,depth + 2 if pipeline else 2,avg_row_len,batchsize)
+
+    if rowid_range:
+        rowid_ranges = [rowid_range]
+    elif paging == 'rowid' and not partition:
+        chunks = max(1,int(math.ceil(float(num_rows or 0) / sizer())))
+        rowid_ranges = _get_rowid_ranges(source_engine,source_schema,
+            table.name,chunks)
+    elif checkpoint and not partition:
+        # sorting the whole table would delay the first row until the 
+        # sort is done, so only ranges of a bounded size are sorted
+        chunks = max(1,int(math.ceil(float(num_rows or 0) / _CHECKPOINT_RANGE_ROWS)))
+        rowid_ranges = _get_rowid_ranges(source_engine,source_schema,
+            table.name,chunks)
+    else:
+        rowid_ranges = [None]
+    ordered = checkpoint and all(rowid_ranges)
+    if checkpoint and not ordered:
+        msg = "{}.{} is read unordered, so it is loaded in one transaction and checkpointed when it is complete.".format(source_schema,
+            table.name)
+        logging.info(msg)
+    if ordered:
+        columns = columns + ', ROWIDTOCHAR(rowid)'
+    # the rows up to last_rowid were copied in order, whatever the order now
+    queries = [_get_select_query(columns,source_schema,table.name,r,last_rowid,
+        order=ordered,partition=partition) for r in rowid_ranges]
+
+    if lob_inline_kb is None:
+        lob_columns = None
+
+    return queries, sizer, depth, lob_columns, ordered
+
+def _copy_data(source_engine,source_schema,target_engine,table,
+    batchsize=10000,logged=True,trialrun=False,load_method='copy',paging='cursor',
+    rowid_range=None,pipeline=False,memory_budget_mb=1024,checkpoint=False,
+    last_rowid=None,strip_nulls=False,metrics_dir=None,run_id=None,lob_inline_kb=None,
+    columnar=False,partition=None,freeze=False,owner=None,lease_lost=None):
+    """
+    Copies the data into the target system. Disables integrity checks 
+    prior to inserting.
+
+    Args:
+        source_engine (obj): Database engine.
+        source_schema (obj): Name of schema to migrate.
+        target_engine (obj): Database engine.
+        table (obj): SQLAlchemy table object.
+        batchsize (int): Number of rows to migrate in each batch, or None to
+            size batches automatically within the memory budget.
+        logged (bool): Enable or disable Postgres logging.
+        trialrun (bool): Run in trial mode.
+        load_method (str): 'copy' or 'insert'. See _insert_data.
+        paging (str): 'cursor' to stream the table through a single query, or
+            'rowid' to read it as a series of ROWID extent ranges.
+        rowid_range (tuple): Copy only the rows between this first and last
+            ROWID. Overrides paging.
+        pipeline (bool): Fetch batches in a separate thread while the 
+            previous batches are written.
+        memory_budget_mb (int): Memory available for batches.
+        checkpoint (bool): Record the work item in the checkpoint table 
+            when it is done, and the last ROWID of each batch if the rows 
+            can be read in sorted ROWID ranges (see _get_copy_plan). Rows 
+            read unordered cannot be resumed part way, so they are loaded 
+            in one transaction that commits with the 'done' checkpoint.
+        last_rowid (str): Resume the copy after this ROWID.
+        strip_nulls (bool): Remove null characters from strings.
+        metrics_dir (str): Directory for metrics of each batch. Default None.
+        run_id (str): Identifier of the migration run, for the metrics.
+        lob_inline_kb (int): Fetch LOBs up to this many KB with the row, and
+            stream larger LOBs into the target in pieces. None fetches all 
+            LOBs with the row.
+        columnar (bool): Encode batches for COPY column by column.
+        partition (str): Copy only this partition of the table, into its 
+            own table on the target if it has one (see 
+            _get_partition_target). Overrides paging.
+        freeze (bool): Truncate the table and load it in a single 
+            transaction with COPY FREEZE, so the rows are written frozen 
+            and, with wal_level=minimal, with almost no WAL. Used in place
+            of switching logging off and on, which rewrites the table. 
+            Falls back to a normal load if the table cannot be frozen 
+            (e.g. it is a ROWID chunk, it resumes after last_rowid, or 
+            COPY FREEZE fails). Checkpoints are only saved when the table
+            is complete.
+        owner (str): Distributed worker that holds the work item. If 
+            another worker has claimed it, the checkpoint fails and the 
+            batch is rolled back, see _save_checkpoint.
+        lease_lost (obj): threading.Event, set if the owner loses the work
+            item. The copy stops at the next batch.
+
+    Returns:
+        dict: Rows and bytes copied, and seconds spent fetching, 
+            transforming and writing.
+    """
+    # create DB-API connections. sqlalchemy is only used for reflection.
+    source_connection = source_engine.raw_connection()
+    target_connection = target_engine.raw_connection()
+    target_cursor = target_connection.cursor()
+
+    batches = None
+    failed = False
+    try:
+        # print schema
+        msg = 'Began copy of {}.{} at {}'.format(source_schema,table.name,
+            datetime.strftime(datetime.now(),"%Y-%m-%d %H:%M:%S"))
+        logging.info(msg)
+
+        # range and list partitions are loaded straight into their own table
+        target = None
+        if partition:
+            target = _get_partition_target(target_cursor,source_schema,table.name,partition)
+        target_name = target or _PG_PREPARER.format_table(table)
+
+        # the whole table is written by this work item, so it can be 
+        # truncated. a resumed item keeps the rows copied before last_rowid.
+        freeze = freeze and load_method == 'copy' and not rowid_range and not last_rowid and \
+            (not partition or target)
+        if freeze:
+            try:
+                target_cursor.execute('SAVEPOINT freeze_load')
+                target_cursor.execute('TRUNCATE {}'.format(target_name))
+            except:
+                target_connection.rollback()
+                freeze = False
+                msg = "Unable to truncate {}.{}. Loading without FREEZE.".format(source_schema,table.name)
+                logging.info(msg)
+
+        # switch off logging
+        logswitch = False
+        if not logged and not freeze:
+            try: 
+                target_cursor.execute('ALTER TABLE {} SET UNLOGGED'.format(target_name))
+                logswitch = True
+            except:
+                target_connection.rollback()
+                msg = "Unable to disable logging for {}.{}".format(source_schema,table.name)
+                logging.info(msg)
+
+        queries, sizer, depth, lob_columns, ordered = _get_copy_plan(source_engine,source_schema,
+            table,batchsize,paging,rowid_range,pipeline,memory_budget_mb,checkpoint,last_rowid,
+            lob_inline_kb,partition)
+
+        # an item read unordered has no progress to resume from, so none 
+        # of its rows are committed until it is done
+        atomic = checkpoint and not ordered
+
+        fetch_times = collections.deque()
+        batches = _fetch_batches(source_connection,queries,sizer,fetch_times,lob_columns,
+            len(table.columns))
+        if pipeline:
+            batches = _pipeline_batches(batches,depth)
+
+        stats = _new_copy_stats()
+        last = time.time()
+        for data in batches:
+            start = time.time()
+
+            # another worker is copying the item
+            if lease_lost is not None and lease_lost.is_set():
+                raise _LeaseLost('{} no longer holds {}.{}'.format(owner,source_schema,table.name))
+
+            # insert the data
+            if ordered:
+                progress = {'schema': source_schema, 'table_name': table.name, 
+                    'rowid_range': rowid_range, 'last_rowid': data[-1][-1], 
+                    'rows': len(data), 'partition': partition, 'owner': owner}
+                data = [row[:-1] for row in data]
+            else:
+                progress = None
+            write_start = time.time()
+            if freeze:
+                try:
+                    nbytes, serialize_seconds = _insert_data(target_connection,table,data,
+                        strip_nulls=strip_nulls,columnar=columnar,target=target,freeze=True,
+                        commit=False)
+                except psycopg2.Error as e:
+                    # only the first COPY FREEZE shows whether the server allows it
+                    if stats['rows']:
+                        raise
+                    target_cursor.execute('ROLLBACK TO SAVEPOINT freeze_load')
+                    freeze = False
+                    msg = "Unable to load {}.{} with COPY FREEZE. Loading without it: {}".format(source_schema,
+                        table.name,e)
+                    logging.info(msg)
+            if not freeze:
+                nbytes, serialize_seconds = _insert_data(target_connection,table,data,
+                    method=load_method,checkpoint=progress,strip_nulls=strip_nulls,
+                    columnar=columnar,target=target,commit=not atomic)
+            finish = time.time()
+
+            # record the throughput of the batch
+            batch = {'rows': len(data), 'bytes': nbytes, 
+                'fetch_seconds': fetch_times.popleft(),
+                'transform_seconds': write_start - start + serialize_seconds,
+                'write_seconds': finish - write_start - serialize_seconds}
+            _add_copy_stats(stats,batch)
+            sizer.update(data,finish - last)
+            last = finish
+            if metrics_dir:
+                batch.update({'type': 'batch', 'run_id': run_id, 'schema': source_schema, 
+                    'table': table.name, 'worker': multiprocessing.current_process().name,
+                    'time': datetime.now().isoformat()})
+                _write_metrics(metrics_dir,batch)
+            msg = '\tCopied {} rows of {}.{} at {}'.format(stats['rows'],source_schema,
+                table.name,datetime.strftime(datetime.now(),"%Y-%m-%d %H:%M:%S"))
+            logging.debug(msg)
+
+            # break after a couple of batches
+            if trialrun and stats['rows'] > 200:
+                break
+
+        batches.close()
+
+        # switch on database logging
+        if logswitch:
+            target_cursor.execute('ALTER TABLE {} SET LOGGED'.format(target_name))
+
+        if checkpoint:
+            # frozen and unordered loads are checkpointed with the whole item
+            _save_checkpoint(target_connection,source_schema,table.name,rowid_range,
+                rows=stats['rows'] if freeze or atomic else 0,status='done',partition=partition,
+                owner=owner)
+        target_connection.commit()
+
+        # record end
+        msg = 'Finished copy of {}.{} at {}'.format(source_schema,table.name,
+            datetime.strftime(datetime.now(),"%Y-%m-%d %H:%M:%S"))
+        logging.info(msg)
+    except:
+        # discard the partial work of the item
+        failed = True
+        try:
+            target_connection.rollback()
+        except:
+            pass
+        raise
+    finally:
+        # close the connections
+        if batches is not None:
+            batches.close()
+        target_cursor.close()
+        if failed:
+            # the pool replaces connections that may be broken or part way
+            # through a fetch, rather than reusing them for the next table
+            source_connection.invalidate()
+            target_connection.invalidate()
+        source_connection.close()
+        target_connection.close()
+
+    return stats
+
+def _convert_type(colname, ora_type, schema_name='',
+    table_name='', number_types='numeric', profile=None, report=None):
+    """
+    Converts a data type in the source (Oracle) database to a Postgres type.
+
+    Args:
+        colname (str): Name of the column.
+        ora_type (obj): Data type in the source (Oracle) database.
+        schema_name (str): Name of the schema.
+        table_name (str): Name of the table.
+        number_types (str): 'numeric' to convert every number to NUMERIC, 
+            or 'declared' or 'profile' to narrow the type, see 
+            _narrow_number.
+        profile (tuple): Profile of the data in a number column, see 
+            _profile_numbers.
+        report (list): If given, a dict describing the conversion of a 
+            number column is appended to it.
+    """
+    pg_type = ora_type
+    
+    # "NullType is used as a default type for those cases 
+    # where a type cannot be determined"
+    # NB: this needs to be first in the list
+    # Otherwise str(ora_type) clauses will error
+    if isinstance(ora_type,sqlalchemy.types.NullType):
+        pg_type = sqlalchemy.types.String()
+        logging.info('\t{}.{}.{}: NULL DETECTED'.format(schema_name, table_name,
+            colname))
+        return pg_type
+    elif number_types != 'numeric' and isinstance(ora_type,(sqlalchemy.types.Numeric,
+        sqlalchemy.types.Integer)):
+        pg_type, reason = _narrow_number(ora_type,profile)
+        if report is not None:
+            lo, hi, fractions = profile or (None,None,None)
+            report.append({'schema': schema_name, 'table': table_name, 
+                'column': colname, 'source_type': str(ora_type), 
+                'target_type': str(pg_type), 'reason': reason, 'minimum': lo, 
+                'maximum': hi, 'fractions': fractions})
+    elif isinstance(ora_type,sqlalchemy.types.Numeric):
+        pg_type = sqlalchemy.types.Numeric()
+    elif isinstance(ora_type,sqlalchemy.types.DateTime):
+        pg_type = TIMESTAMP()
+    elif isinstance(ora_type,sqlalchemy.types.Text):
+        pg_type = sqlalchemy.types.Text()
+    elif isinstance(ora_type,sqlalchemy.types.NVARCHAR):
+        pg_type = sqlalchemy.types.VARCHAR()
+    elif isinstance(ora_type,sqlalchemy.types.BLOB):
+        pg_type = BYTEA()
+    elif str(ora_type) == 'RAW':
+        pg_type = BYTEA()
+    # this isn't currently catching the binary_float
+    elif str(ora_type) == 'BINARY_FLOAT':
+        pg_type = REAL()
+    elif str(ora_type) == 'INTERVAL DAY TO SECOND':
+        pg_type = sqlalchemy.types.Interval(second_precision=True)
+    else:
+        pass
+
+    if pg_type != ora_type:
+        msg = "\t{}.{}.{}: {} converted to {}".format(schema_name, table_name,
+            colname, ora_type, pg_type)
+        logging.info(msg)
+
+    return pg_type
+
+def _new_copy_stats():
+    """
+    Create an empty record of copy throughput.
+    """
+    return {'rows': 0, 'bytes': 0, 'fetch_seconds': 0.0, 
+        'transform_seconds': 0.0, 'write_seconds': 0.0}
+
+def _add_copy_stats(total,stats):
+    """
+    Add a record of copy throughput to a running total.
+
+    Args:
+        total (dict): Running total, see _new_copy_stats.
+        stats (dict): Record to add.
+    """
+    for key in _new_copy_stats():
+        total[key] += stats[key]
+
+def _write_metrics(metrics_dir,record):
+    """
+    Append a record to the JSON-lines metrics file. Each record is written
+    with a single call, so records from several processes do not mix.
+
+    Args:
+        metrics_dir (str): Directory for metrics.
+        record (dict): Values to record.
+    """
+    os.makedirs(metrics_dir,exist_ok=True)
+    with open(os.path.join(metrics_dir,'metrics.jsonl'),'a') as f:
+        f.write(json.dumps(record) + '\n')
+
+def _get_table_metrics(timings):
+    """
+    Combine the results of the work items into totals per table. Returns a
+    dict keyed on (schema, table) with the copy stats, plus the elapsed 
+    seconds from the first start to the last finish.
+
+    Args:
+        timings (list): Results of _migrate_table.
+    """
+    tables = {}
+    for schema, table_name, worker, start, finish, stats in timings:
+        table = tables.setdefault((schema,table_name),dict(_new_copy_stats(),
+            start=start,finish=finish))
+        _add_copy_stats(table,stats)
+        table['start'] = min(table['start'],start)
+        table['finish'] = max(table['finish'],finish)
+    for table in tables.values():
+        table['seconds'] = (table['finish'] - table['start']).total_seconds()
+
+    return tables
+
+def _write_prometheus(metrics_dir,timings):
+    """
+    Write the table and worker totals in the Prometheus text format, for 
+    the node exporter textfile collector. The file is replaced atomically.
+
+    Args:
+        metrics_dir (str): Directory for metrics.
+        timings (list): Results of _migrate_table.
+    """
+    lines = []
+    metrics = [('rows','oracle2postgres_table_rows_total','counter','Rows copied.'),
+        ('bytes','oracle2postgres_table_bytes_total','counter','Bytes copied.'),
+        ('seconds','oracle2postgres_table_seconds','gauge','Elapsed time of the copy.')]
+    tables = _get_table_metrics(timings)
+    for key, name, kind, description in metrics:
+        lines.append('# HELP {} {}'.format(name,description))
+        lines.append('# TYPE {} {}'.format(name,kind))
+        for (schema, table_name), table in sorted(tables.items()):
+            lines.append('{}{{schema="{}",table="{}"}} {}'.format(name,schema,table_name,table[key]))
+
+    name = 'oracle2postgres_table_stage_seconds'
+    lines.append('# HELP {} Time spent in each stage of the copy.'.format(name))
+    lines.append('# TYPE {} counter'.format(name))
+    for (schema, table_name), table in sorted(tables.items()):
+        for stage in ('fetch','transform','write'):
+            lines.append('{}{{schema="{}",table="{}",stage="{}"}} {}'.format(name,schema,
+                table_name,stage,table[stage + '_seconds']))
+
+    workers = {}
+    for schema, table_name, worker, start, finish, stats in timings:
+        workers[worker] = workers.get(worker,0) + stats['rows']
+    name = 'oracle2postgres_worker_rows_total'
+    lines.append('# HELP {} Rows copied by each worker.'.format(name))
+    lines.append('# TYPE {} counter'.format(name))
+    for worker, rows in sorted(workers.items()):
+        lines.append('{}{{worker="{}"}} {}'.format(name,worker,rows))
+
+    path = os.path.join(metrics_dir,'oracle2postgres.prom')
+    with open(path + '.tmp','w') as f:
+        f.write('\n'.join(lines) + '\n')
+    os.replace(path + '.tmp',path)
+
+def _log_metrics_summary(timings,n=10):
+    """
+    Print and log the throughput of the slowest tables, and where their 
+    time was spent.
+
+    Args:
+        timings (list): Results of _migrate_table.
+        n (int): Number of tables to report. Default 10.
+    """
+    tables = _get_table_metrics(timings)
+    slowest = sorted(tables.items(),key=lambda x: x[1]['seconds'],reverse=True)[:n]
+
+    lines = ['Slowest tables:']
+    for (schema, table_name), table in slowest:
+        seconds = table['seconds'] or 1e-9
+        stages = table['fetch_seconds'] + table['transform_seconds'] + table['write_seconds'] or 1e-9
+        lines.append('\t{}.{}: {:.1f}s, {:.0f} rows/s, {:.2f} MB/s (fetch {:.0%}, transform {:.0%}, write {:.0%})'.format(
+            schema,table_name,table['seconds'],table['rows'] / seconds,
+            table['bytes'] / seconds / 1024 / 1024,table['fetch_seconds'] / stages,
+            table['transform_seconds'] / stages,table['write_seconds'] / stages))
+    msg = '\n'.join(lines)
+    print(msg)
+    logging.info(msg)
+
+# memory of a worker process before it holds any batches
+_WORKER_BASE_MB = 100
+# copy rate for tables without a measured throughput
+_DEFAULT_MB_PER_SECOND = 10
+
+def _get_lob_sizes(engine,schema):
+    """
+    Get the LOB columns of the tables in a schema from ALL_LOBS. Returns a
+    dict of table name to (number of LOB columns, bytes in the LOB 
+    segments). The sizes are 0 if DBA_SEGMENTS is not accessible, and the 
+    dict is empty if ALL_LOBS is not (e.g. the source is not Oracle).
+
+    Args:
+        engine (obj): Database engine.
+        schema (str): Name of the schema.
+    """
+    queries = ["""SELECT l.table_name, COUNT(*), SUM(NVL((SELECT SUM(s.bytes) FROM dba_segments s 
+                      WHERE s.owner = l.owner AND s.segment_name = l.segment_name),0))
+                  FROM all_lobs l 
+                  WHERE l.owner = :owner
+                  GROUP BY l.table_name""",
+               """SELECT table_name, COUNT(*), 0
+                  FROM all_lobs 
+                  WHERE owner = :owner
+                  GROUP BY table_name"""]
+    for query in queries:
+        try:
+            result = engine.execute(sqlalchemy.text(query),owner=schema.upper())
+            return {name.lower(): (int(n),int(size or 0)) for name, n, size in result}
+        except:
+            pass
+
+    return {}
+
+def _get_throughput_history(metrics_dir):
+    """
+    Get the throughput of each table in earlier runs from the work item 
+    records in metrics.jsonl. Returns a dict keyed on (schema, table) with
+    the rows copied per second by one worker, from the latest run that 
+    copied the table.
+
+    Args:
+        metrics_dir (str): Directory for metrics.
+    """
+    path = os.path.join(metrics_dir or '','metrics.jsonl')
+    if not metrics_dir or not os.path.exists(path):
+        return {}
+
+    runs = {}
+    with open(path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if record.get('type') != 'work_item' or not record.get('rows'):
+                continue
+            seconds = (datetime.fromisoformat(record['finish']) - 
+                datetime.fromisoformat(record['start'])).total_seconds()
+            key = (record['schema'],record['table'])
+            run = runs.get(key)
+            if not run or run['run_id'] != record.get('run_id'):
+                run = runs[key] = {'run_id': record.get('run_id'), 'rows': 0, 'seconds': 0.0}
+            run['rows'] += record['rows']
+            run['seconds'] += seconds
+
+    return {key: run['rows'] / max(run['seconds'],1e-6) for key, run in runs.items()}
+
+def _calibrate_table(source_engine,schema,table_name,rows,migration_config):
+    """
+    Read and encode the first rows of a table as the copy would, without 
+    writing them, and return the rows per second. The target is not used,
+    so the rate is an upper bound when the target is the bottleneck.
+
+    Args:
+        source_engine (obj): Database engine.
+        schema (str): Name of the schema.
+        table_name (str): Name of the table.
+        rows (int): Number of rows to read.
+        migration_config (dict): Settings for the migration.
+    """
+    t = _get_table(source_engine,schema,table_name,migration_config.get('metadata_cache'))
+    source_connection = source_engine.raw_connection()
+    queries, sizer, depth, lob_columns, ordered = _get_copy_plan(source_engine,schema,t,
+        migration_config['batchsize'] or rows,memory_budget_mb=migration_config.get('memory_budget_mb',1024),
+        lob_inline_kb=migration_config.get('lob_inline_kb'))
+
+    start = time.time()
+    copied = 0
+    batches = _fetch_batches(source_connection,queries,min(sizer(),rows),
+        lob_columns=lob_columns,ncols=len(t.columns))
+    for data in batches:
+        stream = _get_copy_stream(t,data,migration_config.get('strip_nulls',False),
+            migration_config.get('columnar',False))
+        while stream.read(_LOB_PIECE_SIZE):
+            pass
+        copied += len(data)
+        if copied >= rows:
+            break
+    batches.close()
+    seconds = time.time() - start
+    source_connection.close()
+
+    msg = 'Calibrated {}.{}: {} rows in {:.1f} seconds'.format(schema,table_name,copied,seconds)
+    logging.info(msg)
+
+    return copied / max(seconds,1e-6) if copied else None
+
+def _get_item_memory(migration_config,avg_row_len,lob_columns=0,lob_bytes_per_row=0):
+    """
+    Estimate the memory in bytes used by the batches of a work item, as 
+    sized by _get_copy_plan and _BatchSizer. Inline LOBs are held with the
+    row, and streamed LOBs one piece at a time.
+
+    Args:
+        migration_config (dict): Settings for the migration.
+        avg_row_len (int): Average row length in bytes, or None if unknown.
+        lob_columns (int): Number of LOB columns.
+        lob_bytes_per_row (float): Average bytes of LOB data in each row.
+    """
+    batchsize = migration_config['batchsize']
+    budget = migration_config.get('memory_budget_mb',1024)
+    pipeline = migration_config.get('pipeline',False)
+    lob_inline_kb = migration_config.get('lob_inline_kb')
+
+    row_size = (avg_row_len or 100) * _ROW_MEMORY_FACTOR
+    pieces = 0
+    if lob_columns and lob_inline_kb is not None:
+        row_size += min(lob_bytes_per_row,lob_columns * lob_inline_kb * 1024)
+        pieces = _LOB_PIECE_SIZE
+    elif lob_columns:
+        row_size += lob_bytes_per_row
+
+    if pipeline and batchsize:
+        held = _get_queue_depth(batchsize,avg_row_len,budget) + 2
+    else:
+        held = _ADAPTIVE_QUEUE_DEPTH + 2 if pipeline else 2
+    if batchsize:
+        return held * batchsize * row_size + pieces
+    # automatic batches are capped by the budget, within the limits on size
+    return max(held * _MIN_BATCHSIZE * row_size,min(budget * 1024 * 1024,
+        held * _MAX_BATCHSIZE * row_size)) + pieces
+
+def _get_makespan(durations,workers):
+    """
+    Estimate the wall-clock time of a list of work items on a number of 
+    workers. Each item goes to the first free worker, largest first, as 
+    migrate hands them out.
+
+    Args:
+        durations (list): Seconds taken by each work item.
+        workers (int): Number of workers.
+    """
+    loads = [0.0] * max(1,workers)
+    for seconds in sorted(durations,reverse=True):
+        loads[loads.index(min(loads))] += seconds
+
+    return max(loads)
+
+def plan_migration(source_config,migration_config,workers=None,calibrate_rows=0,
+    path='migration_plan.csv'):
+    """
+    Plan a migration without copying any data. Reads the sizes of the 
+    tables, partitions and LOBs from DBA_SEGMENTS, ALL_TABLES and ALL_LOBS,
+    splits the tables into work items as migrate would, and estimates the 
+    duration of each item from the throughput of the table in earlier runs
+    (see 'metrics_dir'), from a short calibration read, or from the average
+    rate of the measured tables. Prints the plan and the expected 
+    wall-clock time for each number of workers, and writes the plan to a 
+    CSV file. Building the keys and indexes is not included.
+
+    Args:
+        source_config (dict): Settings for source database.
+        migration_config (dict): Settings for the migration.
+        workers (list): Numbers of workers to estimate the wall-clock time 
+            for. Default 1, 2, 4, 8 and 16 workers.
+        calibrate_rows (int): Read this many rows from each of the largest 
+            tables that have no measured throughput. Default 0.
+        path (str): File for the plan, or None.
+    """
+    msg = 'Planning migration...\n'
+    print(msg)
+    logging.info(msg)
+
+    source_engine = connect_to_source(source_config)
+    schema_list = source_config['schema_list']
+    work_items = _split_work_items(source_engine,_get_work_items(source_engine,schema_list),
+        migration_config)
+
+    # sizes and statistics of each table
+    tables = {}
+    lobs = {}
+    for schema in schema_list:
+        for table_name, lob in _get_lob_sizes(source_engine,schema).items():
+            lobs[(schema,table_name)] = lob
+    for schema, table_name, size, rowid_range, partition in work_items:
+        table = tables.setdefault((schema,table_name),{'size': 0, 'items': 0})
+        table['size'] += size
+        table['items'] += 1
+    for (schema, table_name), table in tables.items():
+        table['num_rows'], table['avg_row_len'] = _get_table_stats(source_engine,schema,table_name)
+        table['lob_columns'], table['lob_bytes'] = lobs.get((schema,table_name.lower()),(0,0))
+
+    # rows per second for one worker
+    rates = _get_throughput_history(migration_config.get('metrics_dir'))
+    sources = {key: 'history' for key in rates}
+    if calibrate_rows:
+        largest = sorted(tables.items(),key=lambda x: x[1]['size'] + x[1]['lob_bytes'],reverse=True)
+        for key, table in [x for x in largest if x[0] not in rates][:5]:
+            rate = _calibrate_table(source_engine,key[0],key[1],calibrate_rows,migration_config)
+            if rate:
+                rates[key], sources[key] = rate, 'calibrated'
+    source_engine.dispose()
+
+    # tables that were not measured are copied at the average byte rate
+    byte_rates = [rates[key] * (table['avg_row_len'] + table['lob_bytes'] / float(table['num_rows']))
+        for key, table in tables.items() if key in rates and table['num_rows'] and table['avg_row_len']]
+    if byte_rates:
+        default_rate = sum(byte_rates) / len(byte_rates)
+    else:
+        default_rate = _DEFAULT_MB_PER_SECOND * 1024 * 1024
+
+    plan = []
+    for schema, table_name, size, rowid_range, partition in work_items:
+        key = (schema,table_name)
+        table = tables[key]
+        share = float(size) / table['size'] if table['size'] else 1.0 / table['items']
+        rows = int((table['num_rows'] or 0) * share)
+        lob_bytes_per_row = table['lob_bytes'] / float(table['num_rows']) if table['num_rows'] else 0
+
+        if partition:
+            strategy = 'partition {}'.format(partition)
+        elif rowid_range:
+            strategy = 'split {}'.format(table['items'])
+        else:
+            strategy = 'single'
+        if not table['lob_columns']:
+            lob_mode = ''
+        elif migration_config.get('lob_inline_kb') is None:
+            lob_mode = 'inline'
+        else:
+            lob_mode = 'stream > {} KB'.format(migration_config['lob_inline_kb'])
+
+        if key in rates and rows:
+            seconds, source = rows / rates[key], sources[key]
+        else:
+            seconds, source = (size + table['lob_bytes'] * share) / default_rate, 'estimated'
+        if not size and not table['num_rows']:
+            source = 'no statistics'
+        memory = _get_item_memory(migration_config,table['avg_row_len'],
+            table['lob_columns'],lob_bytes_per_row)
+
+        plan.append({'schema': schema, 'table': table_name, 'partition': partition or '',
+            'strategy': strategy, 'lob_mode': lob_mode, 
+            'size_mb': round((size + table['lob_bytes'] * share) / 1024.0 / 1024,1),
+            'rows': rows, 'estimate': source, 'seconds': round(seconds,1),
+            'memory_mb': round(memory / 1024.0 / 1024,1)})
+
+    if path:
+        with open(path,'w',newline='') as f:
+            writer = csv.DictWriter(f,fieldnames=['schema','table','partition','strategy',
+                'lob_mode','size_mb','rows','estimate','seconds','memory_mb'])
+            writer.writeheader()
+            writer.writerows(plan)
+
+    # every worker must fit the largest work item
+    worker_mb = _WORKER_BASE_MB + max([x['memory_mb'] for x in plan] or [0])
+    durations = [x['seconds'] for x in plan]
+    lines = ['Migration plan ({} work items, {:.1f} GB, plan written to {}):'.format(len(plan),
+        sum([x['size_mb'] for x in plan]) / 1024,path)]
+    for item in sorted(plan,key=lambda x: x['seconds'],reverse=True)[:10]:
+        lines.append('\t{}.{}: {}{}, {:.0f} MB, {:.0f}s ({}), {:.0f} MB of batches'.format(
+            item['schema'],item['table'],item['strategy'],
+            ', LOBs ' + item['lob_mode'] if item['lob_mode'] else '',
+            item['size_mb'],item['seconds'],item['estimate'],item['memory_mb']))
+    for n in workers or [1,2,4,8,16]:
+        lines.append('\t{} workers: {}, about {:.0f} MB in total'.format(n,
+            timedelta(seconds=int(_get_makespan(durations,n))),n * worker_mb))
+    msg = '\n'.join(lines)
+    print(msg)
+    logging.info(msg)
+
+    return plan
+
+class _AsyncTarget(object):
+    """
+    Connection to the target database for the asyncio copy engine. Uses 
+    asyncpg if it is installed, otherwise a psycopg2 connection that is 
+    driven from the thread pool.
+
+    Args:
+        connect_args (dict): user, password, host, port and database.
+        executor (obj): Thread pool for blocking calls.
+    """
+    def __init__(self,connect_args,executor):
+        self.connect_args = connect_args
+        self.executor = executor
+        self.connection = None
+        # an open transaction that holds batches until the next checkpoint
+        self.transaction = None
+        self.held = False
+        # the last call in the thread pool, which runs on after a cancel
+        self.pending = None
+
+    async def _run(self,func,*args):
+        self.pending = self.executor.submit(func,*args)
+        return await asyncio.wrap_future(self.pending)
+
+    async def connect(self):
+        if asyncpg:
+            self.connection = await asyncpg.connect(**self.connect_args)
+            # disable integrity checks for the session
+            await self.connection.execute("SET session_replication_role = replica;")
+        else:
+            self.connection = await self._run(functools.partial(psycopg2.connect,**self.connect_args))
+            await self._run(_set_target_session,self.connection,None)
+
+    async def begin(self):
+        """
+        Hold every batch in one transaction, until it is committed with 
+        the next checkpoint, see save_checkpoint.
+        """
+        self.held = True
+        if asyncpg:
+            self.transaction = self.connection.transaction()
+            await self.transaction.start()
+
+    async def execute(self,statement):
+        """
+        Run a statement in its own transaction, or in the held transaction.
+        """
+        if asyncpg:
+            await self.connection.execute(statement)
+        else:
+            await self._run(self._execute,statement)
+
+    def _execute(self,statement):
+        cursor = self.connection.cursor()
+        try:
+            cursor.execute(statement)
+            if not self.held:
+                self.connection.commit()
+        except:
+            self.connection.rollback()
+            raise
+        finally:
+            cursor.close()
+
+    async def copy(self,table,data,target,strip_nulls=False,columnar=False,checkpoint=None):
+        """
+        Copy a batch of rows into the target table, and save the checkpoint
+        in the same transaction. Returns the characters sent and the seconds
+        spent serializing them.
+
+        Args:
+            table (obj): SQLAlchemy table object.
+            data (list): Rows to copy, with values in table column order.
+            target (tuple): Schema and name of the table to copy into.
+            strip_nulls (bool): Remove null characters from strings.
+            columnar (bool): Encode the rows column by column.
+            checkpoint (dict): Arguments for _save_checkpoint.
+        """
+        if not asyncpg:
+            quoted = '{}.{}'.format(_PG_PREPARER.quote_schema(target[0]),_PG_PREPARER.quote(target[1]))
+            return await self._run(_insert_data,self.connection,table,data,'copy',checkpoint,
+                strip_nulls,columnar,quoted,False,not self.held)
+
+        stream = _get_copy_stream(table,data,strip_nulls,columnar)
+        async with self.connection.transaction():
+            await self.connection.copy_to_table(target[1],schema_name=target[0],
+                columns=[col.name for col in table.columns],source=self._encode(stream),
+                format='text')
+            if checkpoint:
+                await self._save_checkpoint(**checkpoint)
+
+        return stream.chars_read, stream.seconds
+
+    async def _encode(self,stream):
+        """
+        Read a COPY stream in pieces, as UTF-8 bytes for copy_to_table. 
+        Pieces are serialized in the thread pool, as LOB locators are read 
+        from the source.
+
+        Args:
+            stream (obj): COPY stream, see _get_copy_stream.
+        """
+        while True:
+            piece = await self._run(stream.read,_LOB_PIECE_SIZE)
+            if not piece:
+                return
+            yield piece.encode('utf-8')
+
+    async def save_checkpoint(self,checkpoint):
+        """
+        Save a checkpoint in its own transaction, or commit it with the 
+        held transaction.
+
+        Args:
+            checkpoint (dict): Arguments for _save_checkpoint.
+        """
+        if asyncpg:
+            await self._save_checkpoint(**checkpoint)
+            if self.transaction:
+                await self.transaction.commit()
+                self.transaction = None
+        else:
+            await self._run(self._commit_checkpoint,checkpoint)
+        self.held = False
+
+    def _commit_checkpoint(self,checkpoint):
+        _save_checkpoint(self.connection,**checkpoint)
+        self.connection.commit()
+
+    async def _save_checkpoint(self,schema,table_name,rowid_range,last_rowid=None,
+        rows=0,status='running',partition=None):
+        # as _save_checkpoint, with asyncpg parameters
+        lo_rowid, hi_rowid = rowid_range or ('','')
+        await self.connection.execute("""
+            UPDATE {}.checkpoint 
+            SET status = $1, last_rowid = COALESCE($2, last_rowid), 
+                rows_copied = rows_copied + $3, updated_at = now()
+            WHERE schema_name = $4 AND table_name = $5 AND partition_name = $6
+                AND lo_rowid = $7 AND hi_rowid = $8""".format(_CONTROL_SCHEMA),
+            status,last_rowid,rows,schema,table_name,partition or '',lo_rowid,hi_rowid)
+
+    async def close(self,discard=False):
+        """
+        Close the connection. Discarding it (e.g. after an error, or part 
+        way through a batch) rolls back the open transaction without 
+        waiting on the server.
+
+        Args:
+            discard (bool): Discard the connection. Default False.
+        """
+        if self.pending and not self.pending.done():
+            # a cancelled copy still holds the connection, and may be 
+            # reading from the source
+            if discard and self.connection is not None and not asyncpg:
+                self.connection.cancel()
+            await asyncio.wait([asyncio.wrap_future(self.pending)])
+        if self.connection is None:
+            return
+        if asyncpg and discard:
+            self.connection.terminate()
+        elif asyncpg:
+            await self.connection.close()
+        else:
+            await self._run(self._close,discard)
+
+    def _close(self,discard):
+        if discard:
+            try:
+                self.connection.rollback()
+            except:
+                pass
+        self.connection.close()
+
+def _get_connect_args(engine):
+    """
+    Get the arguments to connect to a Postgres database from an engine, 
+    for psycopg2.connect or asyncpg.connect.
+
+    Args:
+        engine (obj): Database engine.
+    """
+    url = engine.url
+    args = {'user': url.username, 'password': url.password, 'host': url.host, 
+        'port': url.port, 'database': url.database}
+    return {key: value for key, value in args.items() if value is not None}
+
+async def _copy_work_item_async(slots,executor,source_engine,connect_args,table,target,
+    migration_config,rowid_range=None,last_rowid=None,partition=None):
+    """
+    Copy a work item as a stream of the asyncio copy engine. Fetches run in
+    the thread pool, and the next batch is fetched while the last batch is
+    written. Returns a tuple of (schema, table_name, worker, start, finish,
+    stats), see _migrate_table.
+
+    Args:
+        slots (obj): asyncio.Queue of free stream numbers, which limits 
+            the number of streams.
+        executor (obj): Thread pool for blocking calls.
+        source_engine (obj): Database engine.
+        connect_args (dict): Arguments to connect to the target database.
+        table (obj): SQLAlchemy table object.
+        target (tuple): Schema and name of the table to copy into.
+        migration_config (dict): Settings for the migration.
+        rowid_range (tuple): First and last ROWID of the chunk to copy.
+        last_rowid (str): Resume the copy after this ROWID.
+        partition (str): Name of the partition to copy.
+    """
+    slot = await slots.get()
+    loop = asyncio.get_event_loop()
+    source_connection = None
+    target_connection = _AsyncTarget(connect_args,executor)
+    batches = None
+    pending = None
+    failed = False
+    try:
+        worker = 'stream-{}'.format(slot)
+        schema = table.schema
+        start = datetime.now()
+        msg = '{} started {}.{}'.format(worker,schema,table.name)
+        logging.info(msg)
+
+        # the memory budget is shared by the streams
+        checkpoint = migration_config.get('checkpoint',False)
+        pipeline = migration_config.get('pipeline',False)
+        queries, sizer, depth, lob_columns, ordered = await loop.run_in_executor(executor,
+            functools.partial(_get_copy_plan,source_engine,schema,table,
+            migration_config['batchsize'],migration_config.get('paging','cursor'),rowid_range,
+            pipeline,migration_config.get('memory_budget_mb',1024) / migration_config['concurrency'],
+            checkpoint,last_rowid,migration_config.get('lob_inline_kb'),partition))
+
+        source_connection = await loop.run_in_executor(executor,source_engine.raw_connection)
+        await target_connection.connect()
+
+        # chunks and partitions are switched by migrate for the whole table
+        logswitch = False
+        if not migration_config['logged'] and not rowid_range and not partition:
+            try:
+                await target_connection.execute('ALTER TABLE {}.{} SET UNLOGGED'.format(
+                    _PG_PREPARER.quote_schema(target[0]),_PG_PREPARER.quote(target[1])))
+                logswitch = True
+            except Exception:
+                msg = "Unable to disable logging for {}.{}".format(*target)
+                logging.info(msg)
+
+        # an item read unordered has no progress to resume from, so none 
+        # of its rows are committed until it is done
+        if checkpoint and not ordered:
+            await target_connection.begin()
+
+        # the fetch runs in the thread pool. pending is kept to wait for it
+        # before the cursor is closed, even if the stream is cancelled.
+        fetch_times = collections.deque()
+        batches = _fetch_batches(source_connection,queries,sizer,fetch_times,lob_columns,
+            len(table.columns))
+        pending = executor.submit(next,batches,None)
+        stats = _new_copy_stats()
+        last = time.time()
+        while True:
+            data = await asyncio.wrap_future(pending)
+            if data is None:
+                break
+            if pipeline:
+                pending = executor.submit(next,batches,None)
+
+            if ordered:
+                progress = {'schema': schema, 'table_name': table.name, 
+                    'rowid_range': rowid_range, 'last_rowid': data[-1][-1], 
+                    'rows': len(data), 'partition': partition}
+                data = [row[:-1] for row in data]
+            else:
+                progress = None
+            write_start = time.time()
+            nbytes, serialize_seconds = await target_connection.copy(table,data,target,
+                migration_config.get('strip_nulls',False),migration_config.get('columnar',False),
+                progress)
+            finish = time.time()
+
+            _add_copy_stats(stats,{'rows': len(data), 'bytes': nbytes, 
+                'fetch_seconds': fetch_times.popleft(), 'transform_seconds': serialize_seconds,
+                'write_seconds': finish - write_start - serialize_seconds})
+            sizer.update(data,finish - last)
+            last = finish
+            if not pipeline:
+                pending = executor.submit(next,batches,None)
+
+            if migration_config['trialrun'] and stats['rows'] > 200:
+                break
+
+        if logswitch:
+            await target_connection.execute('ALTER TABLE {}.{} SET LOGGED'.format(
+                _PG_PREPARER.quote_schema(target[0]),_PG_PREPARER.quote(target[1])))
+        if checkpoint:
+            await target_connection.save_checkpoint({'schema': schema, 
+                'table_name': table.name, 'rowid_range': rowid_range, 
+                'rows': 0 if ordered else stats['rows'], 'status': 'done', 
+                'partition': partition})
+
+        finish = datetime.now()
+        msg = '{} finished {}.{} ({:.1f} seconds)'.format(worker,schema,table.name,
+            (finish - start).total_seconds())
+        logging.info(msg)
+    except BaseException:
+        # including cancellation, when another stream has failed
+        failed = True
+        raise
+    finally:
+        # a failed stream discards its connections, which rolls back the
+        # batch in progress
+        await target_connection.close(discard=failed)
+        if pending is not None:
+            await asyncio.wait([asyncio.wrap_future(pending)])
+        if source_connection is not None:
+            await loop.run_in_executor(executor,_close_source,source_connection,
+                batches,failed)
+        slots.put_nowait(slot)
+
+    return schema, table.name, worker, start, finish, stats
+
+def _close_source(source_connection,batches,discard=False):
+    """
+    Close the batches and the source connection of an asyncio stream.
+
+    Args:
+        source_connection (obj): DB-API connection from the source engine.
+        batches (obj): Generator of batches, see _fetch_batches, or None.
+        discard (bool): Discard the connection rather than return it to the 
+            pool. Default False.
+    """
+    if batches is not None:
+        batches.close()
+    if discard:
+        source_connection.invalidate()
+    source_connection.close()
+
+async def _copy_work_items_async(work_items,source_config,target_config,migration_config):
+    """
+    Copy the work items with up to 'concurrency' streams at a time. See 
+    _migrate_async.
+
+    Args:
+        work_items (list): List of (schema, table, size, rowid_range, 
+            partition, last_rowid) work items.
+        source_config (dict): Settings for source database.
+        target_config (dict): Settings for target database.
+        migration_config (dict): Settings for the migration.
+    """
+    loop = asyncio.get_event_loop()
+    concurrency = migration_config['concurrency']
+    # each stream may fetch a batch while it serializes the last one
+    executor = concurrent.futures.ThreadPoolExecutor(2 * concurrency)
+    slots = asyncio.Queue()
+    for slot in range(concurrency):
+        slots.put_nowait(slot)
+
+    # a connection for each stream, rather than a pool shared by the streams
+    source_engine = connect_to_source(dict(source_config,engine_args=dict(source_config.get('engine_args',{}),
+        poolclass=sqlalchemy.pool.NullPool)))
+    target_engine = connect_to_target(target_config,target_config['database'])
+    connect_args = _get_connect_args(target_engine)
+
+    # reflect each table once, in parallel, and find the partitions that 
+    # are copied into their own table
+    names = sorted(set([(x[0],x[1]) for x in work_items]))
+    reflected = await asyncio.gather(*[loop.run_in_executor(executor,_get_table,source_engine,
+        schema,table_name,migration_config.get('metadata_cache')) for schema, table_name in names])
+    tables = dict(zip(names,reflected))
+    targets = {}
+    for schema, table_name, size, rowid_range, partition, last_rowid in work_items:
+        targets[(schema,table_name,partition)] = (schema,table_name)
+    if any([x[4] for x in work_items]):
+        target_connection = target_engine.raw_connection()
+        cursor = target_connection.cursor()
+        for schema, table_name, size, rowid_range, partition, last_rowid in work_items:
+            if partition and _get_partition_target(cursor,schema,table_name,partition):
+                targets[(schema,table_name,partition)] = (schema,
+                    _get_partition_table_name(table_name,partition))
+        cursor.close()
+        target_connection.close()
+
+    if migration_config.get('load_method','copy') != 'copy':
+        msg = "The asyncio copy engine always loads with COPY."
+        logging.info(msg)
+    if migration_config.get('freeze',False):
+        msg = "The asyncio copy engine does not load with COPY FREEZE."
+        logging.info(msg)
+
+    tasks = [asyncio.ensure_future(_copy_work_item_async(slots,executor,source_engine,
+        connect_args,tables[(schema,table_name)],targets[(schema,table_name,partition)],
+        migration_config,rowid_range,last_rowid,partition))
+        for schema, table_name, size, rowid_range, partition, last_rowid in work_items]
+    try:
+        results = await asyncio.gather(*tasks)
+    except BaseException:
+        # stop the other streams, and wait for them to close their 
+        # connections before the thread pool is shut down
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks,return_exceptions=True)
+        raise
+    finally:
+        executor.shutdown()
+        source_engine.dispose()
+        target_engine.dispose()
+
+    return results
+
+def _migrate_async(work_items,source_config,target_config,migration_config):
+    """
+    Copy the work items concurrently in this process with asyncio, as up 
+    to 'concurrency' streams at a time. Most of a copy is spent waiting on
+    the databases, so one process can keep many streams busy. Source 
+    queries run in a thread pool, as cx_Oracle blocks. The target is 
+    loaded with asyncpg if it is installed, otherwise with psycopg2 in the
+    thread pool. Returns the results of the work items, see _migrate_table.
+
+    Args:
+        work_items (list): List of (schema, table, size, rowid_range, 
+            partition, last_rowid) work items.
+        source_config (dict): Settings for source database.
+        target_config (dict): Settings for target database.
+        migration_config (dict): Settings for the migration.
+    """
+    msg = 'Copying with up to {} concurrent streams using {}'.format(migration_config['concurrency'],
+        'asyncpg' if asyncpg else 'psycopg2')
+    logging.info(msg)
+    print(msg)
+
+    return asyncio.run(_copy_work_items_async(work_items,source_config,target_config,
+        migration_config))
+
+def migrate(source_config,target_config,migration_config,resume=False):
+    """
+    Migrate data from the source database to the target database. The target
+    database and schema must already exist.
+
+    Args:
+        source_config (dict): Settings for source database.
+        target_config (dict): Settings for target database.
+        migration_config (dict): Settings for the migration.
+        resume (bool): Continue an interrupted migration from the checkpoints
+            recorded on the target database. Default False.
+    """
+    msg = 'Migrating data to target database...\n'
+    print(msg)
+
+    # label the metrics of this run
+    migration_config = dict(migration_config,run_id=datetime.now().strftime("%Y%m%d%H%M%S"))
+    metrics_dir = migration_config.get('metrics_dir')
+
+    target_engine = connect_to_target(target_config,target_config['database'])
+
+    # one work item per table or table chunk, largest first
+    if resume:
+        work_items = _get_checkpoints(target_engine)
+        msg = 'Resuming migration with {} work items remaining.'.format(len(work_items))
+        logging.info(msg)
+        print(msg)
+    else:
+        source_engine = connect_to_source(source_config)
+        work_items = _get_work_items(source_engine,source_config['schema_list'])
+        work_items = _split_work_items(source_engine,work_items,migration_config)
+        source_engine.dispose()
+        if migration_config.get('checkpoint',False):
+            _create_checkpoints(target_engine,work_items)
+        if migration_config.get('delta',False):
+            # changes made during the bulk load are picked up by the first sync
+            _record_high_water_marks(source_config,target_engine,migration_config)
+        work_items = [x + (None,) for x in work_items]
+    arg_iterable = [[schema,table_name,source_config,target_config,migration_config,
+        rowid_range,last_rowid,partition] for schema, table_name, size, rowid_range, partition, 
+        last_rowid in work_items]
+
+    # chunks and partitions of a table are loaded concurrently, so switch 
+    # logging for the whole table rather than in each work item
+    split_tables = _get_shared_tables(work_items)
+    if split_tables and not migration_config['logged']:
+        for schema, table_name in split_tables:
+            _set_logged(target_engine,schema,table_name,False)
+
+    start = datetime.now()
+
+    # copy concurrently in this process, or set up multiprocessing
+    if migration_config.get('concurrency'):
+        processes = migration_config['concurrency']
+        pool = None
+        results = _migrate_async(work_items,source_config,target_config,migration_config)
+    elif migration_config['multiprocess']:
+
+        # set number of processes
+        if migration_config['processes']:
+            processes = int(migration_config['processes'])
+        else: 
+            processes = multiprocessing.cpu_count()
+        pool = multiprocessing.Pool(processes)
+
+        # chunksize=1 hands out the next table whenever a worker is free
+        results = pool.imap_unordered(_migrate_table_args,arg_iterable,chunksize=1)
+    else:
+        processes = 1
+        pool = None
+        results = (_migrate_table(*args) for args in arg_iterable)
+
+    # update the metrics as each work item finishes
+    timings = []
+    for result in results:
+        timings.append(result)
+        if metrics_dir:
+            schema, table_name, worker, began, finish, stats = result
+            _write_metrics(metrics_dir,dict(stats,type='work_item',run_id=migration_config['run_id'],
+                schema=schema,table=table_name,worker=worker,start=began.isoformat(),
+                finish=finish.isoformat()))
+            _write_prometheus(metrics_dir,timings)
+    if pool:
+        pool.close()
+        pool.join()
+
+    if split_tables and not migration_config['logged']:
+        for schema, table_name in split_tables:
+            _set_logged(target_engine,schema,table_name,True)
+    target_engine.dispose()
+
+    # report how busy the workers were kept
+    elapsed = (datetime.now() - start).total_seconds()
+    busy = sum([(finish - began).total_seconds() for _, _, _, began, finish, _ in timings])
+    if elapsed:
+        msg = 'Copied {} work items in {:.1f} seconds with {} workers ({:.0%} utilization)'.format(len(timings),
+            elapsed,processes,busy / (elapsed * processes))
+        logging.info(msg)
+    _log_metrics_summary(timings)
+
+    msg = 'Migration complete!\n'
+    logging.info(msg)
+    print(msg)
+
+# seconds a distributed worker holds a work item without a heartbeat
+_LEASE_SECONDS = 300
+# seconds between checks of the work queue
+_POLL_SECONDS = 10
+# attempts at a work item before it is marked as failed
+_MAX_ATTEMPTS = 3
+
+def _claim_work_item(engine,worker,lease_seconds=_LEASE_SECONDS):
+    """
+    Claim the largest pending work item in the checkpoint table, or an 
+    item whose lease has expired (e.g. its worker died). SKIP LOCKED lets 
+    many workers claim items at once without waiting on each other. 
+    Returns (schema, table, size, rowid_range, partition, last_rowid, 
+    attempts), or None if no item is available.
+
+    Args:
+        engine (obj): Database engine for the target database.
+        worker (str): Name of the worker.
+        lease_seconds (int): Seconds the item is held without a heartbeat.
+    """
+    query = """UPDATE {0}.checkpoint c
+               SET status = 'running', worker = :worker, attempts = c.attempts + 1,
+                   lease_until = now() + :lease_seconds * interval '1 second', 
+                   updated_at = now()
+               FROM (SELECT schema_name, table_name, partition_name, lo_rowid, hi_rowid
+                     FROM {0}.checkpoint 
+                     WHERE status = 'pending' OR (status = 'running' AND lease_until < now())
+                     ORDER BY size_bytes DESC
+                     LIMIT 1
+                     FOR UPDATE SKIP LOCKED) n
+               WHERE c.schema_name = n.schema_name AND c.table_name = n.table_name 
+                   AND c.partition_name = n.partition_name 
+                   AND c.lo_rowid = n.lo_rowid AND c.hi_rowid = n.hi_rowid
+               RETURNING c.schema_name, c.table_name, c.size_bytes, c.lo_rowid, c.hi_rowid, 
+                   c.partition_name, c.last_rowid, c.attempts""".format(_CONTROL_SCHEMA)
+    con = engine.connect()
+    trans = con.begin()
+    row = con.execute(sqlalchemy.text(query),worker=worker,lease_seconds=lease_seconds).fetchone()
+    trans.commit()
+    con.close()
+
+    if not row:
+        return None
+    schema, table_name, size, lo_rowid, hi_rowid, partition, last_rowid, attempts = row
+    rowid_range = (lo_rowid,hi_rowid) if lo_rowid else None
+    return schema, table_name, size, rowid_range, partition or None, last_rowid, attempts
+
+def _update_work_item(engine,item,worker,values,status='running'):
+    """
+    Update a work item in the checkpoint table, if it is still held by the
+    worker. Returns False if the item was claimed by another worker (e.g. 
+    after its lease expired).
+
+    Args:
+        engine (obj): Database engine for the target database.
+        item (tuple): Work item, see _claim_work_item.
+        worker (str): Name of the worker.
+        values (str): SET clause, e.g. "status = 'pending'".
+        status (str): Only update the item if it has this status. 
+            Default 'running'.
+    """
+    schema, table_name, size, rowid_range, partition = item[:5]
+    lo_rowid, hi_rowid = rowid_range or ('','')
+    query = """UPDATE {}.checkpoint 
+               SET {}
+               WHERE schema_name = :schema_name AND table_name = :table_name 
+                   AND partition_name = :partition_name
+                   AND lo_rowid = :lo_rowid AND hi_rowid = :hi_rowid
+                   AND worker = :worker AND (:status IS NULL OR status = :status)""".format(_CONTROL_SCHEMA,values)
+    result = engine.execute(sqlalchemy.text(query),schema_name=schema,table_name=table_name,
+        partition_name=partition or '',lo_rowid=lo_rowid,hi_rowid=hi_rowid,worker=worker,
+        status=status)
+
+    return result.rowcount > 0
+
+def _heartbeat(engine,item,worker,lease_seconds,stop,lost):
+    """
+    Renew the lease on a work item until stop is set, so that the item is
+    only re-queued if the worker dies or loses its connection. Sets lost 
+    if the item has been claimed by another worker. Runs in a thread.
+
+    Args:
+        engine (obj): Database engine for the target database.
+        item (tuple): Work item, see _claim_work_item.
+        worker (str): Name of the worker.
+        lease_seconds (int): Seconds the item is held without a heartbeat.
+        stop (obj): threading.Event, set when the item is finished.
+        lost (obj): threading.Event, set here if the lease is lost.
+    """
+    values = "lease_until = now() + {:d} * interval '1 second'".format(int(lease_seconds))
+    while not stop.wait(lease_seconds / 3.0):
+        try:
+            if not _update_work_item(engine,item,worker,values):
+                msg = "{} lost the lease on {}.{}. Stopping the copy.".format(worker,
+                    item[0],item[1])
+                logging.warning(msg)
+                lost.set()
+                return
+        except:
+            msg = "{} was unable to renew the lease on {}.{}".format(worker,item[0],item[1])
+            logging.warning(msg)
+
+def _wait_for_queue(engine,worker):
+    """
+    Wait until the coordinator has created the work queue on the target 
+    database. The target database may be recreated by the coordinator in
+    the meantime, so connection errors are retried.
+
+    Args:
+        engine (obj): Database engine for the target database.
+        worker (str): Name of the worker.
+    """
+    query = "SELECT 1 FROM {}.checkpoint LIMIT 1".format(_CONTROL_SCHEMA)
+    while True:
+        try:
+            if engine.execute(query).fetchone():
+                return
+        except:
+            pass
+        msg = '{} is waiting for the coordinator to create the work queue'.format(worker)
+        logging.info(msg)
+        time.sleep(_POLL_SECONDS)
+
+def _run_worker(source_config,target_config,migration_config):
+    """
+    Claim and copy work items from the queue on the target database until
+    no items are left, see work. Returns the results of the work items, 
+    see _migrate_table.
+
+    Args:
+        source_config (dict): Settings for source database.
+        target_config (dict): Settings for target database.
+        migration_config (dict): Settings for the migration.
+    """
+    worker = '{}-{}'.format(socket.gethostname(),os.getpid())
+    lease_seconds = migration_config.get('lease_seconds',_LEASE_SECONDS)
+    metrics_dir = migration_config.get('metrics_dir')
+    target_engine = _get_engine(target_config,target_config['database'],target=True)
+    _wait_for_queue(target_engine,worker)
+
+    timings = []
+    while True:
+        item = _claim_work_item(target_engine,worker,lease_seconds)
+        if not item:
+            # items held by other workers are re-queued if their lease expires
+            remaining = target_engine.execute("""SELECT COUNT(*) FROM {}.checkpoint 
+                WHERE status IN ('pending','running')""".format(_CONTROL_SCHEMA)).scalar()
+            if not remaining:
+                break
+            time.sleep(_POLL_SECONDS)
+            continue
+
+        schema, table_name, size, rowid_range, partition, last_rowid, attempts = item
+        if attempts > 1:
+            msg = '{} retrying {}.{} (attempt {})'.format(worker,schema,table_name,attempts)
+            logging.info(msg)
+
+        stop = threading.Event()
+        lost = threading.Event()
+        heartbeat = threading.Thread(target=_heartbeat,args=(target_engine,item,worker,
+            lease_seconds,stop,lost),daemon=True)
+        heartbeat.start()
+        try:
+            result = _migrate_table(schema,table_name,source_config,target_config,
+                migration_config,rowid_range,last_rowid,partition,worker,lost)
+        except _LeaseLost as e:
+            # the uncommitted batch was rolled back. the item now belongs 
+            # to another worker, so it is left as it is
+            stop.set()
+            heartbeat.join()
+            msg = '{} stopped copying {}.{}: {}'.format(worker,schema,table_name,e)
+            logging.warning(msg)
+            continue
+        except Exception as e:
+            stop.set()
+            heartbeat.join()
+            status = 'failed' if attempts >= _MAX_ATTEMPTS else 'pending'
+            msg = '{} was unable to copy {}.{}, marking it {}: {}'.format(worker,schema,table_name,
+                status,e)
+            logging.error(msg)
+            # the next attempt continues from the last checkpoint. the rows
+            # of an unordered item are rolled back with it, so it restarts
+            _update_work_item(target_engine,item,worker,
+                "status = '{}', lease_until = NULL".format(status))
+            continue
+        stop.set()
+        heartbeat.join()
+        _update_work_item(target_engine,item,worker,'lease_until = NULL',status=None)
+
+        timings.append(result)
+        if metrics_dir:
+            schema, table_name, _, began, finish, stats = result
+            _write_metrics(metrics_dir,dict(stats,type='work_item',run_id=migration_config['run_id'],
+                schema=schema,table=table_name,worker=worker,start=began.isoformat(),
+                finish=finish.isoformat()))
+
+    msg = '{} finished: no work items left'.format(worker)
+    logging.info(msg)
+
+    return timings
+
+def _run_worker_args(args):
+    """
+    Calls _run_worker with a list of arguments, for Pool.map.
+
+    Args:
+        args (list): Arguments for _run_worker.
+    """
+    return _run_worker(*args)
+
+def work(source_config,target_config,migration_config):
+    """
+    Run workers for a distributed migration. Workers on any number of 
+    hosts claim work items from the queue that the coordinator writes to 
+    the target database (see distribute), copy them, and mark them done. 
+    A worker renews the lease on its item while it copies, and an item 
+    whose lease expires is claimed again and continues from its last 
+    checkpoint, or from the start if it is read unordered. Every commit 
+    of a worker updates its checkpoint, fenced on the worker, so no rows 
+    are committed after the item is claimed again. A worker that loses 
+    its item stops copying it. With 'multiprocess', several workers are 
+    run on this host. Returns when the queue is empty.
+
+    Args:
+        source_config (dict): Settings for source database.
+        target_config (dict): Settings for target database.
+        migration_config (dict): Settings for the migration. Must match
+            the settings of the coordinator.
+    """
+    # items are resumed from their checkpoints when they are re-queued
+    migration_config = dict(migration_config,checkpoint=True,
+        run_id=datetime.now().strftime("%Y%m%d%H%M%S"))
+
+    if migration_config['multiprocess']:
+        processes = int(migration_config['processes'] or multiprocessing.cpu_count())
+    else:
+        processes = 1
+    msg = 'Starting {} distributed workers on {}...\n'.format(processes,socket.gethostname())
+    print(msg)
+    logging.info(msg)
+
+    args = [source_config,target_config,migration_config]
+    if processes > 1:
+        pool = multiprocessing.Pool(processes)
+        timings = sum(pool.map(_run_worker_args,[args] * processes,chunksize=1),[])
+        pool.close()
+        pool.join()
+    else:
+        timings = _run_worker(*args)
+
+    if timings:
+        _log_metrics_summary(timings)
+    msg = 'Worker complete! Copied {} work items.\n'.format(len(timings))
+    logging.info(msg)
+    print(msg)
+
+def _get_queue_status(engine):
+    """
+    Count the work items in the queue by status. Returns a dict of status 
+    to (items, rows copied).
+
+    Args:
+        engine (obj): Database engine for the target database.
+    """
+    query = """SELECT status, COUNT(*), SUM(rows_copied) 
+               FROM {}.checkpoint 
+               GROUP BY status""".format(_CONTROL_SCHEMA)
+
+    return {status: (n, int(rows or 0)) for status, n, rows in engine.execute(query)}
+
+def distribute(source_config,target_config,migration_config,resume=False):
+    """
+    Coordinate a distributed migration. Writes the work items to a queue 
+    in the checkpoint table on the target database, then reports progress
+    until the workers (see work) have copied every item. The target 
+    database and schema must already exist.
+
+    Args:
+        source_config (dict): Settings for source database.
+        target_config (dict): Settings for target database.
+        migration_config (dict): Settings for the migration.
+        resume (bool): Keep the queue of an earlier distributed migration, 
+            and queue its failed items again. Default False.
+    """
+    msg = 'Distributing migration to workers...\n'
+    print(msg)
+    logging.info(msg)
+
+    target_engine = connect_to_target(target_config,target_config['database'])
+    if resume:
+        split_tables = target_engine.execute("""SELECT DISTINCT schema_name, table_name 
+            FROM {}.checkpoint WHERE lo_rowid <> '' OR partition_name <> ''""".format(_CONTROL_SCHEMA)).fetchall()
+    else:
+        source_engine = connect_to_source(source_config)
+        work_items = _get_work_items(source_engine,source_config['schema_list'])
+        work_items = _split_work_items(source_engine,work_items,migration_config)
+        source_engine.dispose()
+        split_tables = _get_shared_tables(work_items)
+
+    # chunks and partitions of a table are loaded by several workers, so 
+    # switch logging for the whole table before they can claim the items
+    if split_tables and not migration_config['logged']:
+        for schema, table_name in split_tables:
+            _set_logged(target_engine,schema,table_name,False)
+
+    # publish the queue. workers start copying as soon as items are pending
+    if resume:
+        target_engine.execute("""UPDATE {}.checkpoint 
+            SET status = 'pending', attempts = 0, lease_until = NULL
+            WHERE status = 'failed'""".format(_CONTROL_SCHEMA))
+    else:
+        if migration_config.get('delta',False):
+            # changes made during the bulk load are picked up by the first sync
+            _record_high_water_marks(source_config,target_engine,migration_config)
+        _create_checkpoints(target_engine,work_items)
+
+    start = datetime.now()
+    last = None
+    expired = """SELECT schema_name, table_name, worker 
+                 FROM {}.checkpoint 
+                 WHERE status = 'running' AND lease_until < now()""".format(_CONTROL_SCHEMA)
+    while True:
+        counts = _get_queue_status(target_engine)
+        if counts != last:
+            msg = 'Work items: {}'.format(', '.join(['{} {} ({} rows)'.format(n,status,rows)
+                for status, (n, rows) in sorted(counts.items())]))
+            logging.info(msg)
+            print(msg)
+            last = counts
+        for schema, table_name, worker in target_engine.execute(expired):
+            msg = 'The lease of {} on {}.{} has expired. The item will be copied again.'.format(worker,
+                schema,table_name)
+            logging.warning(msg)
+        if not counts.get('pending') and not counts.get('running'):
+            break
+        time.sleep(_POLL_SECONDS)
+
+    if split_tables and not migration_config['logged']:
+        for schema, table_name in split_tables:
+            _set_logged(target_engine,schema,table_name,True)
+
+    failed = target_engine.execute("""SELECT schema_name, table_name, partition_name, lo_rowid, hi_rowid 
+        FROM {}.checkpoint WHERE status = 'failed'""".format(_CONTROL_SCHEMA)).fetchall()
+    target_engine.dispose()
+
+    msg = 'Copied {} rows in {:.1f} seconds'.format(sum([x[1] for x in counts.values()]),
+        (datetime.now() - start).total_seconds())
+    logging.info(msg)
+    if failed:
+        msg = '{} work items failed: {}. Rerun the coordinator with --resume to queue them again.'.format(len(failed),
+            ', '.join(['{}.{}'.format(x[0],x[1]) for x in failed]))
+        logging.error(msg)
+        sys.exit(msg)
+
+    msg = 'Migration complete!\n'
+    logging.info(msg)
+    print(msg)
+
+# version of the staging manifest
+_STAGING_VERSION = 1
+
+# fast gzip compression, so extraction keeps up with the source
+_STAGING_COMPRESSLEVEL = 1
+
+def _get_staged_schema_ddl(source_engine,schema_list,migration_config):
+    """
+    Get the DDL that create_target_schema would run on the target 
+    database, by running it against a mock engine.
+
+    Args:
+        source_engine (obj): Database engine.
+        schema_list (list): List of schema.
+        migration_config (dict): Settings for the migration.
+    """
+    statements = []
+    def executor(sql,*multiparams,**params):
+        statements.append(sql if isinstance(sql,str) else str(sql.compile(dialect=mock_engine.dialect)))
+    mock_engine = sqlalchemy.create_engine('postgresql://',strategy='mock',executor=executor)
+    create_target_schema(schema_list,source_engine,mock_engine,
+        cache_dir=migration_config.get('metadata_cache'),
+        number_types=migration_config.get('number_types','numeric'),
+        type_report=migration_config.get('type_report'),
+        processes=migration_config.get('processes') or 4,
+        partitions=migration_config.get('partitions',False))
+
+    return statements
+
+def _export_table(schema,table_name,source_config,migration_config,path,
+    rowid_range=None,partition=None):
+    """
+    Extract a source table (or a ROWID range or partition of the table) to
+    a gzipped file in the COPY text format. The file is written under a 
+    temporary name and renamed when it is complete. Returns a tuple of 
+    (schema, table_name, worker, start, finish, stats), see _migrate_table.
+
+    Args:
+        schema (str): Name of schema.
+        table_name (str): Name of table.
+        source_config (dict): Settings for source database.
+        migration_config (dict): Settings for the migration.
+        path (str): Path of the staging file.
+        rowid_range (tuple): First and last ROWID of the chunk to extract.
+        partition (str): Name of the partition to extract.
+    """
+    worker = multiprocessing.current_process().name
+    start = datetime.now()
+    msg = '{} started extract of {}.{} to {}'.format(worker,schema,table_name,path)
+    logging.info(msg)
+
+    source_engine = _get_engine(source_config)
+    t = _get_table(source_engine,schema,table_name,migration_config.get('metadata_cache'))
+    source_connection = source_engine.raw_connection()
+
+    queries, sizer, depth, lob_columns, ordered = _get_copy_plan(source_engine,schema,t,
+        migration_config['batchsize'],rowid_range=rowid_range,
+        memory_budget_mb=migration_config.get('memory_budget_mb',1024),
+        lob_inline_kb=migration_config.get('lob_inline_kb'),partition=partition)
+    fetch_times = collections.deque()
+    batches = _fetch_batches(source_connection,queries,sizer,fetch_times,lob_columns,
+        len(t.columns))
+
+    stats = _new_copy_stats()
+    last = time.time()
+    with gzip.open(path + '.tmp','wt',compresslevel=_STAGING_COMPRESSLEVEL,
+        encoding='utf-8',newline='') as f:
+        for data in batches:
+            write_start = time.time()
+            stream = _get_copy_stream(t,data,migration_config.get('strip_nulls',False),
+                migration_config.get('columnar',False))
+            shutil.copyfileobj(stream,f,_LOB_PIECE_SIZE)
+            finish = time.time()
+            _add_copy_stats(stats,{'rows': len(data), 'bytes': stream.chars_read, 
+                'fetch_seconds': fetch_times.popleft(), 'transform_seconds': stream.seconds,
+                'write_seconds': finish - write_start - stream.seconds})
+            sizer.update(data,finish - last)
+            last = finish
+    os.replace(path + '.tmp',path)
+
+    source_connection.close()
+
+    finish = datetime.now()
+    msg = '{} finished extract of {}.{} ({} rows, {:.1f} seconds)'.format(worker,schema,
+        table_name,stats['rows'],(finish - start).total_seconds())
+    logging.info(msg)
+
+    return schema, table_name, worker, start, finish, stats
+
+def _export_table_args(args):
+    """
+    Calls _export_table with a list of arguments, for Pool.imap_unordered.
+
+    Args:
+        args (list): Arguments for _export_table.
+    """
+    return _export_table(*args)
+
+def export_data(source_config,migration_config,staging_dir):
+    """
+    Extract the source tables to gzipped files in the COPY text format, 
+    for load_data to load into the target database later. The work items 
+    are extracted in parallel, as in migrate. The DDL for the target schema,
+    keys and indexes, and a list of the files, are written to 
+    manifest.json once every file is complete. The target database is not
+    used.
+
+    Args:
+        source_config (dict): Settings for source database.
+        migration_config (dict): Settings for the migration.
+        staging_dir (str): Directory for the staging files. Earlier 
+            staging files in the directory are replaced.
+    """
+    msg = 'Extracting data to {}...\n'.format(staging_dir)
+    print(msg)
+    logging.info(msg)
+
+    os.makedirs(staging_dir,exist_ok=True)
+    manifest_path = os.path.join(staging_dir,'manifest.json')
+    if os.path.exists(manifest_path):
+        os.remove(manifest_path)
+
+    schema_list = source_config['schema_list']
+    source_engine = connect_to_source(source_config)
+    schema_ddl = _get_staged_schema_ddl(source_engine,schema_list,migration_config)
+    table_statements, foreign_keys = _get_target_constraints(source_engine,schema_list,
+        migration_config.get('metadata_cache'))
+    work_items = _get_work_items(source_engine,schema_list)
+    work_items = _split_work_items(source_engine,work_items,migration_config)
+
+    # the columns are listed so that the files can be loaded without the 
+    # source metadata
+    columns = {}
+    files = []
+    arg_iterable = []
+    for i, (schema, table_name, size, rowid_range, partition) in enumerate(work_items):
+        if (schema,table_name) not in columns:
+            t = _get_table(source_engine,schema,table_name,migration_config.get('metadata_cache'))
+            columns[(schema,table_name)] = [col.name for col in t.columns]
+        name = '{}.{}.{:05d}.copy.gz'.format(schema,table_name,i)
+        files.append({'path': name, 'schema': schema, 'table': table_name, 
+            'partition': partition, 'columns': columns[(schema,table_name)], 
+            'size_bytes': size})
+        arg_iterable.append([schema,table_name,source_config,migration_config,
+            os.path.join(staging_dir,name),rowid_range,partition])
+    source_engine.dispose()
+
+    start = datetime.now()
+    if migration_config['multiprocess']:
+        processes = int(migration_config['processes'] or multiprocessing.cpu_count())
+        pool = multiprocessing.Pool(processes)
+        results = pool.imap(_export_table_args,arg_iterable,chunksize=1)
+    else:
+        pool = None
+        results = (_export_table(*args) for args in arg_iterable)
+
+    timings = []
+    for entry, result in zip(files,results):
+        timings.append(result)
+        entry['rows'], entry['bytes'] = result[5]['rows'], result[5]['bytes']
+    if pool:
+        pool.close()
+        pool.join()
+
+    manifest = {'version': _STAGING_VERSION, 'created': datetime.now().isoformat(),
+        'schema_list': schema_list, 'schema_ddl': schema_ddl, 
+        'table_statements': table_statements, 'foreign_keys': foreign_keys, 
+        'files': files}
+    with open(manifest_path + '.tmp','w') as f:
+        json.dump(manifest,f,indent=1)
+    os.replace(manifest_path + '.tmp',manifest_path)
+
+    msg = 'Extracted {} rows to {} files in {:.1f} seconds'.format(sum([x['rows'] for x in files]),
+        len(files),(datetime.now() - start).total_seconds())
+    logging.info(msg)
+    print(msg)
+    _log_metrics_summary(timings)
+
+def _read_manifest(staging_dir):
+    """
+    Read the manifest of a staging directory, see export_data.
+
+    Args:
+        staging_dir (str): Directory of the staging files.
+    """
+    try:
+        with open(os.path.join(staging_dir,'manifest.json')) as f:
+            manifest = json.load(f)
+    except:
+        msg = "No manifest found in {}. Has the extract finished?".format(staging_dir)
+        logging.info(msg)
+        sys.exit(msg)
+    if manifest.get('version') != _STAGING_VERSION:
+        msg = "The manifest in {} is from another version. Extract the data again.".format(staging_dir)
+        sys.exit(msg)
+
+    return manifest
+
+def _load_file(staging_dir,entry,target_config,migration_config,whole_table=False):
+    """
+    Load a staging file into its target table with COPY. The file is 
+    recorded as loaded in the same transaction. Returns a tuple of 
+    (schema, table_name, worker, start, finish, stats), see _migrate_table.
+
+    Args:
+        staging_dir (str): Directory of the staging files.
+        entry (dict): Entry for the file in the manifest.
+        target_config (dict): Settings for target database.
+        migration_config (dict): Settings for the migration.
+        whole_table (bool): The file is the only one for its target table, 
+            so with 'freeze' it is truncated and loaded with COPY FREEZE.
+    """
+    worker = multiprocessing.current_process().name
+    start = datetime.now()
+    schema, table_name = entry['schema'], entry['table']
+
+    target_engine = _get_engine(target_config,target_config['database'],target=True)
+    target_connection = target_engine.raw_connection()
+    cursor = target_connection.cursor()
+
+    failed = False
+    try:
+        # range and list partitions are loaded straight into their own table
+        target = None
+        if entry['partition']:
+            target = _get_partition_target(cursor,schema,table_name,entry['partition'])
+            whole_table = whole_table and bool(target)
+        target = target or '{}.{}'.format(_PG_PREPARER.quote_schema(schema),_PG_PREPARER.quote(table_name))
+        columns = ', '.join([_PG_PREPARER.quote(x) for x in entry['columns']])
+        query = 'COPY {} ({}) FROM STDIN'.format(target,columns)
+
+        # a file that holds a whole table or partition can be loaded frozen
+        freeze = migration_config.get('freeze',False) and whole_table
+        if freeze:
+            cursor.execute('SAVEPOINT freeze_load')
+            try:
+                cursor.execute('TRUNCATE {}'.format(target))
+                with gzip.open(os.path.join(staging_dir,entry['path']),'rt',encoding='utf-8',newline='') as f:
+                    cursor.copy_expert(query + ' WITH (FREEZE)',f,_LOB_PIECE_SIZE)
+            except psycopg2.Error as e:
+                cursor.execute('ROLLBACK TO SAVEPOINT freeze_load')
+                freeze = False
+                msg = "Unable to load {} with COPY FREEZE. Loading without it: {}".format(entry['path'],e)
+                logging.info(msg)
+        if not freeze:
+            with gzip.open(os.path.join(staging_dir,entry['path']),'rt',encoding='utf-8',newline='') as f:
+                cursor.copy_expert(query,f,_LOB_PIECE_SIZE)
+        cursor.execute("""INSERT INTO {}.staged_file (path, rows_loaded, loaded_at) 
+                          VALUES (%(path)s, %(rows)s, now())""".format(_CONTROL_SCHEMA),
+            {'path': entry['path'], 'rows': entry['rows']})
+        target_connection.commit()
+    except:
+        failed = True
+        raise
+    finally:
+        cursor.close()
+        if failed:
+            # the pool replaces the connection rather than reusing it for 
+            # the next file
+            target_connection.invalidate()
+        target_connection.close()
+
+    finish = datetime.now()
+    msg = '{} loaded {} into {} ({:.1f} seconds)'.format(worker,entry['path'],target,
+        (finish - start).total_seconds())
+    logging.info(msg)
+
+    stats = dict(_new_copy_stats(),rows=entry['rows'],bytes=entry['bytes'],
+        write_seconds=(finish - start).total_seconds())
+    return schema, table_name, worker, start, finish, stats
+
+def _load_file_args(args):
+    """
+    Calls _load_file with a list of arguments, for Pool.imap_unordered.
+
+    Args:
+        args (list): Arguments for _load_file.
+    """
+    return _load_file(*args)
+
+def load_data(target_config,migration_config,staging_dir,resume=False):
+    """
+    Load the staging files written by export_data into the target 
+    database. Creates the target schema, loads the files in parallel, 
+    largest first, then creates the keys and indexes. The source database 
+    is not used. The target database must already exist.
+
+    Args:
+        target_config (dict): Settings for target database.
+        migration_config (dict): Settings for the migration.
+        staging_dir (str): Directory of the staging files.
+        resume (bool): Continue an interrupted load, skipping the schema 
+            and the files that were loaded. Default False.
+    """
+    msg = 'Loading data from {}...\n'.format(staging_dir)
+    print(msg)
     logging.info(msg)
 
-def create_database(dbname,engine):
+    manifest = _read_manifest(staging_dir)
+    target_engine = connect_to_target(target_config,target_config['database'])
+
+    if resume:
+        loaded = set([x[0] for x in target_engine.execute("SELECT path FROM {}.staged_file".format(_CONTROL_SCHEMA))])
+    else:
+        for statement in manifest['schema_ddl']:
+            target_engine.execute(statement)
+        target_engine.execute("CREATE SCHEMA IF NOT EXISTS {}".format(_CONTROL_SCHEMA))
+        target_engine.execute("""
+            CREATE TABLE IF NOT EXISTS {}.staged_file (
+                path TEXT PRIMARY KEY,
+                rows_loaded BIGINT NOT NULL,
+                loaded_at TIMESTAMP)""".format(_CONTROL_SCHEMA))
+        loaded = set()
+
+    files = [x for x in manifest['files'] if x['path'] not in loaded]
+    files.sort(key=lambda x: x['bytes'],reverse=True)
+    tables = sorted(set([(x['schema'],x['table']) for x in files]))
+    freeze = migration_config.get('freeze',False)
+    if not migration_config['logged'] and not freeze:
+        for schema, table_name in tables:
+            _set_logged(target_engine,schema,table_name,False)
+
+    # tables and partitions held in a single file can be loaded frozen
+    counts = collections.Counter([(x['schema'],x['table'],x['partition']) for x in manifest['files']])
+
+    start = datetime.now()
+    arg_iterable = [[staging_dir,entry,target_config,migration_config,
+        counts[(entry['schema'],entry['table'],entry['partition'])] == 1] for entry in files]
+    if migration_config['multiprocess']:
+        processes = int(migration_config['processes'] or multiprocessing.cpu_count())
+        pool = multiprocessing.Pool(processes)
+        timings = list(pool.imap_unordered(_load_file_args,arg_iterable,chunksize=1))
+        pool.close()
+        pool.join()
+    else:
+        timings = [_load_file(*args) for args in arg_iterable]
+
+    if not migration_config['logged'] and not freeze:
+        for schema, table_name in tables:
+            _set_logged(target_engine,schema,table_name,True)
+    target_engine.dispose()
+
+    msg = 'Loaded {} rows from {} files in {:.1f} seconds'.format(sum([x['rows'] for x in files]),
+        len(files),(datetime.now() - start).total_seconds())
+    logging.info(msg)
+    print(msg)
+    _log_metrics_summary(timings)
+
+    _create_constraints(target_config,manifest['table_statements'],manifest['foreign_keys'],
+        migration_config)
+
+def _get_current_scn(engine):
     """
-    Creates a new database on the target.
+    Get the current system change number of the source database.
 
     Args:
-        dbname (str): Name of database.
         engine (obj): Database engine.
     """
-    con = engine.connect()
-    con.execute("COMMIT") # need to close current transaction
-    con.execute("CREATE DATABASE {}".format(dbname))
-    con.execute("COMMIT") 
-    con.close()
-    msg = "Target database created: {}".format(dbname)
+    queries = ["SELECT DBMS_FLASHBACK.GET_SYSTEM_CHANGE_NUMBER FROM dual",
+               "SELECT current_scn FROM v$database"]
+    for query in queries:
+        try:
+            return int(engine.execute(query).scalar())
+        except:
+            pass
+
+    msg = "Unable to read the current SCN from the source database."
     logging.info(msg)
+    sys.exit(msg)
 
-def _check_default(default):
-    new_default = default
-    logging.info("CHECKING DEFAULT")
+def _get_high_water_mark(engine,schema,table_name,column=None,scn=None):
+    """
+    Get the current high-water mark of a table: the maximum value of the 
+    last-modified column, or the current SCN if no column is configured.
 
-    if str(default).lower() == "sysdate":
-        logging.info("UPDATED")
-        new_default = None
-    
-    return new_default
+    Args:
+        engine (obj): Database engine.
+        schema (str): Name of schema.
+        table_name (str): Name of table.
+        column (str): Last-modified column, or None for ORA_ROWSCN.
+        scn (int): Current SCN, if already known.
+    """
+    if not column:
+        return scn or _get_current_scn(engine)
 
-def _insert_data(target_session,table,data):
+    return engine.execute("SELECT MAX({}) FROM {}.{}".format(column,schema,
+        table_name)).scalar()
+
+def _encode_high_water_mark(value):
     """
-    Inserts the data into the target system. Disables integrity checks 
-    prior to inserting.
+    Encode a high-water mark as text for the control table.
 
     Args:
-        target_session (obj): SQLAlchemy session.
-        table (obj): SQLAlchemy table object.
-        data (obj): SQLAlchemy data object.
+        value (obj): Number, string, date or datetime.
     """
-    if data:
-        # disable integrity checks
-        target_session.execute("SET session_replication_role = replica;")
-        # insert data
-        target_session.execute(table.insert(),data)
-        # enable integrity checks
-        target_session.execute("SET session_replication_role = DEFAULT;")
-        target_session.commit()
+    if value is None:
+        return None
+    elif isinstance(value,datetime):
+        return 'datetime:' + value.isoformat()
+    elif isinstance(value,date):
+        return 'date:' + value.isoformat()
+    elif isinstance(value,str):
+        return 'text:' + value
+    else:
+        return 'number:' + str(value)
 
-def _get_column_string(table):
+def _decode_high_water_mark(text):
     """
-    Create a string of column names for contructing a query.
+    Decode a high-water mark stored with _encode_high_water_mark.
 
     Args:
-        table (obj): SQLAlchemy table object.
+        text (str): Encoded high-water mark.
     """
-    column_list = table.columns.keys()
-
-    # quote columns that are also keywords. 
-    # assume they are upper case!
-    keywords = ['where','from','select','comment','order']
-    column_list = ['"{}"'.format(x.upper()) if x.lower() in keywords else x for x in column_list] 
-    column_str = ', '.join(column_list)
-    
-    return column_str
+    if text is None:
+        return None
+    kind, value = text.split(':',1)
+    if kind == 'datetime':
+        return datetime.strptime(value,'%Y-%m-%dT%H:%M:%S.%f' if '.' in value else '%Y-%m-%dT%H:%M:%S')
+    elif kind == 'date':
+        return datetime.strptime(value,'%Y-%m-%d').date()
+    elif kind == 'text':
+        return value
+    else:
+        return Decimal(value)
 
-def _copy_data(source_engine,source_schema,target_engine,table,
-    batchsize=10000,logged=True,trialrun=False):
+def _create_high_water_mark_table(engine):
     """
-    Copies the data into the target system. Disables integrity checks 
-    prior to inserting.
+    Create the table of high-water marks on the target database.
 
     Args:
-        source_engine (obj): Database engine.
-        source_schema (obj): Name of schema to migrate.
-        target_engine (obj): Database engine.
-        table (obj): SQLAlchemy table object.
-        batchsize (int): Number of rows to migrate in each batch.
-        logged (bool): Enable or disable Postgres logging.
-        trialrun (bool): Run in trial mode.
+        engine (obj): Database engine.
     """
-    # create sessions
-    SourceSession = sessionmaker(bind=source_engine)
-    source_session = SourceSession()
-    TargetSession = sessionmaker(bind=target_engine)
-    target_session = TargetSession()
+    engine.execute("CREATE SCHEMA IF NOT EXISTS {}".format(_CONTROL_SCHEMA))
+    engine.execute("""
+        CREATE TABLE IF NOT EXISTS {}.high_water_mark (
+            schema_name TEXT NOT NULL,
+            table_name TEXT NOT NULL,
+            column_name TEXT,
+            high_water_mark TEXT,
+            updated_at TIMESTAMP,
+            PRIMARY KEY (schema_name, table_name))""".format(_CONTROL_SCHEMA))
 
-    # print schema
-    msg = 'Began copy of {}.{} at {}'.format(source_schema,table.name,
-        datetime.strftime(datetime.now(),"%Y-%m-%d %H:%M:%S"))
-    logging.info(msg)
+def _get_saved_high_water_mark(engine,schema,table_name,column):
+    """
+    Get the high-water mark recorded for a table, or None if there is no 
+    mark for the table and column.
 
-    target_session.execute("SET SEARCH_PATH TO {};".format(source_schema))
+    Args:
+        engine (obj): Database engine.
+        schema (str): Name of schema.
+        table_name (str): Name of table.
+        column (str): Last-modified column, or None for ORA_ROWSCN.
+    """
+    query = """SELECT column_name, high_water_mark 
+               FROM {}.high_water_mark 
+               WHERE schema_name = :schema_name AND table_name = :table_name""".format(_CONTROL_SCHEMA)
+    saved = engine.execute(sqlalchemy.text(query),schema_name=schema,
+        table_name=table_name).fetchone()
+    if not saved or saved[0] != column:
+        return None
 
-    # switch off logging
-    logswitch = False
-    if not logged:
-        try: 
-            target_session.execute('ALTER TABLE "{}" SET UNLOGGED'.format(table.name))
-            logswitch = True
-        except:
-            target_session.rollback()
-            target_session.execute("SET SEARCH_PATH TO {};".format(source_schema))
-            msg = "Unable to disable logging for {}.{}".format(source_schema,table.name)
-            logging.info(msg)
+    return _decode_high_water_mark(saved[1])
 
-    columns = _get_column_string(table)
-
-    # # copy the data in batches
-    # if trialrun:
-    #     r = source_session.query(table).limit(200)
-    #     data = r.all()
-    #     _insert_data(target_session,table,data)
-    # else: 
-    #     for data in source_session.query(table).yield_per(batchsize):
-    #         _insert_data(target_session,table,data)
-
-    # get the initial data batch
-    offset = 0
-    query =  """SELECT {} 
-                FROM {}.{} 
-                ORDER BY rowid 
-                OFFSET {} ROWS 
-                FETCH NEXT {} ROWS ONLY""".format(columns,source_schema,
-                    table.name,offset,batchsize)
-    data = source_session.execute(query).fetchall()
-
-    while data:
-        # insert the data
-        _insert_data(target_session,table,data)
-
-        # # print summary
-        # msg = '\tCopied rows {}-{} of {}.{} at {}'.format(offset,offset+batchsize,
-        #     source_schema,table.name, datetime.strftime(datetime.now(),"%Y-%m-%d %H:%M:%S"))
-        # logging.info(msg)
-        
-        # break after a couple of loops
-        if trialrun and offset > 200:
-            break
+def _save_high_water_mark(target_session,schema,table_name,column,value):
+    """
+    Record the high-water mark of a table. The caller commits the session.
 
-        # update the offset
-        offset = offset + batchsize
-        query =  """SELECT {} 
-                    FROM {}.{} 
-                    ORDER BY rowid 
-                    OFFSET {} ROWS 
-                    FETCH NEXT {} ROWS ONLY""".format(columns,source_schema,
-                        table.name,offset,batchsize)
-        
-        # load the next chunk of data
-        try: 
-            data = source_session.execute(query).fetchall()
-        except:
-            # break if end of table is reached
-            data = None
-            break
+    Args:
+        target_session (obj): SQLAlchemy session.
+        schema (str): Name of schema.
+        table_name (str): Name of table.
+        column (str): Last-modified column, or None for ORA_ROWSCN.
+        value (obj): High-water mark.
+    """
+    query = """INSERT INTO {}.high_water_mark 
+                   (schema_name, table_name, column_name, high_water_mark, updated_at)
+               VALUES (:schema_name, :table_name, :column_name, :high_water_mark, now())
+               ON CONFLICT (schema_name, table_name) DO UPDATE
+               SET column_name = EXCLUDED.column_name, 
+                   high_water_mark = EXCLUDED.high_water_mark,
+                   updated_at = EXCLUDED.updated_at""".format(_CONTROL_SCHEMA)
+    target_session.execute(sqlalchemy.text(query),{'schema_name': schema, 
+        'table_name': table_name, 'column_name': column, 
+        'high_water_mark': _encode_high_water_mark(value)})
 
-    # switch on database logging
-    if logswitch:
-        target_session.execute('ALTER TABLE "{}" SET LOGGED'.format(table.name))
+def _record_high_water_marks(source_config,target_engine,migration_config):
+    """
+    Record the current high-water mark of every table to be migrated. 
+    Called before the bulk load, so the first sync pass picks up any rows
+    that change while the load runs.
 
-    # record end
-    msg = 'Finished copy of {}.{} at {}'.format(source_schema,table.name,
-        datetime.strftime(datetime.now(),"%Y-%m-%d %H:%M:%S"))
-    logging.info(msg)
+    Args:
+        source_config (dict): Settings for source database.
+        target_engine (obj): Database engine.
+        migration_config (dict): Settings for the migration.
+    """
+    source_engine = connect_to_source(source_config)
+    inspector = sqlalchemy.inspect(source_engine)
+    delta_columns = migration_config.get('delta_columns') or {}
+    scn = _get_current_scn(source_engine)
 
-    # close the sessions
-    source_session.close()
+    _create_high_water_mark_table(target_engine)
+    TargetSession = sessionmaker(bind=target_engine)
+    target_session = TargetSession()
+    for schema in source_config['schema_list']:
+        for table_name in inspector.get_table_names(schema=schema):
+            column = delta_columns.get('{}.{}'.format(schema,table_name).lower())
+            value = _get_high_water_mark(source_engine,schema,table_name,column,scn)
+            _save_high_water_mark(target_session,schema,table_name,column,value)
+    target_session.commit()
     target_session.close()
+    source_engine.dispose()
 
-def _convert_type(colname, ora_type, schema_name='',
-    table_name=''):
+def _merge_rows(target_session,table,data,primary_key):
     """
-    Converts a data type in the source (Oracle) database to a Postgres type.
+    Upserts rows into the target table: the rows are copied into a 
+    temporary staging table, the target rows with matching primary keys 
+    are deleted, and the staged rows are inserted. Works whether or not 
+    the primary key constraint exists on the target. The caller commits 
+    the session, which must have integrity checks disabled (see 
+    _set_target_session).
 
     Args:
-        colname (str): Name of the column.
-        ora_type (obj): Data type in the source (Oracle) database.
-        schema_name (str): Name of the schema.
-        table_name (str): Name of the table.
+        target_session (obj): SQLAlchemy session.
+        table (obj): SQLAlchemy table object.
+        data (list): Rows to merge, with values in table column order.
+        primary_key (list): Names of the primary key columns.
     """
-    pg_type = ora_type
-    
-    # "NullType is used as a default type for those cases 
-    # where a type cannot be determined"
-    # NB: this needs to be first in the list
-    # Otherwise str(ora_type) clauses will error
-    if isinstance(ora_type,sqlalchemy.types.NullType):
-        pg_type = sqlalchemy.types.String()
-        logging.info('\t{}.{}.{}: NULL DETECTED'.format(schema_name, table_name,
-            colname))
-        return pg_type
-    elif isinstance(ora_type,sqlalchemy.types.Numeric):
-        pg_type = sqlalchemy.types.Numeric()
-    elif isinstance(ora_type,sqlalchemy.types.DateTime):
-        pg_type = TIMESTAMP()
-    elif isinstance(ora_type,sqlalchemy.types.Text):
-        pg_type = sqlalchemy.types.Text()
-    elif isinstance(ora_type,sqlalchemy.types.NVARCHAR):
-        pg_type = sqlalchemy.types.VARCHAR()
-    elif isinstance(ora_type,sqlalchemy.types.BLOB):
-        pg_type = BYTEA()
-    elif str(ora_type) == 'RAW':
-        pg_type = BYTEA()
-    # this isn't currently catching the binary_float
-    elif str(ora_type) == 'BINARY_FLOAT':
-        pg_type = REAL()
-    elif str(ora_type) == 'INTERVAL DAY TO SECOND':
-        pg_type = sqlalchemy.types.Interval(second_precision=True)
-    else:
-        pass
+    preparer = target_session.connection().dialect.identifier_preparer
+    target = preparer.format_table(table)
+    columns = ', '.join([preparer.format_column(col) for col in table.columns])
+    match = ' AND '.join(['t.{0} = s.{0}'.format(preparer.quote(col)) for col in primary_key])
 
-    if pg_type != ora_type:
-        msg = "\t{}.{}.{}: {} converted to {}".format(schema_name, table_name,
-            colname, ora_type, pg_type)
-        logging.info(msg)
+    # qualified with pg_temp, so a user table of the same name is never used
+    target_session.execute("DROP TABLE IF EXISTS pg_temp.delta_stage")
+    target_session.execute("CREATE TEMPORARY TABLE delta_stage (LIKE {}) ON COMMIT DROP".format(target))
+    _copy_rows(target_session.connection().connection,table,data,target='pg_temp.delta_stage')
+    target_session.execute("DELETE FROM {} t USING pg_temp.delta_stage s WHERE {}".format(target,match))
+    target_session.execute("INSERT INTO {0} ({1}) SELECT {1} FROM pg_temp.delta_stage".format(target,columns))
 
-    return pg_type
+def _sync_table(schema,table_name,source_config,target_config,migration_config,scn=None):
+    """
+    Copy the rows of a table that changed since its last high-water mark,
+    then record the new mark. Tables without a primary key, or without a 
+    high-water mark, are reloaded in full in a single transaction. Rows 
+    deleted on the source are not detected. Returns the number of rows 
+    copied.
 
-def migrate(source_config,target_config,migration_config):
+    Args:
+        schema (str): Name of schema.
+        table_name (str): Name of table.
+        source_config (dict): Settings for source database.
+        target_config (dict): Settings for target database.
+        migration_config (dict): Settings for the migration.
+        scn (int): SCN at the start of the pass.
     """
-    Migrate data from the source database to the target database. The target
-    database and schema must already exist.
+    source_engine = _get_engine(source_config)
+    target_engine = _get_engine(target_config,target_config['database'],target=True)
+    t = _get_table(source_engine,schema,table_name,migration_config.get('metadata_cache'))
+
+    delta_columns = migration_config.get('delta_columns') or {}
+    column = delta_columns.get('{}.{}'.format(schema,table_name).lower())
+    primary_key = [col.name for col in t.primary_key.columns]
+
+    # take the new mark before reading, so no change can fall between passes
+    saved = _get_saved_high_water_mark(target_engine,schema,table_name,column)
+    new_mark = _get_high_water_mark(source_engine,schema,table_name,column,scn)
+
+    lob_inline_kb = migration_config.get('lob_inline_kb')
+    lob_columns = _get_lob_columns(t)
+    if not lob_columns or lob_inline_kb is None:
+        lob_inline_kb, lob_columns = None, None
+    columns = _get_column_string(t,lob_inline_kb)
+    query = "SELECT {} FROM {}.{}".format(columns,schema,table_name)
+    params = {}
+    full_reload = saved is None or not primary_key
+    if not full_reload:
+        if column:
+            query = query + " WHERE {} >= :mark".format(column)
+        else:
+            query = query + " WHERE ORA_ROWSCN > :mark"
+        params['mark'] = saved
+
+    source_connection = source_engine.raw_connection()
+    TargetSession = sessionmaker(bind=target_engine)
+    target_session = TargetSession()
+    batches = None
+    failed = False
+
+    rowcount = 0
+    try:
+        if full_reload:
+            msg = "{}.{}: no primary key or high-water mark. Reloading the table.".format(schema,
+                table_name)
+            logging.info(msg)
+            target_session.execute('TRUNCATE {}."{}"'.format(schema,table_name))
+        sizer = _BatchSizer(migration_config.get('memory_budget_mb',1024),2,
+            _get_table_stats(source_engine,schema,table_name)[1],migration_config['batchsize'])
+        last = time.time()
+        batches = _fetch_batches(source_connection,[(query,params)],sizer,lob_columns=lob_columns,
+            ncols=len(t.columns))
+        for data in batches:
+            if full_reload:
+                _copy_rows(target_session.connection().connection,t,data)
+            else:
+                _merge_rows(target_session,t,data,primary_key)
+                target_session.commit()
+            rowcount = rowcount + len(data)
+            sizer.update(data,time.time() - last)
+            last = time.time()
+
+        _save_high_water_mark(target_session,schema,table_name,column,new_mark)
+        target_session.commit()
+    except:
+        # the mark is not moved, so the next pass merges the rows again
+        failed = True
+        try:
+            target_session.rollback()
+        except:
+            pass
+        raise
+    finally:
+        if batches is not None:
+            batches.close()
+        if failed:
+            # discard connections that may be part way through a fetch or
+            # a merge, rather than return them to the pool
+            source_connection.invalidate()
+            target_session.invalidate()
+        source_connection.close()
+        target_session.close()
+
+    msg = "{}.{}: synced {} changed rows".format(schema,table_name,rowcount)
+    logging.info(msg)
+
+    return rowcount
+
+def sync(source_config,target_config,migration_config):
+    """
+    Run an incremental catch-up pass after a migration with delta sync 
+    enabled, copying only the rows that changed since the last pass. 
+    Changed rows replace the target rows with the same primary key.
 
     Args:
         source_config (dict): Settings for source database.
         target_config (dict): Settings for target database.
         migration_config (dict): Settings for the migration.
     """
-    msg = 'Migrating data to target database...\n'
+    msg = 'Syncing changes to target database...\n'
     print(msg)
+    logging.info(msg)
 
-    # set up multiprocessing
-    if migration_config['multiprocess']:
+    target_engine = connect_to_target(target_config,target_config['database'])
+    recorded = target_engine.execute(sqlalchemy.text("SELECT to_regclass(:name)"),
+        name='{}.high_water_mark'.format(_CONTROL_SCHEMA)).scalar()
+    target_engine.dispose()
+    if not recorded:
+        msg = ("No high-water marks found on the target database. Unable to sync. "
+            "Run the migration with delta sync enabled first.")
+        logging.info(msg)
+        sys.exit(msg)
 
-        # set number of processes
+    source_engine = connect_to_source(source_config)
+    work_items = _get_work_items(source_engine,source_config['schema_list'])
+    scn = _get_current_scn(source_engine)
+    source_engine.dispose()
+    arg_iterable = [[schema,table_name,source_config,target_config,migration_config,scn] 
+        for schema, table_name, size in work_items]
+
+    start = datetime.now()
+    if migration_config['multiprocess']:
         if migration_config['processes']:
             pool = multiprocessing.Pool(int(migration_config['processes']))
         else: 
             pool = multiprocessing.Pool()
-
-        # starmap takes an iterable list
-        arg_iterable = [[schema,source_config,target_config,migration_config] for schema in source_config['schema_list']]
-        pool.starmap(_migrate_data,arg_iterable)
+        rowcounts = pool.starmap(_sync_table,arg_iterable,chunksize=1)
+        pool.close()
+        pool.join()
     else:
-        for schema in source_config['schema_list']:
-            _migrate_data(schema,source_config,target_config,migration_config)
+        rowcounts = [_sync_table(*args) for args in arg_iterable]
 
-    msg = 'Migration complete!\n'
+    msg = 'Sync complete: {} rows in {:.1f} seconds\n'.format(sum(rowcounts),
+        (datetime.now() - start).total_seconds())
     logging.info(msg)
     print(msg)
 
-def check_migration(source_engine,target_engine,source_config):
+def check_migration(source_engine,target_engine,source_config,cache_dir=None,
+    checksum=False,processes=4,chunks=16):
     """
-    Carry out post migration integrity checks.
+    Carry out post migration integrity checks. By default the row counts 
+    are compared. With checksum=True, aggregate fingerprints of the content
+    of every column are compared instead, by primary key range, in parallel.
 
     Args:
         source_engine (obj): Database engine.
         target_engine (obj): Database engine.
         source_config (dict): Settings for source database.
+        cache_dir (str): Directory of cached metadata, see cache_metadata.
+        checksum (bool): Compare column fingerprints. Default False.
+        processes (int): Number of chunks to check at the same time when 
+            checksum is True. Default 4.
+        chunks (int): Number of primary key ranges per table when checksum
+            is True. Default 16.
     """
     msg = 'Checking migration.\n'
     print(msg)
@@ -663,17 +4892,21 @@ def check_migration(source_engine,target_engine,source_config):
     target_session = TargetSession()
 
     # iterate the source schema to populate source_details
+    tables = []
     for schema_name in source_config['schema_list']:
-        source_metadata = sqlalchemy.MetaData(source_engine,quote_schema=True)
-        source_metadata.reflect(schema=schema_name)
+        source_metadata = _reflect_schema(source_engine,schema_name,cache_dir)
         # source_table_details[schema_name] = source_metadata.tables
 
-        target_metadata = sqlalchemy.MetaData(target_engine,quote_schema=True)
-        target_metadata.reflect(schema=schema_name)
-
         for t in source_metadata.sorted_tables:
-            # compare row count
-            _compare_row_count(schema_name,source_session,target_session,t,logging)
+            if checksum:
+                if t.schema == schema_name:
+                    tables.append(t)
+            else:
+                # compare row count
+                _compare_row_count(schema_name,source_session,target_session,t,logging)
+
+    if checksum:
+        _compare_fingerprints(source_engine,target_engine,tables,processes,chunks)
 
     # close the sessions
     source_session.close()
@@ -709,3 +4942,286 @@ def _compare_row_count(schema_name,source_session,target_session,t,logging):
     except:
         msg = "{}.{}: Unable to compare row counts.".format(schema_name,t.name)
         logging.error(msg)
+
+def _get_fingerprint_kind(col):
+    """
+    Classify a column by the aggregates used to fingerprint it.
+
+    Args:
+        col (obj): SQLAlchemy column of the source table.
+    """
+    name = str(col.type)
+    if isinstance(col.type,(sqlalchemy.types.Numeric,sqlalchemy.types.Integer)):
+        return 'number'
+    elif isinstance(col.type,sqlalchemy.types.TIMESTAMP):
+        return 'timestamp'
+    elif isinstance(col.type,(sqlalchemy.types.DateTime,sqlalchemy.types.Date)):
+        return 'datetime'
+    elif name.startswith('RAW'):
+        return 'raw'
+    elif isinstance(col.type,sqlalchemy.types.LargeBinary):
+        return 'lob'
+    elif name in ('CLOB','NCLOB') or isinstance(col.type,sqlalchemy.types.Text):
+        return 'clob'
+    elif isinstance(col.type,(sqlalchemy.types.CHAR,sqlalchemy.types.NCHAR)):
+        return 'char'
+    elif isinstance(col.type,sqlalchemy.types.String):
+        return 'string'
+    return None
+
+# sum of the first 28 bits of the MD5 of each value, which does not depend
+# on the order of the rows. strings are hashed as UTF-8 on both databases.
+_ORACLE_HASH = "SUM(TO_NUMBER(SUBSTR(RAWTOHEX(STANDARD_HASH({}, 'MD5')), 1, 7), 'XXXXXXX'))"
+_POSTGRES_HASH = "SUM(CAST(CAST('x' || SUBSTR(MD5({}), 1, 7) AS BIT(28)) AS BIGINT))"
+
+# LOBs cannot be hashed whole in SQL, so the first and last characters 
+# (or twice as many bytes) of each LOB are hashed
+_LOB_HASH_CHARS = 1000
+
+def _utf8(expression):
+    """
+    Convert an Oracle string expression to its UTF-8 bytes, as hashed by 
+    Postgres.
+
+    Args:
+        expression (str): SQL expression.
+    """
+    return "UTL_I18N.STRING_TO_RAW({}, 'AL32UTF8')".format(expression)
+
+# aggregates that give the same numbers on both databases, by column kind.
+# CHAR values are compared without the trailing blanks that pad them, which
+# Oracle keeps and Postgres ignores. Oracle trims blanks to NULL.
+_FINGERPRINTS = {
+    'oracle': {
+        'number': ["SUM({0})"],
+        'string': ["SUM(LENGTH({0}))",_ORACLE_HASH.format(_utf8('{0}'))],
+        'char': ["SUM(LENGTH(RTRIM({0})))",_ORACLE_HASH.format(_utf8('RTRIM({0})'))],
+        'clob': ["SUM(DBMS_LOB.GETLENGTH({0}))",
+                 _ORACLE_HASH.format(_utf8('DBMS_LOB.SUBSTR({{0}}, {0}, 1)'.format(_LOB_HASH_CHARS))),
+                 _ORACLE_HASH.format(_utf8('DBMS_LOB.SUBSTR({{0}}, {0}, GREATEST(1, DBMS_LOB.GETLENGTH({{0}}) - {1}))'.format(
+                     _LOB_HASH_CHARS,_LOB_HASH_CHARS - 1)))],
+        'lob': ["SUM(DBMS_LOB.GETLENGTH({0}))",
+                _ORACLE_HASH.format('DBMS_LOB.SUBSTR({{0}}, {0}, 1)'.format(2 * _LOB_HASH_CHARS)),
+                _ORACLE_HASH.format('DBMS_LOB.SUBSTR({{0}}, {0}, GREATEST(1, DBMS_LOB.GETLENGTH({{0}}) - {1}))'.format(
+                    2 * _LOB_HASH_CHARS,2 * _LOB_HASH_CHARS - 1))],
+        'raw': ["SUM(UTL_RAW.LENGTH({0}))",_ORACLE_HASH.format('{0}')],
+        'datetime': ["SUM(ROUND((TRUNC({0}, 'MI') - DATE '1970-01-01') * 1440))",
+                     "SUM(TO_NUMBER(TO_CHAR({0}, 'SS')))"],
+        'timestamp': ["SUM(ROUND((TRUNC(CAST({0} AS DATE), 'MI') - DATE '1970-01-01') * 1440))",
+                      "SUM(TO_NUMBER(TO_CHAR({0}, 'SS')))",
+                      "SUM(TO_NUMBER(TO_CHAR({0}, 'FF6')))"]},
+    'postgresql': {
+        'number': ["SUM({0})"],
+        'string': ["SUM(LENGTH({0}))",_POSTGRES_HASH.format('{0}')],
+        'char': ["SUM(LENGTH(RTRIM({0})))",_POSTGRES_HASH.format("NULLIF(RTRIM({0}), '')")],
+        'clob': ["SUM(LENGTH({0}))",
+                 _POSTGRES_HASH.format('SUBSTR({{0}}, 1, {0})'.format(_LOB_HASH_CHARS)),
+                 _POSTGRES_HASH.format('RIGHT({{0}}, {0})'.format(_LOB_HASH_CHARS))],
+        'lob': ["SUM(OCTET_LENGTH({0}))",
+                _POSTGRES_HASH.format('SUBSTRING({{0}} FROM 1 FOR {0})'.format(2 * _LOB_HASH_CHARS)),
+                _POSTGRES_HASH.format('SUBSTRING({{0}} FROM GREATEST(1, OCTET_LENGTH({{0}}) - {0}))'.format(
+                    2 * _LOB_HASH_CHARS - 1))],
+        'raw': ["SUM(OCTET_LENGTH({0}))",_POSTGRES_HASH.format('{0}')],
+        'datetime': ["SUM(CAST(EXTRACT(EPOCH FROM DATE_TRUNC('minute', {0})) / 60 AS BIGINT))",
+                     "SUM(CAST(FLOOR(EXTRACT(SECOND FROM {0})) AS INTEGER))"],
+        'timestamp': ["SUM(CAST(EXTRACT(EPOCH FROM DATE_TRUNC('minute', {0})) / 60 AS BIGINT))",
+                      "SUM(CAST(FLOOR(EXTRACT(SECOND FROM {0})) AS INTEGER))",
+                      "SUM(MOD(CAST(EXTRACT(MICROSECONDS FROM {0}) AS BIGINT), 1000000))"]}
+}
+
+def _get_fingerprint_query(table,dialect):
+    """
+    Create a query that computes a fingerprint of the rows of a table in 
+    a key range: the row count, then for each column the non-null count 
+    and aggregates of the values (sums of numbers, lengths and content 
+    hashes of strings, RAWs and the start and end of LOBs, and minutes 
+    since 1970, seconds and microseconds of datetimes). Returns the query
+    and the list of column names for each aggregate. The Oracle hashes 
+    need STANDARD_HASH (Oracle 12c or later).
+
+    Args:
+        table (obj): SQLAlchemy table object, reflected from the source.
+        dialect (obj): Dialect of the database to query.
+    """
+    preparer = dialect.identifier_preparer
+    expressions = ['COUNT(*)']
+    names = ['*']
+    for col in table.columns:
+        quoted = preparer.format_column(col)
+        expressions.append('COUNT({})'.format(quoted))
+        names.append(col.name)
+        for aggregate in _FINGERPRINTS[dialect.name].get(_get_fingerprint_kind(col),[]):
+            expressions.append(aggregate.format(quoted))
+            names.append(col.name)
+
+    query = "SELECT {} FROM {}".format(', '.join(expressions),preparer.format_table(table))
+
+    return query, names
+
+def _get_integer_key(table):
+    """
+    Get the single integer primary key column of a table, or None.
+
+    Args:
+        table (obj): SQLAlchemy table object.
+    """
+    key = list(table.primary_key.columns)
+    if len(key) != 1:
+        return None
+    key_type = key[0].type
+    if isinstance(key_type,sqlalchemy.types.Integer) or (isinstance(key_type,
+        sqlalchemy.types.Numeric) and key_type.scale == 0):
+        return key[0]
+    return None
+
+def _values_match(a,b):
+    """
+    Compare aggregates from the source and target. Floating point sums are
+    compared with a small relative tolerance, as the order of summation 
+    differs.
+
+    Args:
+        a (obj): Aggregate from the source.
+        b (obj): Aggregate from the target.
+    """
+    if a is None or b is None:
+        return a is None and b is None
+    if isinstance(a,float) or isinstance(b,float):
+        a, b = float(a), float(b)
+        if math.isnan(a) or math.isnan(b):
+            return math.isnan(a) and math.isnan(b)
+        return abs(a - b) <= 1e-9 * max(abs(a),abs(b),1)
+    return Decimal(str(a)) == Decimal(str(b))
+
+def _compare_range(source_engine,target_engine,table,key,lo=None,hi=None,depth=0):
+    """
+    Compare the fingerprints of a range of rows [lo, hi) of the primary key
+    on the source and target. Ranges that do not match are split in two and
+    compared again, up to 8 times, so that the differences can be located.
+    Returns a list of (lo, hi, columns) for the smallest ranges that do not
+    match. A range without lo or hi is open at that end, and is not split.
+
+    Args:
+        source_engine (obj): Database engine.
+        target_engine (obj): Database engine.
+        table (obj): SQLAlchemy table object, reflected from the source.
+        key (obj): Integer primary key column, or None to compare the table.
+        lo (int): Start of the key range, or None.
+        hi (int): End of the key range, or None.
+        depth (int): Number of times the range has been split.
+    """
+    fingerprints = []
+    for engine in (source_engine,target_engine):
+        query, names = _get_fingerprint_query(table,engine.dialect)
+        conditions = []
+        params = {}
+        if key is not None:
+            quoted = engine.dialect.identifier_preparer.format_column(key)
+            if lo is not None:
+                conditions.append("{} >= :lo".format(quoted))
+                params['lo'] = lo
+            if hi is not None:
+                conditions.append("{} < :hi".format(quoted))
+                params['hi'] = hi
+        if conditions:
+            query = query + " WHERE " + " AND ".join(conditions)
+        fingerprints.append(engine.execute(sqlalchemy.text(query),**params).fetchone())
+
+    columns = sorted(set([name for name, a, b in zip(names,*fingerprints) if not _values_match(a,b)]))
+    if not columns:
+        return []
+    if key is None or lo is None or hi is None or depth >= 8 or hi - lo <= 1:
+        return [(lo,hi,columns)]
+
+    mid = lo + (hi - lo) // 2
+    return _compare_range(source_engine,target_engine,table,key,lo,mid,depth + 1) + \
+        _compare_range(source_engine,target_engine,table,key,mid,hi,depth + 1)
+
+def _get_key_ranges(engine,table,key,chunks):
+    """
+    Split the primary key of a table into ranges [lo, hi) of equal width,
+    between the smallest and largest keys of the source. Open ranges below
+    and above them catch rows that are only in the target. An empty table 
+    is one open range, (None, None).
+
+    Args:
+        engine (obj): Database engine.
+        table (obj): SQLAlchemy table object.
+        key (obj): Integer primary key column.
+        chunks (int): Number of ranges.
+    """
+    lo, hi = engine.execute(sqlalchemy.select([sqlalchemy.func.min(key),
+        sqlalchemy.func.max(key)])).fetchone()
+    if lo is None:
+        return [(None,None)]
+    lo, hi = int(lo), int(hi) + 1
+    width = max(1,int(math.ceil(float(hi - lo) / chunks)))
+    return [(None,lo)] + [(x,min(x + width,hi)) for x in range(lo,hi,width)] + [(hi,None)]
+
+def _compare_fingerprints(source_engine,target_engine,tables,processes=4,chunks=16):
+    """
+    Compare the fingerprints of each table on the source and target, by
+    primary key range where the table has a single integer key. Ranges of 
+    all tables are compared in parallel, and mismatches are logged.
+
+    Args:
+        source_engine (obj): Database engine.
+        target_engine (obj): Database engine.
+        tables (list): SQLAlchemy table objects, reflected from the source.
+        processes (int): Number of ranges to compare at the same time.
+        chunks (int): Number of key ranges per table.
+    """
+    tasks = []
+    for t in tables:
+        key = _get_integer_key(t)
+        if key is None:
+            msg = "{}.{}: No single integer primary key. Comparing checksums for the whole table.".format(
+                t.schema,t.name)
+            logging.info(msg)
+            tasks.append((t,None,None,None))
+        else:
+            try:
+                ranges = _get_key_ranges(source_engine,t,key,chunks)
+            except:
+                msg = "{}.{}: Unable to split the primary key into ranges. Comparing checksums for the whole table.".format(
+                    t.schema,t.name)
+                logging.warning(msg)
+                ranges = [(None,None)]
+                key = None
+            tasks.extend([(t,key,lo,hi) for lo, hi in ranges])
+
+    def compare(task):
+        t, key, lo, hi = task
+        try:
+            return t, _compare_range(source_engine,target_engine,t,key,lo,hi), None
+        except Exception as e:
+            return t, [], e
+
+    # the comparisons wait on the databases, so threads are sufficient
+    pool = multiprocessing.pool.ThreadPool(processes)
+    results = {}
+    for t, mismatches, error in pool.imap_unordered(compare,tasks):
+        if error is not None:
+            msg = "{}.{}: Unable to compare checksums: {}".format(t.schema,t.name,error)
+            logging.error(msg)
+        results.setdefault((t.schema,t.name),[]).extend(mismatches)
+    pool.close()
+    pool.join()
+
+    for (schema_name, table_name), mismatches in sorted(results.items()):
+        if not mismatches:
+            msg = "{}.{}: Source and target checksums match".format(schema_name,table_name)
+            logging.info(msg)
+        for lo, hi, columns in mismatches:
+            if lo is None and hi is None:
+                msg = "{}.{}: Checksums differ in columns {}".format(schema_name,table_name,columns)
+            elif lo is None:
+                msg = "{}.{}: Checksums differ for keys below {} in columns {}".format(schema_name,
+                    table_name,hi,columns)
+            elif hi is None:
+                msg = "{}.{}: Checksums differ for keys from {} in columns {}".format(schema_name,
+                    table_name,lo,columns)
+            else:
+                msg = "{}.{}: Checksums differ for keys {} to {} in columns {}".format(schema_name,
+                    table_name,lo,hi - 1,columns)
+            logging.warning(msg)
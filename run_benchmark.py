@@ -0,0 +1,427 @@
+#!/usr/bin/env python3
+
+"""
+Benchmarks the migration without a live Oracle instance.
+
+Synthetic tables (narrow and wide rows, LOBs, NUMBER, DATE and INTERVAL
+columns, and mostly NULL rows) are generated in a SQLite database that
+stands in for the Oracle source. The SQLite columns are declared with Oracle
+type names and reflected as the Oracle types, so the tables pass through
+_convert_type, _copy_data and _insert_data as they would in a migration.
+
+The target is either a local Postgres database (--target with a SQLAlchemy
+URL; the 'main' schema is dropped and recreated for every run) or, by
+default, a sink in place of the target connection. Tables are copied into
+the sink by _copy_data, which serializes the rows for COPY or INSERT and
+counts the bytes, but nothing is sent.
+
+Each combination of batch size, worker count, load method, pipelining and
+columnar encoding runs in a fresh process, and rows/sec and peak RSS are reported for each.
+"""
+import os
+import sys
+import json
+import time
+import random
+import sqlite3
+import argparse
+import itertools
+import resource
+import subprocess
+import multiprocessing
+from datetime import datetime, timedelta
+from decimal import Decimal
+import psycopg2.extensions
+import sqlalchemy
+import sqlalchemy.dialects.oracle.base
+import sqlalchemy.dialects.sqlite.base
+import oracle2postgres
+
+# the stand-in schema. sqlite calls the schema of the main database 'main'.
+SCHEMA = 'main'
+
+# reflect the stand-in tables with the same types as the Oracle dialect.
+# sqlite cannot parse INTERVAL DAY TO SECOND, so it is declared as INTERVAL.
+sqlalchemy.dialects.sqlite.base.ischema_names.update(
+    sqlalchemy.dialects.oracle.base.ischema_names)
+sqlalchemy.dialects.sqlite.base.ischema_names['INTERVAL'] = \
+    sqlalchemy.dialects.oracle.base.ischema_names['INTERVAL DAY TO SECOND']
+
+# return the values with the python types that cx_Oracle would return.
+# sqlite matches the first word of the declared type.
+sqlite3.register_converter('NUMBER',lambda x: Decimal(x.decode()))
+sqlite3.register_converter('DATE',lambda x: datetime.fromisoformat(x.decode()))
+sqlite3.register_converter('TIMESTAMP',lambda x: datetime.fromisoformat(x.decode()))
+sqlite3.register_converter('INTERVAL',lambda x: timedelta(seconds=float(x)))
+
+def _text(rng,low,high):
+    """
+    Random text, including characters that are escaped by COPY.
+
+    Args:
+        rng (obj): Random number generator.
+        low (int): Minimum length.
+        high (int): Maximum length.
+    """
+    words = ['alpha','beta','gamma','delta','tab\there','new\nline','back\\slash','épsilon']
+    text = []
+    size = 0
+    length = rng.randint(low,high)
+    while size < length:
+        word = rng.choice(words)
+        text.append(word)
+        size += len(word) + 1
+    return ' '.join(text)[:length]
+
+def _date(rng):
+    """
+    Random date and time, as stored by the stand-in.
+
+    Args:
+        rng (obj): Random number generator.
+    """
+    value = datetime(2000,1,1) + timedelta(seconds=rng.randint(0,20 * 365 * 86400))
+    return value.isoformat(sep=' ')
+
+def _sparse(rng,value):
+    """
+    Returns the value for one row in twenty, otherwise None.
+
+    Args:
+        rng (obj): Random number generator.
+        value (obj): Value.
+    """
+    return value if rng.random() < 0.05 else None
+
+# the synthetic tables: name, relative number of rows, columns (name,
+# Oracle type, generator)
+TABLES = [
+    ('narrow', 1,
+        [('id','NUMBER(10)',None),
+         ('code','VARCHAR2(10)',lambda r: _text(r,1,10)),
+         ('amount','NUMBER(12,2)',lambda r: round(r.uniform(-1e6,1e6),2))]),
+    ('wide', 0.2,
+        [('id','NUMBER(10)',None)] +
+        [('label_{}'.format(i),'VARCHAR2(100)',lambda r: _text(r,10,100)) for i in range(10)] +
+        [('value_{}'.format(i),'NUMBER(12,2)',lambda r: round(r.uniform(0,1e6),2)) for i in range(10)] +
+        [('date_{}'.format(i),'DATE',_date) for i in range(5)] +
+        [('ratio_{}'.format(i),'BINARY_DOUBLE',lambda r: r.gauss(0,1)) for i in range(5)]),
+    ('lobs', 0.05,
+        [('id','NUMBER(10)',None),
+         ('notes','CLOB',lambda r: _text(r,1000,16000)),
+         ('payload','BLOB',lambda r: bytes(r.getrandbits(8) for _ in range(r.randint(512,8192))))]),
+    ('types', 1,
+        [('id','NUMBER(10)',None),
+         ('quantity','NUMBER',lambda r: r.randint(-10**12,10**12)),
+         ('ratio','BINARY_DOUBLE',lambda r: r.gauss(0,1e6)),
+         ('created','DATE',_date),
+         ('updated','TIMESTAMP',lambda r: _date(r) + '.{:06d}'.format(r.randint(0,999999))),
+         ('duration','INTERVAL',lambda r: round(r.uniform(-1e6,1e6),6))]),
+    ('sparse', 1,
+        [('id','NUMBER(10)',None)] +
+        [('text_{}'.format(i),'VARCHAR2(100)',lambda r: _sparse(r,_text(r,1,100))) for i in range(8)] +
+        [('value_{}'.format(i),'NUMBER(12,2)',lambda r: _sparse(r,round(r.random(),2))) for i in range(8)] +
+        [('date_{}'.format(i),'DATE',lambda r: _sparse(r,_date(r))) for i in range(4)])]
+
+def create_source(path,rows,seed=0):
+    """
+    Generates the synthetic tables in a SQLite database. The same rows and
+    seed always generate the same data.
+
+    Args:
+        path (str): Path of the SQLite database.
+        rows (int): Number of rows in the narrow tables. The wide and LOB
+            tables have fewer rows.
+        seed (int): Seed for the random number generator.
+    """
+    rng = random.Random(seed)
+    con = sqlite3.connect(path + '.tmp')
+    for table_name, scale, columns in TABLES:
+        con.execute('CREATE TABLE {} ({})'.format(table_name,
+            ', '.join(['{} {}'.format(name,coltype) for name, coltype, _ in columns])))
+        query = 'INSERT INTO {} VALUES ({})'.format(table_name,','.join(['?'] * len(columns)))
+        n = max(1,int(rows * scale))
+        for start in range(0,n,10000):
+            data = [[i] + [generate(rng) for _, _, generate in columns[1:]]
+                for i in range(start,min(n,start + 10000))]
+            con.executemany(query,data)
+        con.commit()
+        print('Generated {} rows of {}'.format(n,table_name))
+    con.close()
+    os.replace(path + '.tmp',path)
+
+def get_source_config(path):
+    """
+    Settings that point connect_to_source at the stand-in.
+
+    Args:
+        path (str): Path of the SQLite database.
+    """
+    # the pipeline fetches in a separate thread
+    connect_args = {'detect_types': sqlite3.PARSE_DECLTYPES, 'check_same_thread': False}
+    return {'url': 'sqlite:///{}'.format(os.path.abspath(path)),
+        'engine_args': {'connect_args': connect_args},
+        'schema_list': [SCHEMA]}
+
+def get_migration_config(run):
+    """
+    Migration settings for one benchmark run.
+
+    Args:
+        run (dict): Settings of the run.
+    """
+    return {'trialrun': False, 'batchsize': run['batchsize'], 'metadata_cache': None,
+        'paging': 'cursor', 'pipeline': run['pipeline'], 'memory_budget_mb': 1024, 'lob_inline_kb': 64,
+        'columnar': run.get('columnar',False), 'number_types': 'declared', 'type_report': None,
+        'partitions': True, 'checkpoint': False, 'strip_nulls': False, 'metrics_dir': run.get('metrics_dir'),
+        'logged': True, 'load_method': run['load_method'], 'freeze': False,
+        'multiprocess': run['processes'] > 1, 'processes': run['processes'],
+        'split_threshold_mb': 0, 'table_chunks': None, 'delta': False}
+
+class _SinkCursor(object):
+    """
+    Cursor of the sink. COPY streams are read as psycopg2 reads them, and
+    INSERT statements are built as psycopg2 builds them, but nothing is
+    sent.
+    """
+    def __init__(self,connection):
+        self.connection = connection
+        self.query = None
+
+    def copy_expert(self,sql,file,size=8192):
+        while file.read(size):
+            pass
+
+    def mogrify(self,template,args):
+        values = []
+        for value in args:
+            adapted = psycopg2.extensions.adapt(value)
+            if hasattr(adapted,'encoding'):
+                adapted.encoding = 'utf8'
+            values.append(adapted.getquoted())
+        return template % tuple(values)
+
+    def execute(self,query,params=None):
+        self.query = query
+
+    def close(self):
+        pass
+
+class _SinkConnection(object):
+    """
+    Connection of the sink, in place of a psycopg2 connection.
+    """
+    encoding = 'UTF8'
+
+    def cursor(self):
+        return _SinkCursor(self)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def invalidate(self):
+        pass
+
+    def close(self):
+        pass
+
+class _SinkEngine(object):
+    """
+    Target engine of the sink, for _copy_data.
+    """
+    def raw_connection(self):
+        return _SinkConnection()
+
+def _sink_table(args):
+    """
+    Copies a table from the source into the sink with _copy_data, as it 
+    would be copied into the target. Returns (rows, bytes).
+
+    Args:
+        args (list): Schema, table name, source settings, migration settings.
+    """
+    schema, table_name, source_config, migration_config = args
+    engine = oracle2postgres._get_engine(source_config)
+    table = oracle2postgres._get_table(engine,schema,table_name)
+
+    stats = oracle2postgres._copy_data(engine,schema,_SinkEngine(),table,
+        batchsize=migration_config['batchsize'],load_method=migration_config['load_method'],
+        paging=migration_config['paging'],pipeline=migration_config['pipeline'],
+        memory_budget_mb=migration_config['memory_budget_mb'],
+        strip_nulls=migration_config['strip_nulls'],lob_inline_kb=migration_config['lob_inline_kb'],
+        columnar=migration_config['columnar'])
+
+    return stats['rows'], stats['bytes']
+
+def run_sink(source_config,migration_config):
+    """
+    Copies every table of the stand-in into the sink. Returns (rows, bytes).
+
+    Args:
+        source_config (dict): Settings for the source database.
+        migration_config (dict): Settings for the migration.
+    """
+    engine = oracle2postgres.connect_to_source(source_config)
+    work_items = oracle2postgres._get_work_items(engine,source_config['schema_list'])
+    engine.dispose()
+    args = [[schema,table_name,source_config,migration_config]
+        for schema, table_name, _ in work_items]
+
+    if migration_config['multiprocess']:
+        pool = multiprocessing.Pool(migration_config['processes'])
+        results = pool.map(_sink_table,args,chunksize=1)
+        pool.close()
+        pool.join()
+    else:
+        results = [_sink_table(x) for x in args]
+
+    return sum([x[0] for x in results]), sum([x[1] for x in results])
+
+def run_postgres(source_config,target_config,migration_config):
+    """
+    Migrates the stand-in to a Postgres database. Returns (rows, bytes).
+
+    Args:
+        source_config (dict): Settings for the source database.
+        target_config (dict): Settings for the target database.
+        migration_config (dict): Settings for the migration.
+    """
+    source_engine = oracle2postgres.connect_to_source(source_config)
+    target_engine = oracle2postgres.connect_to_target(target_config)
+    target_engine.execute('DROP SCHEMA IF EXISTS {} CASCADE'.format(SCHEMA))
+    oracle2postgres.create_target_schema(source_config['schema_list'],source_engine,
+        target_engine,number_types=migration_config['number_types'],
+        type_report=migration_config['type_report'],partitions=migration_config['partitions'])
+    source_engine.dispose()
+    target_engine.dispose()
+
+    oracle2postgres.migrate(source_config,target_config,migration_config)
+
+    # sum the work items recorded in the metrics
+    rows, nbytes = 0, 0
+    with open(os.path.join(migration_config['metrics_dir'],'metrics.jsonl')) as f:
+        for line in f:
+            record = json.loads(line)
+            if record['type'] == 'work_item':
+                rows += record['rows']
+                nbytes += record['bytes']
+
+    return rows, nbytes
+
+def run_one(run):
+    """
+    Runs a single benchmark and prints the result as a line of JSON. Peak
+    RSS is the larger of this process and its largest worker.
+
+    Args:
+        run (dict): Settings of the run.
+    """
+    source_config = get_source_config(run['source'])
+    migration_config = get_migration_config(run)
+
+    start = time.time()
+    if run['target'] == 'sink':
+        rows, nbytes = run_sink(source_config,migration_config)
+    else:
+        rows, nbytes = run_postgres(source_config,{'url': run['target'], 'database': None},
+            migration_config)
+    seconds = time.time() - start
+
+    # ru_maxrss is in kilobytes on linux
+    peak_rss = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    result = dict(run,rows=rows,bytes=nbytes,seconds=seconds,
+        rows_per_second=rows / seconds,peak_rss_mb=peak_rss / 1024.0)
+    print(json.dumps(result))
+
+def _parse_list(text,convert=str):
+    """
+    Splits a comma separated argument.
+
+    Args:
+        text (str): Comma separated values.
+        convert (obj): Function to convert each value.
+    """
+    return [convert(x.strip()) for x in text.split(',') if x.strip()]
+
+def main():
+    """
+    Generates the stand-in, if needed, then runs every combination of the
+    settings and reports the results.
+    """
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=100000,
+        help='number of rows in the narrow tables (default 100000)')
+    parser.add_argument('--seed', type=int, default=0,
+        help='seed for the synthetic data (default 0)')
+    parser.add_argument('--data-dir', default='benchmark_data',
+        help='directory for the stand-in databases (default benchmark_data)')
+    parser.add_argument('--target', default='sink',
+        help="'sink', or the SQLAlchemy URL of an existing Postgres database")
+    parser.add_argument('--batchsizes', default='1000,10000,auto',
+        help="comma separated batch sizes, or 'auto' (default 1000,10000,auto)")
+    parser.add_argument('--processes', default='1,4',
+        help='comma separated worker counts (default 1,4)')
+    parser.add_argument('--load-methods', default='copy,insert',
+        help='comma separated load methods (default copy,insert)')
+    parser.add_argument('--pipeline', default='n',
+        help="comma separated pipeline settings, 'y' or 'n' (default n)")
+    parser.add_argument('--columnar', default='n',
+        help="comma separated columnar encoding settings, 'y' or 'n' (default n)")
+    parser.add_argument('--output',
+        help='append the results to this file as lines of JSON')
+    parser.add_argument('--run-one', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_one:
+        run_one(json.loads(args.run_one))
+        return
+
+    os.makedirs(args.data_dir,exist_ok=True)
+    source = os.path.join(args.data_dir,'source_{}_{}.sqlite'.format(args.rows,args.seed))
+    if not os.path.exists(source):
+        create_source(source,args.rows,args.seed)
+
+    msg = '{:>9} {:>9} {:>6} {:>8} {:>8} {:>10} {:>12} {:>8} {:>9} {:>10}'.format('batchsize',
+        'processes','method','pipeline','columnar','rows','rows/sec','MB/sec','seconds','peak RSS')
+    print(msg)
+
+    settings = itertools.product(
+        _parse_list(args.batchsizes,lambda x: None if x == 'auto' else int(x)),
+        _parse_list(args.processes,int),_parse_list(args.load_methods),
+        _parse_list(args.pipeline),_parse_list(args.columnar))
+    for batchsize, processes, load_method, pipeline, columnar in settings:
+        run = {'source': source, 'target': args.target, 'batchsize': batchsize,
+            'processes': processes, 'load_method': load_method,
+            'pipeline': pipeline.lower() == 'y', 'columnar': columnar.lower() == 'y',
+            'metrics_dir': os.path.join(args.data_dir,'metrics',
+                datetime.now().strftime("%Y%m%d%H%M%S%f"))}
+
+        # a fresh process for each run, so peak RSS is not shared
+        output = subprocess.run([sys.executable,os.path.abspath(__file__),
+            '--run-one',json.dumps(run)],stdout=subprocess.PIPE,
+            universal_newlines=True,check=True).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+
+        # no bytes are counted if nothing was copied
+        if result['bytes']:
+            mb_per_second = '{:.1f}'.format(result['bytes'] / result['seconds'] / 1e6)
+        else:
+            mb_per_second = 'n/a'
+        msg = '{:>9} {:>9} {:>6} {:>8} {:>8} {:>10} {:>12.0f} {:>8} {:>9.2f} {:>7.0f} MB'.format(
+            batchsize or 'auto',processes,load_method,pipeline,columnar,result['rows'],
+            result['rows_per_second'],mb_per_second,result['seconds'],result['peak_rss_mb'])
+        print(msg)
+        if args.output:
+            with open(args.output,'a') as f:
+                f.write(json.dumps(result) + '\n')
+
+if __name__ == "__main__":
+    """
+    Execute when run as script
+    """
+    main()
@@ -5,15 +5,73 @@ Migrates data from source databases on an Oracle system to target schemas on
 a Postgres system. 
 
 Running the script will delete the target database before recreating it, so
-use with caution!
+use with caution! Run with --resume to continue an interrupted migration 
+without recreating the target database, or with --sync to copy the rows 
+that changed since the last migration or sync (requires delta sync to be 
+enabled in the migration settings).
+
+Run with --extract DIR to copy the source tables to staging files without 
+connecting to the target, and later with --load DIR to load the staging 
+files into the target without connecting to the source.
+
+Run with --coordinator to copy the data with distributed workers: the 
+coordinator recreates the target database, queues the work items in it 
+and waits for them to be copied, while any number of processes started 
+with --worker, on this or other hosts, claim and copy the items. Add 
+--resume to the coordinator to queue the failed items again.
+
+Run with --plan to estimate the duration and memory of a migration from 
+the source table sizes and the throughput of earlier runs, without copying
+any data.
 """
 import sys
+import argparse
 import oracle2postgres
 
 def main():
     """
     Connects to the source and target databases, then migrates a list of defined schema.
     """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--resume', action='store_true',
+        help='continue an interrupted migration from its checkpoints')
+    parser.add_argument('--sync', action='store_true',
+        help='copy the rows that changed since the last migration or sync')
+    parser.add_argument('--extract', metavar='DIR',
+        help='extract the source tables to staging files in DIR')
+    parser.add_argument('--load', metavar='DIR',
+        help='load the staging files in DIR into the target database')
+    parser.add_argument('--coordinator', action='store_true',
+        help='queue the work items for distributed workers and wait for them to finish')
+    parser.add_argument('--worker', action='store_true',
+        help='copy work items from the queue of a coordinator')
+    parser.add_argument('--plan', action='store_true',
+        help='estimate the duration and memory of the migration, without copying data')
+    parser.add_argument('--calibrate', metavar='ROWS', type=int, default=0,
+        help='with --plan, read ROWS rows from the largest unmeasured tables to measure throughput')
+    parser.add_argument('--workers', metavar='N,N', default='1,2,4,8,16',
+        help='with --plan, numbers of workers to estimate the wall-clock time for')
+    args = parser.parse_args()
+
+    if args.worker:
+        worker()
+        return
+    if args.plan:
+        plan([int(x) for x in args.workers.split(',')],args.calibrate)
+        return
+    if args.extract:
+        extract(args.extract)
+        return
+    if args.load:
+        load(args.load,args.resume)
+        return
+    if args.resume:
+        resume(args.coordinator)
+        return
+    if args.sync:
+        sync()
+        return
+
     msg =  """
     ----------------------------------------------------- \n
     Running this script will delete the target database!  \n
@@ -37,8 +95,16 @@ def main():
     source_engine = oracle2postgres.connect_to_source(source_config)
     oracle2postgres.check_schema_exist(source_engine,source_config['schema_list'])
 
-    # check and remove null characters in strings
-    oracle2postgres.check_for_nulls(source_engine,source_config['schema_list'],remove=True)
+    # reflect the source schema once for all stages
+    cache_dir = migration_config['metadata_cache']
+    if cache_dir:
+        oracle2postgres.cache_metadata(source_engine,source_config['schema_list'],cache_dir)
+
+    # check and remove null characters in strings, unless they are 
+    # stripped during the copy
+    if not migration_config['strip_nulls']:
+        oracle2postgres.check_for_nulls(source_engine,source_config['schema_list'],remove=True,
+            cache_dir=cache_dir)
 
     # create a new database on the target
     # WARNING: deletes target database before creation!
@@ -49,10 +115,164 @@ def main():
 
     # create the schema on the target database
     target_engine = oracle2postgres.connect_to_target(target_config,target_config['database'])
-    oracle2postgres.create_target_schema(source_config['schema_list'],source_engine,target_engine)
+    oracle2postgres.create_target_schema(source_config['schema_list'],source_engine,target_engine,
+        cache_dir=cache_dir,number_types=migration_config['number_types'],
+        type_report=migration_config['type_report'],processes=migration_config['processes'],
+        partitions=migration_config['partitions'])
+
+    # run the migration, or queue it for distributed workers
+    if args.coordinator:
+        oracle2postgres.distribute(source_config,target_config,migration_config)
+    else:
+        oracle2postgres.migrate(source_config,target_config,migration_config)
+
+    # recreate the keys and indexes
+    oracle2postgres.create_target_constraints(source_config,target_config,migration_config)
+
+def extract(staging_dir):
+    """
+    Copies the source tables to staging files, without connecting to the 
+    target database.
+
+    Args:
+        staging_dir (str): Directory for the staging files.
+    """
+    # create the logfile
+    oracle2postgres.create_logfile()
+
+    # get settings for migration
+    migration_config = oracle2postgres.get_migration_config()
+    source_config = oracle2postgres.get_source_config()
+
+    # check the schema exist on the source database
+    source_engine = oracle2postgres.connect_to_source(source_config)
+    oracle2postgres.check_schema_exist(source_engine,source_config['schema_list'])
+
+    # reflect the source schema once for all stages
+    cache_dir = migration_config['metadata_cache']
+    if cache_dir:
+        oracle2postgres.cache_metadata(source_engine,source_config['schema_list'],cache_dir)
+
+    # check and remove null characters in strings, unless they are 
+    # stripped during the copy
+    if not migration_config['strip_nulls']:
+        oracle2postgres.check_for_nulls(source_engine,source_config['schema_list'],remove=True,
+            cache_dir=cache_dir)
+    source_engine.dispose()
+
+    # extract the data
+    oracle2postgres.export_data(source_config,migration_config,staging_dir)
+
+def load(staging_dir,resume=False):
+    """
+    Loads the staging files into a new target database, without connecting
+    to the source database. Deletes the target database first, unless 
+    resuming an interrupted load.
+
+    Args:
+        staging_dir (str): Directory of the staging files.
+        resume (bool): Continue an interrupted load.
+    """
+    # create the logfile
+    oracle2postgres.create_logfile()
+
+    # get settings for migration
+    migration_config = oracle2postgres.get_migration_config()
+    target_config = oracle2postgres.get_target_config()
+
+    # create a new database on the target
+    # WARNING: deletes target database before creation!
+    if not resume:
+        target_engine = oracle2postgres.connect_to_target(target_config)
+        oracle2postgres.drop_connections(target_config['database'],target_engine)
+        oracle2postgres.drop_database(target_config['database'],target_engine)
+        oracle2postgres.create_database(target_config['database'],target_engine)
+
+    # load the data, then recreate the keys and indexes
+    oracle2postgres.load_data(target_config,migration_config,staging_dir,resume=resume)
+
+def plan(workers,calibrate_rows=0):
+    """
+    Estimates the duration and memory of a migration without copying any
+    data or connecting to the target database.
+
+    Args:
+        workers (list): Numbers of workers to estimate the wall-clock time for.
+        calibrate_rows (int): Rows to read from each of the largest tables 
+            without a measured throughput.
+    """
+    # create the logfile
+    oracle2postgres.create_logfile()
+
+    # get settings for migration
+    migration_config = oracle2postgres.get_migration_config()
+    source_config = oracle2postgres.get_source_config()
+
+    # check the schema exist on the source database
+    source_engine = oracle2postgres.connect_to_source(source_config)
+    oracle2postgres.check_schema_exist(source_engine,source_config['schema_list'])
+    source_engine.dispose()
+
+    oracle2postgres.plan_migration(source_config,migration_config,workers=workers,
+        calibrate_rows=calibrate_rows)
+
+def resume(coordinator=False):
+    """
+    Continues an interrupted migration, skipping the tables and chunks that
+    were completed.
+
+    Args:
+        coordinator (bool): Continue a distributed migration, queueing the 
+            failed items again for the workers.
+    """
+    # create the logfile
+    oracle2postgres.create_logfile()
+
+    # get settings for migration
+    migration_config = oracle2postgres.get_migration_config()
+    source_config = oracle2postgres.get_source_config()
+    target_config = oracle2postgres.get_target_config()
+
+    # resume the migration
+    migration_config['checkpoint'] = True
+    if coordinator:
+        oracle2postgres.distribute(source_config,target_config,migration_config,resume=True)
+    else:
+        oracle2postgres.migrate(source_config,target_config,migration_config,resume=True)
+
+    # recreate the keys and indexes
+    oracle2postgres.create_target_constraints(source_config,target_config,migration_config)
+
+def worker():
+    """
+    Copies work items from the queue of a distributed migration until it 
+    is empty. Use the same migration settings as the coordinator.
+    """
+    # create the logfile
+    oracle2postgres.create_logfile()
+
+    # get settings for migration
+    migration_config = oracle2postgres.get_migration_config()
+    source_config = oracle2postgres.get_source_config()
+    target_config = oracle2postgres.get_target_config()
+
+    # copy work items until the queue is empty
+    oracle2postgres.work(source_config,target_config,migration_config)
+
+def sync():
+    """
+    Runs an incremental catch-up pass against an existing target database.
+    """
+    # create the logfile
+    oracle2postgres.create_logfile()
+
+    # get settings for migration
+    migration_config = oracle2postgres.get_migration_config()
+    source_config = oracle2postgres.get_source_config()
+    target_config = oracle2postgres.get_target_config()
 
-    # run the migration
-    oracle2postgres.migrate(source_config,target_config,migration_config)
+    # copy the changed rows
+    oracle2postgres.sync(source_config,target_config,migration_config)
 
 if __name__ == "__main__":
     """
@@ -0,0 +1,48 @@
+import os
+import sys
+
+import pytest
+
+# the module and the scripts live at the top of the repository
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import oracle2postgres
+import run_benchmark
+
+# a Postgres database for the tests that load a real target. its 'main'
+# schema and the control schema are dropped by the tests.
+TARGET_URL = os.environ.get('ORACLE2POSTGRES_TEST_URL')
+
+
+@pytest.fixture(scope='session')
+def source_config(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp('stand_in') / 'source.sqlite')
+    run_benchmark.create_source(path,200)
+    return run_benchmark.get_source_config(path)
+
+
+@pytest.fixture
+def target_config():
+    if not TARGET_URL:
+        pytest.skip('needs a Postgres database in ORACLE2POSTGRES_TEST_URL')
+    return {'url': TARGET_URL, 'database': None}
+
+
+@pytest.fixture
+def target_engine(source_config, target_config):
+    # the stand-in tables, created empty on the target
+    source_engine = oracle2postgres.connect_to_source(source_config)
+    engine = oracle2postgres.connect_to_target(target_config)
+    engine.execute('DROP SCHEMA IF EXISTS {} CASCADE'.format(run_benchmark.SCHEMA))
+    engine.execute('DROP SCHEMA IF EXISTS {} CASCADE'.format(oracle2postgres._CONTROL_SCHEMA))
+    oracle2postgres.create_target_schema(source_config['schema_list'],source_engine,engine,
+        number_types='declared')
+    source_engine.dispose()
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def migration_config():
+    return dict(run_benchmark.get_migration_config({'batchsize': 50, 'pipeline': False,
+        'load_method': 'copy', 'processes': 1}),checkpoint=True)
@@ -0,0 +1,102 @@
+"""
+Tests for the asyncio copy engine. The tests that copy into a real target
+use the Postgres database in ORACLE2POSTGRES_TEST_URL.
+"""
+import asyncio
+import concurrent.futures
+import time
+
+import pytest
+import sqlalchemy
+
+import oracle2postgres
+
+
+@pytest.fixture(params=['asyncpg','psycopg2'])
+def driver(request, monkeypatch):
+    # the engine loads with asyncpg if it is installed, else with psycopg2
+    if request.param == 'asyncpg' and not oracle2postgres.asyncpg:
+        pytest.skip('needs asyncpg')
+    if request.param == 'psycopg2':
+        monkeypatch.setattr(oracle2postgres,'asyncpg',None)
+    return request.param
+
+
+def _get_table():
+    metadata = sqlalchemy.MetaData()
+    return sqlalchemy.Table('o2p_async_copy',metadata,sqlalchemy.Column('id',sqlalchemy.Integer),
+        sqlalchemy.Column('name',sqlalchemy.Text),schema='public')
+
+
+def test_encode_streams_pieces():
+    # rows larger than a piece are sent as several chunks of UTF-8
+    rows = [(i,'é' * oracle2postgres._LOB_PIECE_SIZE) for i in range(3)]
+    expected = ''.join([oracle2postgres._format_copy_row(row) for row in rows]).encode('utf-8')
+
+    async def read():
+        with concurrent.futures.ThreadPoolExecutor(1) as executor:
+            target = oracle2postgres._AsyncTarget({},executor)
+            stream = oracle2postgres._CopyStream(rows)
+            return [chunk async for chunk in target._encode(stream)]
+
+    chunks = asyncio.run(read())
+    assert len(chunks) > 1
+    assert all([isinstance(chunk,bytes) for chunk in chunks])
+    assert b''.join(chunks) == expected
+
+
+def test_copy_into_target(target_config, driver):
+    engine = oracle2postgres.connect_to_target(target_config)
+    table = _get_table()
+    table.drop(engine,checkfirst=True)
+    table.create(engine)
+    rows = [(i,'row\t{}\né'.format(i)) for i in range(1000)] + [(1000,None)]
+
+    async def copy():
+        with concurrent.futures.ThreadPoolExecutor(1) as executor:
+            target = oracle2postgres._AsyncTarget(oracle2postgres._get_connect_args(engine),executor)
+            await target.connect()
+            try:
+                return await target.copy(table,rows,(table.schema,table.name))
+            finally:
+                await target.close()
+
+    try:
+        nbytes, seconds = asyncio.run(copy())
+        copied = engine.execute(table.select().order_by(table.c.id)).fetchall()
+    finally:
+        table.drop(engine)
+        engine.dispose()
+
+    assert [tuple(row) for row in copied] == rows
+    assert nbytes > 0
+
+
+def _get_sessions(engine):
+    return engine.execute("""SELECT COUNT(*), COUNT(*) FILTER (WHERE state LIKE 'idle in transaction%%')
+        FROM pg_stat_activity
+        WHERE datname = current_database() AND pid <> pg_backend_pid()""").fetchone()
+
+
+def test_failed_stream_stops_the_others(source_config, target_config, target_engine,
+    migration_config, driver):
+    migration_config = dict(migration_config,checkpoint=False,concurrency=2,batchsize=10)
+    sessions = _get_sessions(target_engine)
+
+    # narrow fails part way while the other tables are streaming
+    target_engine.execute('ALTER TABLE main.narrow ADD CONSTRAINT stop CHECK (id <> 150)')
+    with pytest.raises(Exception):
+        oracle2postgres.migrate(source_config,target_config,migration_config)
+
+    # every connection of the engine is closed, and no transaction is left
+    # open holding locks on the target
+    deadline = time.time() + 10
+    while time.time() < deadline:
+        count, idle = _get_sessions(target_engine)
+        if count <= sessions[0] and not idle:
+            break
+        time.sleep(0.1)
+    assert count <= sessions[0]
+    assert not idle
+    target_engine.execute('ALTER TABLE main.narrow DROP CONSTRAINT stop')
+    assert target_engine.execute('SELECT COUNT(*) FROM main.narrow').scalar() == 150
@@ -0,0 +1,108 @@
+"""
+Tests for the sizing and pipelining of batches, and the planner's estimates.
+"""
+import pytest
+
+import oracle2postgres
+
+
+def test_queue_depth_fits_budget():
+    # 1000 rows of 100 bytes take ~400 KB in memory
+    assert oracle2postgres._get_queue_depth(1000,100,1) == 1
+    assert oracle2postgres._get_queue_depth(1000,100,100) == 100 * 1024 * 1024 // (1000 * 100 * 4) - 2
+
+
+def test_batch_sizer_fixed():
+    sizer = oracle2postgres._BatchSizer(1024,2,100,batchsize=500)
+    sizer.update([(1,)] * 500,1.0)
+    assert sizer() == 500
+
+
+def test_batch_sizer_within_limits():
+    sizer = oracle2postgres._BatchSizer(1,2,1000)
+    # 1 MB over 2 batches of 4000 byte rows
+    assert sizer() == 131
+    sizer = oracle2postgres._BatchSizer(1,2,10 ** 6)
+    assert sizer() == oracle2postgres._MIN_BATCHSIZE
+
+
+def test_batch_sizer_follows_throughput():
+    sizer = oracle2postgres._BatchSizer(1024,2,10)
+    first = sizer()
+    sizer.update([(1,)] * first,1.0)
+    grown = sizer()
+    assert grown > first
+
+    # slower per row: turns back with a smaller step
+    sizer.update([(1,)] * grown,grown / float(first) * 4)
+    assert first < sizer() < grown
+
+
+def test_makespan():
+    assert oracle2postgres._get_makespan([5,4,3,3,2,2],2) == 10
+    assert oracle2postgres._get_makespan([5,4,3],1) == 12
+    assert oracle2postgres._get_makespan([5,1,1],8) == 5
+    assert oracle2postgres._get_makespan([],4) == 0
+
+
+def test_item_memory():
+    config = {'batchsize': 1000, 'memory_budget_mb': 1024, 'pipeline': False, 'lob_inline_kb': None}
+    assert oracle2postgres._get_item_memory(config,100) == 2 * 1000 * 100 * 4
+
+    # automatic batches are capped by the budget
+    config = dict(config,batchsize=None)
+    assert oracle2postgres._get_item_memory(config,1000) == 1024 * 1024 * 1024
+    assert oracle2postgres._get_item_memory(config,10) == 2 * oracle2postgres._MAX_BATCHSIZE * 10 * 4
+
+    # inline LOBs are capped at lob_inline_kb, and pieces are streamed
+    config = dict(config,batchsize=1000,lob_inline_kb=1)
+    assert oracle2postgres._get_item_memory(config,100,1,5000) == \
+        2 * 1000 * (100 * 4 + 1024) + oracle2postgres._LOB_PIECE_SIZE
+
+
+def test_shared_tables():
+    work_items = [('s','whole',10,None,None),('s','chunked',10,('AAA','AAB'),None),
+        ('s','chunked',10,('AAC','AAD'),None),('s','parted',10,None,'P1')]
+    assert oracle2postgres._get_shared_tables(work_items) == [('s','chunked'),('s','parted')]
+
+
+def test_pipeline_yields_in_order():
+    batches = (list(range(i,i + 3)) for i in range(0,30,3))
+    assert list(oracle2postgres._pipeline_batches(batches,2)) == [list(range(i,i + 3))
+        for i in range(0,30,3)]
+
+
+def test_pipeline_raises_producer_errors():
+    closed = []
+
+    def fetch():
+        try:
+            yield [1]
+            yield [2]
+            raise ValueError('fetch failed')
+        finally:
+            closed.append(True)
+
+    pipe = oracle2postgres._pipeline_batches(fetch(),1)
+    assert next(pipe) == [1]
+    assert next(pipe) == [2]
+    with pytest.raises(ValueError, match='fetch failed'):
+        next(pipe)
+    assert closed == [True]
+
+
+def test_pipeline_stops_producer_when_closed():
+    closed = []
+
+    def fetch():
+        try:
+            while True:
+                yield [1]
+        finally:
+            closed.append(True)
+
+    # the consumer stops early, e.g. when a write fails
+    pipe = oracle2postgres._pipeline_batches(fetch(),2)
+    assert next(pipe) == [1]
+    pipe.close()
+    assert closed == [True]
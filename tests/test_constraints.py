@@ -0,0 +1,65 @@
+"""
+Tests for rebuilding keys, indexes and foreign keys after the load, from a
+SQLite source with constraints to the Postgres database in
+ORACLE2POSTGRES_TEST_URL.
+"""
+import sqlite3
+import sys
+
+import pytest
+
+import oracle2postgres
+import run_benchmark
+import run_migration
+
+
+@pytest.fixture
+def keyed_source(tmp_path):
+    # constraints are named, as they always are on Oracle
+    path = str(tmp_path / 'keyed.sqlite')
+    con = sqlite3.connect(path)
+    con.executescript("""
+        CREATE TABLE parent (id NUMBER(10), code VARCHAR2(10),
+            CONSTRAINT parent_pk PRIMARY KEY (id),
+            CONSTRAINT parent_code UNIQUE (code));
+        CREATE TABLE child (id NUMBER(10), parent_id NUMBER(10),
+            CONSTRAINT child_pk PRIMARY KEY (id),
+            CONSTRAINT child_parent_fk FOREIGN KEY (parent_id) REFERENCES parent (id));
+        CREATE INDEX child_parent ON child (parent_id);""")
+    con.close()
+    return run_benchmark.get_source_config(path)
+
+
+def test_main_rebuilds_constraints_past_failures(keyed_source, target_config, migration_config,
+    monkeypatch, capsys):
+    engine = oracle2postgres.connect_to_target(target_config)
+    engine.execute('DROP SCHEMA IF EXISTS main CASCADE')
+    migration_config = dict(migration_config,metadata_cache=None,strip_nulls=True,
+        type_report=None,partitions=True,index_processes=2)
+
+    def migrate(source_config,target_config,migration_config):
+        # a duplicate code, and a child of a missing parent
+        engine.execute("INSERT INTO main.parent VALUES (1, 'a'), (2, 'a')")
+        engine.execute("INSERT INTO main.child VALUES (1, 1), (2, 9)")
+
+    # a fresh target, without dropping and creating the database
+    monkeypatch.setattr(sys,'argv',['run_migration.py'])
+    monkeypatch.setattr('builtins.input',lambda msg: 'y')
+    monkeypatch.setattr(oracle2postgres,'create_logfile',lambda: None)
+    monkeypatch.setattr(oracle2postgres,'get_migration_config',lambda: migration_config)
+    monkeypatch.setattr(oracle2postgres,'get_source_config',lambda: keyed_source)
+    monkeypatch.setattr(oracle2postgres,'get_target_config',lambda: target_config)
+    for name in ('drop_connections','drop_database','create_database'):
+        monkeypatch.setattr(oracle2postgres,name,lambda dbname, engine: None)
+    monkeypatch.setattr(oracle2postgres,'migrate',migrate)
+
+    run_migration.main()
+
+    assert 'Keys and indexes created (2 statements failed, see log)' in capsys.readouterr().out
+    constraints = dict(engine.execute("""SELECT conname, convalidated FROM pg_constraint
+        WHERE connamespace = 'main'::regnamespace""").fetchall())
+    # the foreign key is kept NOT VALID, so new rows are still checked
+    assert constraints == {'parent_pk': True, 'child_pk': True, 'child_parent_fk': False}
+    assert engine.execute("SELECT to_regclass('main.child_parent')").scalar() == 'main.child_parent'
+    engine.execute('DROP SCHEMA main CASCADE')
+    engine.dispose()
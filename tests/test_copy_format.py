@@ -0,0 +1,81 @@
+"""
+Tests for the serialization of rows to the Postgres COPY text format.
+"""
+from datetime import datetime, date, timedelta
+from decimal import Decimal
+
+import sqlalchemy
+from sqlalchemy.dialects import oracle
+
+import oracle2postgres
+
+
+def test_format_copy_value_escapes_text():
+    assert oracle2postgres._format_copy_value('a\tb\nc\rd\\e') == 'a\\tb\\nc\\rd\\\\e'
+    assert oracle2postgres._format_copy_value(None) == '\\N'
+    # the null character is only removed when stripping nulls
+    assert oracle2postgres._format_copy_value('a\x00b') == 'a\x00b'
+    assert oracle2postgres._format_copy_value('a\x00b',
+        oracle2postgres._COPY_ESCAPES_STRIP_NULLS) == 'ab'
+
+
+def test_format_copy_value_types():
+    assert oracle2postgres._format_copy_value(True) == 't'
+    assert oracle2postgres._format_copy_value(b'\x00\xff') == '\\\\x00ff'
+    assert oracle2postgres._format_copy_value(float('nan')) == 'NaN'
+    assert oracle2postgres._format_copy_value(float('-inf')) == '-Infinity'
+    assert oracle2postgres._format_copy_value(0.1) == '0.1'
+    assert oracle2postgres._format_copy_value(Decimal('1.50')) == '1.50'
+    assert oracle2postgres._format_copy_value(datetime(2020,1,2,3,4,5,6)) == '2020-01-02 03:04:05.000006'
+    assert oracle2postgres._format_copy_value(date(2020,1,2)) == '2020-01-02'
+    assert oracle2postgres._format_copy_value(timedelta(seconds=-1)) == '-1 days 86399 seconds 0 microseconds'
+
+
+def test_copy_stream_reads_in_pieces():
+    rows = [(i,'text {}'.format(i),None) for i in range(100)]
+    expected = ''.join([oracle2postgres._format_copy_row(row) for row in rows])
+
+    stream = oracle2postgres._CopyStream(rows)
+    pieces = []
+    piece = stream.read(7)
+    while piece:
+        assert len(piece) <= 7
+        pieces.append(piece)
+        piece = stream.read(7)
+
+    assert ''.join(pieces) == expected
+    assert stream.chars_read == len(expected)
+    assert oracle2postgres._CopyStream(rows).read() == expected
+
+
+def _get_table(*types):
+    metadata = sqlalchemy.MetaData()
+    columns = [sqlalchemy.Column('c{}'.format(i),t) for i, t in enumerate(types)]
+    return sqlalchemy.Table('t',metadata,*columns)
+
+
+def test_column_kinds():
+    table = _get_table(oracle.NUMBER(10),oracle.NUMBER(12,2),oracle.BINARY_DOUBLE(),
+        oracle.DATE(),sqlalchemy.types.VARCHAR(10),oracle.RAW(),oracle.CLOB())
+    assert oracle2postgres._get_column_kinds(table) == ['int','decimal','float',
+        'datetime','text','bytes','other']
+
+
+def test_encode_columns_matches_rows():
+    table = _get_table(oracle.NUMBER(10),oracle.NUMBER(12,2),oracle.BINARY_DOUBLE(),
+        oracle.DATE(),sqlalchemy.types.VARCHAR(10),oracle.RAW(16))
+    kinds = oracle2postgres._get_column_kinds(table)
+    data = [(1,Decimal('1.25'),0.5,datetime(2020,1,1,12),'a\tb',b'\x01'),
+        (None,None,None,None,None,None),
+        (3,Decimal('-7'),float('nan'),datetime(2020,1,1),'back\\slash\nline',b''),
+        (4,Decimal('0.10'),1e300,datetime(2021,6,30,1,2,3,4),'\x1e',b'\xff')]
+
+    expected = ''.join([oracle2postgres._format_copy_row(row) for row in data])
+    assert oracle2postgres._encode_columns(data,kinds) == expected
+    assert oracle2postgres._encode_columns([],kinds) == ''
+
+
+def test_encode_columns_strips_nulls():
+    kinds = ['text']
+    data = [('a\x00b',),('c',)]
+    assert oracle2postgres._encode_columns(data,kinds,strip_nulls=True) == 'ab\nc\n'
@@ -0,0 +1,90 @@
+"""
+Tests for the work queue of a distributed migration, against the Postgres
+database in ORACLE2POSTGRES_TEST_URL.
+"""
+import threading
+
+import pytest
+
+import oracle2postgres
+import run_benchmark
+
+_ITEMS = [('main','narrow',300,None,None),('main','wide',200,None,None),
+    ('main','lobs',100,None,None)]
+
+
+@pytest.fixture
+def queue(target_engine):
+    oracle2postgres._create_checkpoints(target_engine,_ITEMS)
+    return target_engine
+
+
+def _get_item(engine,table_name):
+    return engine.execute("""SELECT status, worker, attempts, rows_copied
+        FROM {}.checkpoint WHERE table_name = '{}'""".format(oracle2postgres._CONTROL_SCHEMA,
+        table_name)).fetchone()
+
+
+def test_claim_largest_first(queue):
+    claimed = [oracle2postgres._claim_work_item(queue,'w{}'.format(i)) for i in range(4)]
+    assert [x[1] for x in claimed[:3]] == ['narrow','wide','lobs']
+    assert claimed[3] is None
+    assert _get_item(queue,'wide')[:3] == ('running','w1',1)
+
+
+def test_expired_lease_is_claimed_again(queue):
+    item = oracle2postgres._claim_work_item(queue,'w1',lease_seconds=0)
+    again = oracle2postgres._claim_work_item(queue,'w2')
+    assert again[:5] == item[:5]
+    assert _get_item(queue,'narrow')[:3] == ('running','w2',2)
+
+    # the first worker can no longer update or checkpoint the item
+    assert not oracle2postgres._update_work_item(queue,item,'w1',"status = 'pending'")
+    connection = queue.raw_connection()
+    with pytest.raises(oracle2postgres._LeaseLost):
+        oracle2postgres._save_checkpoint(connection,'main','narrow',None,rows=10,owner='w1')
+    connection.rollback()
+    oracle2postgres._save_checkpoint(connection,'main','narrow',None,rows=10,owner='w2')
+    connection.commit()
+    connection.close()
+    assert _get_item(queue,'narrow')[3] == 10
+
+
+def test_requeued_item_is_claimed_again(queue):
+    item = oracle2postgres._claim_work_item(queue,'w1')
+    assert oracle2postgres._update_work_item(queue,item,'w1',"status = 'pending', lease_until = NULL")
+    assert oracle2postgres._claim_work_item(queue,'w2')[:5] == item[:5]
+
+
+def test_lost_item_is_not_committed(source_config, target_config, queue, migration_config):
+    item = oracle2postgres._claim_work_item(queue,'w1')
+    # another worker claims the item before the copy commits
+    queue.execute("UPDATE {}.checkpoint SET worker = 'w2' WHERE table_name = 'narrow'".format(
+        oracle2postgres._CONTROL_SCHEMA))
+    with pytest.raises(oracle2postgres._LeaseLost):
+        oracle2postgres._migrate_table('main','narrow',source_config,target_config,
+            migration_config,owner='w1',lease_lost=threading.Event())
+    assert queue.execute('SELECT COUNT(*) FROM main.narrow').scalar() == 0
+
+    # a worker that is told it lost the lease stops before the first batch
+    lost = threading.Event()
+    lost.set()
+    with pytest.raises(oracle2postgres._LeaseLost):
+        oracle2postgres._migrate_table('main','wide',source_config,target_config,
+            migration_config,owner='w2',lease_lost=lost)
+    assert queue.execute('SELECT COUNT(*) FROM main.wide').scalar() == 0
+
+
+def test_worker_copies_the_queue(source_config, target_config, target_engine, migration_config):
+    source_engine = oracle2postgres.connect_to_source(source_config)
+    work_items = oracle2postgres._get_work_items(source_engine,source_config['schema_list'])
+    oracle2postgres._create_checkpoints(target_engine,[x + (None,None) for x in work_items])
+
+    timings = oracle2postgres._run_worker(source_config,target_config,migration_config)
+
+    assert len(timings) == len(run_benchmark.TABLES)
+    for table_name, _, _ in run_benchmark.TABLES:
+        assert _get_item(target_engine,table_name)[0] == 'done'
+        assert target_engine.execute('SELECT COUNT(*) FROM main.{}'.format(table_name)).scalar() == \
+            source_engine.execute('SELECT COUNT(*) FROM {}'.format(table_name)).scalar()
+    source_engine.dispose()
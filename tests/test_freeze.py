@@ -0,0 +1,71 @@
+"""
+Tests for loads with COPY FREEZE, into the Postgres database in
+ORACLE2POSTGRES_TEST_URL. Postgres rejects COPY FREEZE on a partitioned
+table, so those loads fall back to a normal COPY.
+"""
+import json
+import logging
+import os
+
+import oracle2postgres
+import run_benchmark
+
+_PARTITIONED = """CREATE TABLE main.narrow (id BIGINT, code VARCHAR(10), amount NUMERIC(12, 2))
+    PARTITION BY RANGE (id)"""
+_PARTITION = 'CREATE TABLE main.narrow_all PARTITION OF main.narrow FOR VALUES FROM (MINVALUE) TO (MAXVALUE)'
+
+
+def _get_counts(engine,schema=None):
+    prefix = '{}.'.format(schema) if schema else ''
+    return {x[0]: engine.execute('SELECT COUNT(*) FROM {}{}'.format(prefix,x[0])).scalar()
+        for x in run_benchmark.TABLES}
+
+
+def _get_fallbacks(caplog):
+    return sorted([x.getMessage().split(' with COPY FREEZE')[0] for x in caplog.records
+        if 'with COPY FREEZE. Loading without it' in x.getMessage()])
+
+
+def test_rejected_freeze_loads_normally(source_config, target_config, target_engine,
+    migration_config, caplog):
+    target_engine.execute('DROP TABLE main.narrow')
+    target_engine.execute(_PARTITIONED)
+    target_engine.execute(_PARTITION)
+    migration_config = dict(migration_config,freeze=True)
+
+    with caplog.at_level(logging.INFO):
+        oracle2postgres.migrate(source_config,target_config,migration_config)
+
+    # only the partitioned table falls back, and each row is copied once
+    assert _get_fallbacks(caplog) == ['Unable to load main.narrow']
+    source_engine = oracle2postgres.connect_to_source(source_config)
+    assert _get_counts(target_engine,'main') == _get_counts(source_engine)
+    source_engine.dispose()
+
+
+def test_rejected_freeze_loads_staged_file(source_config, target_config, migration_config,
+    tmp_path, caplog):
+    staging_dir = str(tmp_path)
+    oracle2postgres.export_data(source_config,migration_config,staging_dir)
+    path = os.path.join(staging_dir,'manifest.json')
+    with open(path) as f:
+        manifest = json.load(f)
+    ddl = [x for x in manifest['schema_ddl'] if 'CREATE TABLE main.narrow ' not in x]
+    manifest['schema_ddl'] = ddl + [_PARTITIONED,_PARTITION]
+    with open(path,'w') as f:
+        json.dump(manifest,f)
+
+    engine = oracle2postgres.connect_to_target(target_config)
+    engine.execute('DROP SCHEMA IF EXISTS main CASCADE')
+    engine.execute('DROP SCHEMA IF EXISTS {} CASCADE'.format(oracle2postgres._CONTROL_SCHEMA))
+    with caplog.at_level(logging.INFO):
+        oracle2postgres.load_data(target_config,dict(migration_config,freeze=True),staging_dir)
+
+    narrow = [x['path'] for x in manifest['files'] if x['table'] == 'narrow'][0]
+    assert _get_fallbacks(caplog) == ['Unable to load {}'.format(narrow)]
+    source_engine = oracle2postgres.connect_to_source(source_config)
+    assert _get_counts(engine,'main') == _get_counts(source_engine)
+    source_engine.dispose()
+    engine.execute('DROP SCHEMA main CASCADE')
+    engine.execute('DROP SCHEMA {} CASCADE'.format(oracle2postgres._CONTROL_SCHEMA))
+    engine.dispose()
@@ -0,0 +1,72 @@
+"""
+Tests for the cache of reflected schema metadata, with a SQLite source.
+"""
+import logging
+import os
+import pickle
+
+import pytest
+import sqlalchemy
+
+import oracle2postgres
+
+
+@pytest.fixture
+def engine(tmp_path, monkeypatch):
+    monkeypatch.setattr(oracle2postgres,'_loaded_metadata',{})
+    engine = sqlalchemy.create_engine('sqlite:///{}'.format(tmp_path / 'source.sqlite'))
+    engine.execute('CREATE TABLE first (id INTEGER)')
+    yield engine
+    engine.dispose()
+
+
+def _get_names(metadata):
+    return sorted([t.name for t in metadata.sorted_tables])
+
+
+def test_cache_is_read_until_refreshed(engine, tmp_path):
+    cache_dir = str(tmp_path / 'cache')
+    assert _get_names(oracle2postgres._reflect_schema(engine,'main',cache_dir)) == ['first']
+    path = oracle2postgres._get_metadata_cache_path(engine,'main',cache_dir)
+    assert os.path.exists(path)
+
+    # the cache is read, not the database
+    engine.execute('CREATE TABLE second (id INTEGER)')
+    metadata = oracle2postgres._reflect_schema(engine,'main',cache_dir)
+    assert _get_names(metadata) == ['first']
+    assert metadata.bind is engine
+    assert _get_names(oracle2postgres._reflect_schema(engine,'main',cache_dir,refresh=True)) == \
+        ['first','second']
+    assert _get_names(oracle2postgres._reflect_schema(engine,'main',cache_dir)) == ['first','second']
+
+
+@pytest.mark.parametrize('content', [b'not a pickle',
+    pickle.dumps({'version': oracle2postgres._METADATA_CACHE_VERSION - 1, 'metadata': None})])
+def test_bad_cache_is_replaced(engine, tmp_path, content, caplog):
+    cache_dir = str(tmp_path / 'cache')
+    os.makedirs(cache_dir)
+    path = oracle2postgres._get_metadata_cache_path(engine,'main',cache_dir)
+    with open(path,'wb') as f:
+        f.write(content)
+
+    with caplog.at_level(logging.INFO):
+        assert _get_names(oracle2postgres._reflect_schema(engine,'main',cache_dir)) == ['first']
+    with open(path,'rb') as f:
+        cached = pickle.load(f)
+    assert cached['version'] == oracle2postgres._METADATA_CACHE_VERSION
+    assert _get_names(cached['metadata']) == ['first']
+    if content == b'not a pickle':
+        assert any(['Unable to read cached metadata for main' in x.getMessage() for x in caplog.records])
+
+
+def test_tables_share_the_cached_metadata(engine, tmp_path):
+    cache_dir = str(tmp_path / 'cache')
+    oracle2postgres.cache_metadata(engine,['main'],cache_dir)
+    table = oracle2postgres._get_table(engine,'main','first',cache_dir)
+    assert oracle2postgres._get_table(engine,'main','first',cache_dir) is table
+
+    # caching again replaces the metadata of this process
+    engine.execute('CREATE TABLE second (id INTEGER)')
+    oracle2postgres.cache_metadata(engine,['main'],cache_dir)
+    assert oracle2postgres._get_table(engine,'main','first',cache_dir) is not table
+    assert oracle2postgres._get_table(engine,'main','second',cache_dir).name == 'second'
@@ -0,0 +1,46 @@
+"""
+Tests for stripping null characters while loading, into the Postgres
+database in ORACLE2POSTGRES_TEST_URL.
+"""
+from decimal import Decimal
+
+import psycopg2
+import pytest
+
+import oracle2postgres
+import run_benchmark
+
+_ROWS = [(1,'a\x00b\x00',Decimal('1.50')),(2,None,None),(3,'\x00',Decimal('0'))]
+
+
+def test_strip_nulls():
+    assert oracle2postgres._strip_nulls(_ROWS) == [[1,'ab',Decimal('1.50')],[2,None,None],
+        [3,'',Decimal('0')]]
+
+
+def _get_narrow(source_config):
+    engine = oracle2postgres._get_engine(source_config)
+    return oracle2postgres._get_table(engine,run_benchmark.SCHEMA,'narrow')
+
+
+@pytest.mark.parametrize('method, columnar', [('copy',False),('copy',True),('insert',False)])
+def test_insert_data_strips_nulls(source_config, target_engine, method, columnar):
+    table = _get_narrow(source_config)
+    connection = target_engine.raw_connection()
+    oracle2postgres._insert_data(connection,table,_ROWS,method,strip_nulls=True,columnar=columnar)
+    connection.close()
+
+    rows = target_engine.execute('SELECT * FROM main.narrow ORDER BY id').fetchall()
+    assert [tuple(x) for x in rows] == [(1,'ab',Decimal('1.50')),(2,None,None),(3,'',Decimal('0'))]
+
+
+@pytest.mark.parametrize('method', ['copy','insert'])
+def test_nulls_fail_unless_stripped(source_config, target_engine, method):
+    # Postgres text cannot hold the null character
+    table = _get_narrow(source_config)
+    connection = target_engine.raw_connection()
+    with pytest.raises((psycopg2.Error,ValueError)):
+        oracle2postgres._insert_data(connection,table,_ROWS,method)
+    connection.rollback()
+    connection.close()
+    assert target_engine.execute('SELECT COUNT(*) FROM main.narrow').scalar() == 0
@@ -0,0 +1,116 @@
+"""
+Tests for the mapping of the source schema to the target schema.
+"""
+from datetime import date
+
+import pytest
+import sqlalchemy
+from sqlalchemy.dialects import oracle
+
+import oracle2postgres
+
+
+@pytest.mark.parametrize('ora_type, expected', [
+    (oracle.NUMBER(4), 'SMALLINT'),
+    (oracle.NUMBER(9), 'INTEGER'),
+    (oracle.NUMBER(18), 'BIGINT'),
+    (oracle.NUMBER(19), 'NUMERIC(19, 0)'),
+    (oracle.NUMBER(12,2), 'NUMERIC(12, 2)'),
+    (oracle.NUMBER(3,5), 'NUMERIC(5, 5)'),
+    (oracle.NUMBER(5,-2), 'INTEGER'),
+    (oracle.NUMBER(), 'NUMERIC'),
+    (oracle.BINARY_DOUBLE(), 'DOUBLE PRECISION'),
+    (oracle.BINARY_FLOAT(), 'REAL'),
+    (sqlalchemy.types.Float(), 'NUMERIC'),
+])
+def test_narrow_number(ora_type, expected):
+    pg_type, reason = oracle2postgres._narrow_number(ora_type)
+    assert str(pg_type) == expected
+
+
+def test_narrow_number_profile():
+    pg_type, reason = oracle2postgres._narrow_number(oracle.NUMBER(),(-5,40000,False))
+    assert (str(pg_type), reason) == ('INTEGER', 'profiled range')
+    # fractions, or values too large for BIGINT, stay NUMERIC
+    assert str(oracle2postgres._narrow_number(oracle.NUMBER(),(0,1,True))[0]) == 'NUMERIC'
+    assert str(oracle2postgres._narrow_number(oracle.NUMBER(),(0,2**63,False))[0]) == 'NUMERIC'
+
+
+def test_split_high_value():
+    assert oracle2postgres._split_high_value("10, 'a,b', TO_DATE(' 2020-01-01', 'SYYYY-MM-DD'), MAXVALUE") == \
+        ['10', "'a,b'", "TO_DATE(' 2020-01-01', 'SYYYY-MM-DD')", 'MAXVALUE']
+    assert oracle2postgres._split_high_value('DEFAULT') == ['DEFAULT']
+
+
+def test_format_bound():
+    assert oracle2postgres._format_bound("it's") == "'it''s'"
+    assert oracle2postgres._format_bound(date(2020,1,1)) == "'2020-01-01'"
+    assert oracle2postgres._format_bound(None) == 'NULL'
+    assert oracle2postgres._format_bound(10) == '10'
+
+
+def test_partition_table_name():
+    assert oracle2postgres._get_partition_table_name('orders','P2020') == 'orders_p2020'
+    assert len(oracle2postgres._get_partition_table_name('t' * 60,'P2020')) == 63
+
+
+@pytest.fixture
+def engine():
+    # sqlite evaluates the partition bounds, with a stand-in for dual
+    engine = sqlalchemy.create_engine('sqlite://')
+    engine.execute('CREATE TABLE dual (dummy TEXT)')
+    engine.execute("INSERT INTO dual VALUES ('X')")
+    return engine
+
+
+def _get_table():
+    metadata = sqlalchemy.MetaData()
+    return sqlalchemy.Table('orders',metadata,sqlalchemy.Column('id',sqlalchemy.Integer),
+        sqlalchemy.Column('region',sqlalchemy.String),schema='sales')
+
+
+def test_range_partition_ddl(engine):
+    info = {'method': 'RANGE', 'columns': ['id'],
+        'partitions': [('P1','100',0),('P2','200',0),('PMAX','MAXVALUE',0)]}
+    partition_by, statements = oracle2postgres._get_partition_ddl(engine,_get_table(),info)
+
+    assert partition_by == 'RANGE (id)'
+    assert statements == [
+        'CREATE TABLE sales.orders_p1 PARTITION OF sales.orders FOR VALUES FROM (MINVALUE) TO (100)',
+        'CREATE TABLE sales.orders_p2 PARTITION OF sales.orders FOR VALUES FROM (100) TO (200)',
+        'CREATE TABLE sales.orders_pmax PARTITION OF sales.orders DEFAULT']
+
+
+def test_list_partition_ddl(engine):
+    info = {'method': 'LIST', 'columns': ['region'],
+        'partitions': [('EAST',"'NY', 'MA'",0),('OTHER','DEFAULT',0)]}
+    partition_by, statements = oracle2postgres._get_partition_ddl(engine,_get_table(),info)
+
+    assert partition_by == 'LIST (region)'
+    assert statements == [
+        "CREATE TABLE sales.orders_east PARTITION OF sales.orders FOR VALUES IN ('NY', 'MA')",
+        'CREATE TABLE sales.orders_other PARTITION OF sales.orders DEFAULT']
+
+
+def test_hash_partition_ddl():
+    info = {'method': 'HASH', 'columns': ['id'],
+        'partitions': [('H1',None,0),('H2',None,0)]}
+    partition_by, statements = oracle2postgres._get_partition_ddl(None,_get_table(),info)
+
+    assert partition_by == 'HASH (id)'
+    assert statements[1] == \
+        'CREATE TABLE sales.orders_h2 PARTITION OF sales.orders FOR VALUES WITH (MODULUS 2, REMAINDER 1)'
+
+
+def test_unsupported_partitioning():
+    info = {'method': 'REFERENCE', 'columns': [], 'partitions': [('P1',None,0)]}
+    assert oracle2postgres._get_partition_ddl(None,_get_table(),info) is None
+
+
+def test_select_query_orders_only_when_asked():
+    query, params = oracle2postgres._get_select_query('a','s','t',('AAA','AAB'),'AAA1',order=True)
+    assert query == ('SELECT a FROM s.t WHERE rowid BETWEEN CHARTOROWID(:lo_rowid) AND CHARTOROWID(:hi_rowid) '
+        'AND rowid > CHARTOROWID(:last_rowid) ORDER BY rowid')
+    assert params == {'lo_rowid': 'AAA', 'hi_rowid': 'AAB', 'last_rowid': 'AAA1'}
+    query, params = oracle2postgres._get_select_query('a','s','t',partition='P1')
+    assert query == 'SELECT a FROM s.t PARTITION ("P1")'
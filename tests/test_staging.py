@@ -0,0 +1,89 @@
+"""
+Tests for extracting the SQLite stand-in to staging files, and loading the
+files into the Postgres database in ORACLE2POSTGRES_TEST_URL.
+"""
+import gzip
+import json
+import os
+import shutil
+
+import pytest
+
+import oracle2postgres
+import run_benchmark
+
+
+@pytest.fixture(scope='module')
+def staged(source_config, tmp_path_factory):
+    staging_dir = str(tmp_path_factory.mktemp('staging'))
+    migration_config = run_benchmark.get_migration_config({'batchsize': 50, 'pipeline': False,
+        'load_method': 'copy', 'processes': 1})
+    oracle2postgres.export_data(source_config,migration_config,staging_dir)
+    return staging_dir
+
+
+def _get_counts(engine,schema=None):
+    prefix = '{}.'.format(schema) if schema else ''
+    return {x[0]: engine.execute('SELECT COUNT(*) FROM {}{}'.format(prefix,x[0])).scalar()
+        for x in run_benchmark.TABLES}
+
+
+def test_export_writes_files_and_manifest(source_config, staged):
+    manifest = oracle2postgres._read_manifest(staged)
+    assert manifest['version'] == oracle2postgres._STAGING_VERSION
+    assert manifest['schema_ddl'][0] == 'CREATE SCHEMA main'
+
+    # one complete file per table, each line a row in the COPY text format
+    assert sorted(os.listdir(staged)) == sorted([x['path'] for x in manifest['files']] + ['manifest.json'])
+    source_engine = oracle2postgres.connect_to_source(source_config)
+    assert {x['table']: x['rows'] for x in manifest['files']} == _get_counts(source_engine)
+    source_engine.dispose()
+    narrow = [x for x in manifest['files'] if x['table'] == 'narrow'][0]
+    assert narrow['columns'] == ['id','code','amount']
+    with gzip.open(os.path.join(staged,narrow['path']),'rt',encoding='utf-8') as f:
+        lines = f.read().splitlines()
+    assert len(lines) == narrow['rows']
+    assert all([len(x.split('\t')) == 3 for x in lines])
+
+
+def test_read_manifest_needs_finished_extract(staged, tmp_path):
+    with pytest.raises(SystemExit, match='Has the extract finished'):
+        oracle2postgres._read_manifest(str(tmp_path))
+
+    with open(os.path.join(staged,'manifest.json')) as f:
+        manifest = json.load(f)
+    with open(str(tmp_path / 'manifest.json'),'w') as f:
+        json.dump(dict(manifest,version=oracle2postgres._STAGING_VERSION + 1),f)
+    with pytest.raises(SystemExit, match='from another version'):
+        oracle2postgres._read_manifest(str(tmp_path))
+
+
+def test_load_resumes_after_failed_file(source_config, target_config, migration_config,
+    staged, tmp_path):
+    engine = oracle2postgres.connect_to_target(target_config)
+    engine.execute('DROP SCHEMA IF EXISTS main CASCADE')
+    engine.execute('DROP SCHEMA IF EXISTS {} CASCADE'.format(oracle2postgres._CONTROL_SCHEMA))
+
+    # the smallest file is loaded last, and is not a valid gzip file
+    staging_dir = str(tmp_path / 'staging')
+    shutil.copytree(staged,staging_dir)
+    manifest = oracle2postgres._read_manifest(staging_dir)
+    last = min(manifest['files'],key=lambda x: x['bytes'])
+    with open(os.path.join(staging_dir,last['path']),'wb') as f:
+        f.write(b'not gzip')
+    with pytest.raises(Exception):
+        oracle2postgres.load_data(target_config,migration_config,staging_dir)
+    loaded = [x[0] for x in engine.execute('SELECT path FROM {}.staged_file'.format(
+        oracle2postgres._CONTROL_SCHEMA))]
+    assert sorted(loaded) == sorted([x['path'] for x in manifest['files'] if x != last])
+    assert engine.execute('SELECT COUNT(*) FROM main.{}'.format(last['table'])).scalar() == 0
+
+    # the loaded files are skipped, so each row is copied once
+    shutil.copy(os.path.join(staged,last['path']),os.path.join(staging_dir,last['path']))
+    oracle2postgres.load_data(target_config,migration_config,staging_dir,resume=True)
+    source_engine = oracle2postgres.connect_to_source(source_config)
+    assert _get_counts(engine,'main') == _get_counts(source_engine)
+    source_engine.dispose()
+    engine.execute('DROP SCHEMA main CASCADE')
+    engine.execute('DROP SCHEMA {} CASCADE'.format(oracle2postgres._CONTROL_SCHEMA))
+    engine.dispose()
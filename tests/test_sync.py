@@ -0,0 +1,111 @@
+"""
+Tests for delta sync passes, from a small SQLite source with a primary key
+and a last-modified column, to the Postgres database in
+ORACLE2POSTGRES_TEST_URL.
+"""
+import sqlite3
+from datetime import datetime
+
+import pytest
+import sqlalchemy
+
+import oracle2postgres
+import run_benchmark
+
+_ROWS = [(1,'one',datetime(2020,1,1)),(2,'two',datetime(2020,1,2)),(3,'three',datetime(2020,1,3))]
+
+
+@pytest.fixture
+def delta(tmp_path, target_engine, migration_config):
+    path = str(tmp_path / 'delta.sqlite')
+    con = sqlite3.connect(path)
+    con.execute('CREATE TABLE items (id NUMBER(10) PRIMARY KEY, name VARCHAR2(10), updated TIMESTAMP)')
+    con.executemany('INSERT INTO items VALUES (?,?,?)',[(i,name,str(x)) for i, name, x in _ROWS])
+    con.commit()
+    target_engine.execute('CREATE TABLE main.items (id INTEGER PRIMARY KEY, name VARCHAR(10), updated TIMESTAMP)')
+    oracle2postgres._create_high_water_mark_table(target_engine)
+    migration_config = dict(migration_config,delta=True,delta_columns={'main.items': 'updated'})
+    yield con, run_benchmark.get_source_config(path), migration_config
+    con.close()
+
+
+def _get_rows(engine):
+    return [tuple(x) for x in engine.execute('SELECT * FROM main.items ORDER BY id')]
+
+
+def _get_mark(engine):
+    # SQLite returns the MAX of a timestamp as text
+    return oracle2postgres._get_saved_high_water_mark(engine,'main','items','updated')
+
+
+def test_high_water_mark_round_trip():
+    for value in [datetime(2020,1,2,3,4,5),datetime(2020,1,2,3,4,5,6),datetime(2020,1,2).date(),
+        oracle2postgres.Decimal('123456789012345'),'2020-01-02 03:04:05']:
+        encoded = oracle2postgres._encode_high_water_mark(value)
+        assert oracle2postgres._decode_high_water_mark(encoded) == value
+    assert oracle2postgres._encode_high_water_mark(None) is None
+
+
+def test_sync_copies_changed_rows(delta, target_config, target_engine):
+    con, source_config, migration_config = delta
+
+    # without a mark the table is reloaded, and the mark recorded
+    assert oracle2postgres._sync_table('main','items',source_config,target_config,
+        migration_config) == 3
+    assert _get_rows(target_engine) == _ROWS
+    assert _get_mark(target_engine) == '2020-01-03 00:00:00'
+
+    # a mark for another column is not used
+    assert oracle2postgres._get_saved_high_water_mark(target_engine,'main','items','created') is None
+
+    # rows changed at or after the mark replace the target rows
+    target_engine.execute("UPDATE main.items SET name = 'kept' WHERE id = 1")
+    con.execute("UPDATE items SET name = 'TWO', updated = '2020-01-05 00:00:00' WHERE id = 2")
+    con.execute("INSERT INTO items VALUES (4, 'four', '2020-01-04 00:00:00')")
+    con.commit()
+    assert oracle2postgres._sync_table('main','items',source_config,target_config,
+        migration_config) == 3
+    assert _get_rows(target_engine) == [(1,'kept',datetime(2020,1,1)),(2,'TWO',datetime(2020,1,5)),
+        _ROWS[2],(4,'four',datetime(2020,1,4))]
+    assert _get_mark(target_engine) == '2020-01-05 00:00:00'
+
+
+def test_merge_rows_replaces_matching_keys(target_engine):
+    target_engine.execute('CREATE TABLE main.items (id INTEGER, name VARCHAR(10), updated TIMESTAMP)')
+    target_engine.execute(sqlalchemy.text('INSERT INTO main.items VALUES (:id, :name, :updated)'),
+        [{'id': i, 'name': name, 'updated': x} for i, name, x in _ROWS])
+    table = sqlalchemy.Table('items',sqlalchemy.MetaData(),autoload=True,
+        autoload_with=target_engine,schema='main')
+
+    session = sqlalchemy.orm.sessionmaker(bind=target_engine)()
+    oracle2postgres._merge_rows(session,table,[(2,'TWO',None),(5,'five',None)],['id'])
+    # the staging table is dropped on commit, so a second merge can run
+    session.commit()
+    oracle2postgres._merge_rows(session,table,[(5,'FIVE',None)],['id'])
+    session.commit()
+    session.close()
+
+    assert _get_rows(target_engine) == [_ROWS[0],(2,'TWO',None),_ROWS[2],(5,'FIVE',None)]
+
+
+def test_failed_sync_keeps_the_mark(delta, target_config, target_engine):
+    con, source_config, migration_config = delta
+    oracle2postgres._sync_table('main','items',source_config,target_config,migration_config)
+    target_engine.execute("ALTER TABLE main.items ADD CONSTRAINT stop CHECK (name <> 'bad')")
+    con.execute("UPDATE items SET name = 'bad', updated = '2020-01-05 00:00:00' WHERE id = 2")
+    con.commit()
+
+    with pytest.raises(sqlalchemy.exc.IntegrityError):
+        oracle2postgres._sync_table('main','items',source_config,target_config,migration_config)
+
+    # the merge is rolled back, and the next pass starts from the same mark
+    assert _get_rows(target_engine) == _ROWS
+    assert _get_mark(target_engine) == '2020-01-03 00:00:00'
+    idle = target_engine.execute("""SELECT COUNT(*) FROM pg_stat_activity
+        WHERE datname = current_database() AND state LIKE 'idle in transaction%%'""").scalar()
+    assert idle == 0
+
+
+def test_sync_needs_delta(source_config, target_config, target_engine, migration_config):
+    with pytest.raises(SystemExit, match='Run the migration with delta sync enabled first'):
+        oracle2postgres.sync(source_config,target_config,migration_config)
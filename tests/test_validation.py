@@ -0,0 +1,108 @@
+"""
+Tests for the fingerprints used to validate a migration. The comparison
+of two databases uses the Postgres database in ORACLE2POSTGRES_TEST_URL.
+"""
+import logging
+
+import pytest
+import sqlalchemy
+from sqlalchemy.dialects import oracle, postgresql
+
+import oracle2postgres
+
+
+def _get_table():
+    metadata = sqlalchemy.MetaData()
+    return sqlalchemy.Table('t',metadata,
+        sqlalchemy.Column('id',oracle.NUMBER(10)),
+        sqlalchemy.Column('name',sqlalchemy.types.VARCHAR(10)),
+        sqlalchemy.Column('notes',oracle.CLOB()),
+        sqlalchemy.Column('payload',oracle.BLOB()),
+        sqlalchemy.Column('code',oracle.RAW(16)),
+        sqlalchemy.Column('created',oracle.DATE()),
+        sqlalchemy.Column('updated',sqlalchemy.types.TIMESTAMP()),schema='s')
+
+
+def test_fingerprint_kinds():
+    kinds = [oracle2postgres._get_fingerprint_kind(col) for col in _get_table().columns]
+    assert kinds == ['number','string','clob','lob','raw','datetime','timestamp']
+
+
+def test_fingerprints_match_between_databases():
+    table = _get_table()
+    oracle_query, oracle_names = oracle2postgres._get_fingerprint_query(table,oracle.dialect())
+    postgres_query, postgres_names = oracle2postgres._get_fingerprint_query(table,postgresql.dialect())
+    assert oracle_names == postgres_names
+
+
+def test_fingerprints_hash_content():
+    query, names = oracle2postgres._get_fingerprint_query(_get_table(),postgresql.dialect())
+    # strings, LOBs and RAWs are hashed, and timestamps keep microseconds
+    assert query.count('MD5(') == 6
+    assert 'EXTRACT(MICROSECONDS FROM updated)' in query
+    assert 'MICROSECONDS FROM created' not in query
+    query, names = oracle2postgres._get_fingerprint_query(_get_table(),oracle.dialect())
+    assert query.count('STANDARD_HASH(') == 6
+    assert "TO_CHAR(updated, 'FF6')" in query
+
+
+def test_char_padding_is_ignored():
+    metadata = sqlalchemy.MetaData()
+    table = sqlalchemy.Table('t',metadata,sqlalchemy.Column('code',oracle.CHAR(8)),
+        sqlalchemy.Column('name',oracle.NCHAR(8)))
+    assert [oracle2postgres._get_fingerprint_kind(col) for col in table.columns] == ['char','char']
+    # Oracle trims blank values to NULL, which are not hashed
+    query, names = oracle2postgres._get_fingerprint_query(table,oracle.dialect())
+    assert "STANDARD_HASH(UTL_I18N.STRING_TO_RAW(RTRIM(code), 'AL32UTF8'), 'MD5')" in query
+    query, names = oracle2postgres._get_fingerprint_query(table,postgresql.dialect())
+    assert "MD5(NULLIF(RTRIM(code), ''))" in query
+
+
+def test_key_ranges_are_open_at_both_ends():
+    engine = sqlalchemy.create_engine('sqlite://')
+    metadata = sqlalchemy.MetaData()
+    table = sqlalchemy.Table('t',metadata,sqlalchemy.Column('id',sqlalchemy.Integer,primary_key=True))
+    metadata.create_all(engine)
+    key = oracle2postgres._get_integer_key(table)
+    assert oracle2postgres._get_key_ranges(engine,table,key,4) == [(None,None)]
+
+    engine.execute(table.insert(),[{'id': i} for i in range(10,18)])
+    assert oracle2postgres._get_key_ranges(engine,table,key,4) == [(None,10),(10,12),(12,14),
+        (14,16),(16,18),(18,None)]
+
+
+@pytest.fixture
+def schemas(target_config):
+    # two schemas of one database, as the source and the target
+    engine = sqlalchemy.create_engine(target_config['url'])
+    engines = []
+    for schema in ('o2p_source','o2p_target'):
+        engine.execute('DROP SCHEMA IF EXISTS {0} CASCADE; CREATE SCHEMA {0}'.format(schema))
+        engine.execute("""CREATE TABLE {0}.keyed (id INTEGER PRIMARY KEY, name VARCHAR(10));
+            CREATE TABLE {0}.unkeyed (name VARCHAR(10));
+            INSERT INTO {0}.keyed SELECT i, 'row ' || i FROM generate_series(1, 100) i;
+            INSERT INTO {0}.unkeyed SELECT 'row ' || i FROM generate_series(1, 100) i""".format(schema))
+        engines.append(sqlalchemy.create_engine(target_config['url'],
+            connect_args={'options': '-csearch_path={}'.format(schema)}))
+    yield engines
+    for schema in ('o2p_source','o2p_target'):
+        engine.execute('DROP SCHEMA {} CASCADE'.format(schema))
+    for x in engines + [engine]:
+        x.dispose()
+
+
+def test_rows_outside_the_source_keys_are_found(schemas, caplog):
+    source_engine, target_engine = schemas
+    target_engine.execute("INSERT INTO keyed VALUES (-5, 'head'), (500, 'tail')")
+    metadata = sqlalchemy.MetaData()
+    tables = [sqlalchemy.Table(name,metadata,autoload=True,autoload_with=source_engine)
+        for name in ('keyed','unkeyed')]
+
+    with caplog.at_level(logging.INFO):
+        oracle2postgres._compare_fingerprints(source_engine,target_engine,tables,chunks=4)
+
+    messages = [record.getMessage() for record in caplog.records]
+    assert "None.keyed: Checksums differ for keys below 1 in columns ['*', 'id', 'name']" in messages
+    assert "None.keyed: Checksums differ for keys from 101 in columns ['*', 'id', 'name']" in messages
+    assert "None.unkeyed: No single integer primary key. Comparing checksums for the whole table." in messages
+    assert "None.unkeyed: Source and target checksums match" in messages
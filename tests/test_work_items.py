@@ -0,0 +1,109 @@
+"""
+Tests for ordering the work items of a migration largest first, and for
+splitting tables into partitions and ROWID ranges. The Oracle dictionary
+views are replaced where the SQLite stand-in has no equivalent.
+"""
+import logging
+
+import oracle2postgres
+import run_benchmark
+
+_MB = 1024 * 1024
+
+
+def _get_ranges(engine,schema,table_name,chunks):
+    return [('{}{}'.format(table_name,i),'{}{}'.format(table_name,i + 1)) for i in range(chunks)]
+
+
+def test_work_items_largest_first(source_config, monkeypatch):
+    engine = oracle2postgres.connect_to_source(source_config)
+    monkeypatch.setattr(oracle2postgres,'_get_table_sizes',
+        lambda engine, schema: {'narrow': 10, 'wide': 30, 'types': 20})
+    assert oracle2postgres._get_work_items(engine,['main']) == [('main','wide',30),
+        ('main','types',20),('main','narrow',10),('main','lobs',0),('main','sparse',0)]
+    engine.dispose()
+
+
+def test_sizes_unavailable_keeps_name_order(source_config, caplog):
+    engine = oracle2postgres.connect_to_source(source_config)
+    with caplog.at_level(logging.INFO):
+        work_items = oracle2postgres._get_work_items(engine,['main'])
+    assert work_items == [('main',x,0) for x in sorted([t[0] for t in run_benchmark.TABLES])]
+    assert 'Unable to get table sizes for main' in caplog.text
+    engine.dispose()
+
+
+def test_split_large_tables(monkeypatch):
+    monkeypatch.setattr(oracle2postgres,'_get_rowid_ranges',_get_ranges)
+    work_items = [('s','big',int(3.5 * _MB)),('s','listed',_MB // 2),('s','single',_MB // 4),
+        ('s','small',_MB // 2)]
+    config = {'split_threshold_mb': 1, 'table_chunks': {'s.listed': 2, 's.single': 1}}
+
+    # chunks of about the threshold, or the number given for the table
+    assert oracle2postgres._split_work_items(None,work_items,config) == \
+        [('s','big',int(3.5 * _MB) // 4,('big0','big1'),None),
+         ('s','big',int(3.5 * _MB) // 4,('big1','big2'),None),
+         ('s','big',int(3.5 * _MB) // 4,('big2','big3'),None),
+         ('s','big',int(3.5 * _MB) // 4,('big3','big4'),None),
+         ('s','small',_MB // 2,None,None),
+         ('s','listed',_MB // 4,('listed0','listed1'),None),
+         ('s','listed',_MB // 4,('listed1','listed2'),None),
+         ('s','single',_MB // 4,None,None)]
+
+    # without a threshold only the listed tables are split
+    config = {'split_threshold_mb': 0, 'table_chunks': {'s.listed': 2}}
+    assert [x[1] for x in oracle2postgres._split_work_items(None,work_items,config)] == \
+        ['big','small','listed','listed','single']
+
+
+def test_split_partitioned_tables(monkeypatch):
+    monkeypatch.setattr(oracle2postgres,'_get_rowid_ranges',_get_ranges)
+    monkeypatch.setattr(oracle2postgres,'_get_partitions',lambda engine, schema:
+        {'parted': {'method': 'RANGE', 'columns': ['id'],
+            'partitions': [('P1','10',2 * _MB),('P2','MAXVALUE',3 * _MB)]}})
+    work_items = [('s','PARTED',5 * _MB),('s','plain',_MB)]
+
+    config = {'split_threshold_mb': 1, 'partitions': True}
+    assert oracle2postgres._split_work_items(None,work_items,config) == [('s','PARTED',3 * _MB,None,'P2'),
+        ('s','PARTED',2 * _MB,None,'P1'),('s','plain',_MB,None,None)]
+
+    # otherwise partitioned tables are split like the others
+    config = dict(config,partitions=False)
+    assert len(oracle2postgres._split_work_items(None,work_items,config)) == 6
+
+
+def test_unsplittable_table_is_read_whole(source_config, caplog):
+    engine = oracle2postgres.connect_to_source(source_config)
+    config = {'split_threshold_mb': 1, 'partitions': True}
+    with caplog.at_level(logging.INFO):
+        split_items = oracle2postgres._split_work_items(engine,[('main','narrow',3 * _MB)],config)
+    assert split_items == [('main','narrow',3 * _MB,None,None)]
+    assert 'Unable to split main.narrow into ROWID ranges' in caplog.text
+    engine.dispose()
+
+
+def test_copy_plan_reads_each_range(source_config, monkeypatch):
+    engine = oracle2postgres.connect_to_source(source_config)
+    table = oracle2postgres._get_table(engine,'main','narrow')
+    monkeypatch.setattr(oracle2postgres,'_get_rowid_ranges',_get_ranges)
+    monkeypatch.setattr(oracle2postgres,'_get_table_stats',lambda engine, schema, table_name: (2500,100))
+
+    # one range per batch
+    queries, sizer, depth, lob_columns, ordered = oracle2postgres._get_copy_plan(engine,'main',
+        table,1000,paging='rowid')
+    assert [params for query, params in queries] == [{'lo_rowid': 'narrow{}'.format(i),
+        'hi_rowid': 'narrow{}'.format(i + 1)} for i in range(3)]
+    assert not ordered
+
+    # checkpointed ranges are sorted, and report the last ROWID of each row
+    queries, sizer, depth, lob_columns, ordered = oracle2postgres._get_copy_plan(engine,'main',
+        table,1000,checkpoint=True)
+    assert ordered and len(queries) == 1
+    assert queries[0][0].endswith(', ROWIDTOCHAR(rowid) FROM main.narrow WHERE rowid BETWEEN '
+        'CHARTOROWID(:lo_rowid) AND CHARTOROWID(:hi_rowid) ORDER BY rowid')
+
+    # a given range is read as it is
+    queries, sizer, depth, lob_columns, ordered = oracle2postgres._get_copy_plan(engine,'main',
+        table,1000,paging='rowid',rowid_range=('a','b'))
+    assert [params for query, params in queries] == [{'lo_rowid': 'a', 'hi_rowid': 'b'}]
+    engine.dispose()